@@ -0,0 +1,64 @@
+"""量測記憶體圖譜後端的寫入與 k-hop 查詢速度。
+
+建立 ``--ips`` 個 IP 節點與 ``--users`` 個使用者節點，每個 IP 隨機連到數個
+使用者，接著以整批方式查詢 1、2 跳鄰域（不經過 ``GraphRetrievalTool`` 的快取）。
+
+用法::
+
+    python benchmarks/bench_graph_retrieval.py --ips 100000 --batch 64
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from lms_log_analyzer.src.graph_backend import MemoryGraphBackend  # noqa: E402
+from lms_log_analyzer.src.graph_builder import GraphBuilder  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--ips", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--edges-per-ip", type=int, default=3)
+    parser.add_argument("--batch", type=int, default=64)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--fanout", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        builder = GraphBuilder(backend=MemoryGraphBackend(tmp, compact_every=1_000_000))
+        entities = [{"id": f"ip_{i}", "label": "IP"} for i in range(args.ips)]
+        entities += [{"id": f"user_{u}", "label": "User"} for u in range(args.users)]
+        relations = [
+            {"start_id": f"ip_{i}", "end_id": f"user_{rng.randrange(args.users)}", "type": "LOGIN_AS"}
+            for i in range(args.ips)
+            for _ in range(args.edges_per_ip)
+        ]
+        start = time.perf_counter()
+        builder.create_entities(entities)
+        builder.create_relations(relations)
+        elapsed = time.perf_counter() - start
+        print(f"write: {len(entities) + len(relations):,} items in {elapsed:.2f}s")
+
+        backend = builder.graph
+        for depth in (1, 2):
+            start = time.perf_counter()
+            for _ in range(args.queries):
+                ids = [f"ip_{rng.randrange(args.ips)}" for _ in range(args.batch)]
+                backend.neighbourhoods(ids, depth, args.fanout)
+            per_batch = (time.perf_counter() - start) / args.queries * 1000
+            print(f"depth {depth}: {per_batch:.2f} ms per batch of {args.batch} entities")
+        builder.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""量測 ``parse_record`` 對各種日誌格式的解析速度（lines/sec）。
+
+以合成的 combined、auth.log、syslog、JSON 與無法辨識的日誌行各自重複解析，
+並與原本以 Grok 為主的 ``parse_line`` 比較。
+
+用法::
+
+    python benchmarks/bench_log_parser.py --lines 200000
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from lms_log_analyzer.src import log_parser  # noqa: E402
+
+SAMPLES = {
+    "combined": '10.0.{a}.{b} - - [01/Jan/2024:00:00:{s:02d} +0000] "GET /index.php?id={a} HTTP/1.1" '
+                '200 512 "-" "Mozilla/5.0" resp_time:0.{b}',
+    "auth": 'Jan  1 00:00:{s:02d} web sshd[{a}]: Failed password for invalid user u{b} from 10.1.{a}.{b} port 22 ssh2',
+    "syslog": 'Jan  1 00:00:{s:02d} web kernel: [UFW BLOCK] IN=eth0 SRC=10.2.{a}.{b} DST=10.0.0.1 PROTO=TCP',
+    "json": '{{"@timestamp": "2024-01-01T00:00:{s:02d}Z", "client_ip": "10.3.{a}.{b}", "status": 404, '
+            '"path": "/p{a}", "method": "GET"}}',
+    "raw": 'worker {a} failed job {b} after retries',
+}
+
+
+def make_lines(template: str, n: int):
+    return [template.format(a=i % 250, b=(i * 7) % 250, s=i % 60) for i in range(n)]
+
+
+def bench(func, lines) -> float:
+    start = time.perf_counter()
+    for line in lines:
+        func(line)
+    return len(lines) / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lines", type=int, default=50000)
+    args = parser.parse_args()
+
+    print(f"{'format':<10} {'parse_record':>14} {'parse_line':>12}")
+    for name, template in SAMPLES.items():
+        lines = make_lines(template, args.lines)
+        fast = bench(log_parser.parse_record, lines)
+        grok = bench(log_parser.parse_line, lines) if log_parser.APACHE_GROK is not None else float("nan")
+        print(f"{name:<10} {fast:>14,.0f} {grok:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
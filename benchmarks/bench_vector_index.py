@@ -0,0 +1,100 @@
+"""比較不同 FAISS 索引類型的 recall@k 與單筆查詢延遲。
+
+以合成的叢集向量模擬日誌嵌入，對每種索引類型建立 ``SimpleVectorDB``，
+等待背景 IVF 訓練完成後，以 flat 索引的結果作為基準計算 recall@k。
+
+用法::
+
+    python benchmarks/bench_vector_index.py --sizes 100000 1000000 --dim 384
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from lms_log_analyzer.src.vector_db import SimpleVectorDB  # noqa: E402
+
+
+def make_data(n: int, dim: int, queries: int, seed: int = 0):
+    """產生以高斯叢集分佈的資料集與查詢向量。"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(16, n // 1000), dim)).astype("float32")
+    assign = rng.integers(0, len(centers), n)
+    base = centers[assign] + 0.3 * rng.standard_normal((n, dim)).astype("float32")
+    picks = rng.integers(0, n, queries)
+    query = base[picks] + 0.05 * rng.standard_normal((queries, dim)).astype("float32")
+    return base.astype("float32"), query.astype("float32")
+
+
+def ground_truth(base: np.ndarray, query: np.ndarray, k: int) -> np.ndarray:
+    index = faiss.IndexFlatL2(base.shape[1])
+    index.add(base)
+    _, ids = index.search(query, k)
+    return ids
+
+
+def run(index_type: str, base: np.ndarray, query: np.ndarray, truth: np.ndarray, k: int, nlist: int):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = SimpleVectorDB(
+            Path(tmpdir) / "bench.index",
+            Path(tmpdir) / "cases",
+            index_type=index_type,
+            nlist=nlist,
+            train_min=min(len(base), 39 * nlist),
+        )
+        start = time.perf_counter()
+        for chunk in range(0, len(base), 50_000):
+            part = base[chunk:chunk + 50_000]
+            db.add(part, [{}] * len(part))
+        db.wait_for_migration()
+        build = time.perf_counter() - start
+
+        latencies = []
+        hits = 0
+        for q, expected in zip(query, truth):
+            t0 = time.perf_counter()
+            ids, _ = db.search(q, k=k)
+            latencies.append(time.perf_counter() - t0)
+            hits += len(set(ids) & set(expected.tolist()))
+    lat = np.array(latencies) * 1000
+    return {
+        "build_s": build,
+        "recall": hits / truth.size,
+        "p50_ms": float(np.percentile(lat, 50)),
+        "p95_ms": float(np.percentile(lat, 95)),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--types", nargs="+", default=["flat", "ivf_flat", "ivf_pq", "hnsw"])
+    args = parser.parse_args()
+
+    print(f"{'size':>9} {'index':>9} {'build(s)':>9} {'recall@k':>9} {'p50(ms)':>8} {'p95(ms)':>8}")
+    for n in args.sizes:
+        base, query = make_data(n, args.dim, args.queries)
+        truth = ground_truth(base, query, args.k)
+        nlist = int(4 * np.sqrt(n))
+        for index_type in args.types:
+            res = run(index_type, base, query, truth, args.k, nlist)
+            print(
+                f"{n:>9} {index_type:>9} {res['build_s']:>9.1f} {res['recall']:>9.3f} "
+                f"{res['p50_ms']:>8.3f} {res['p95_ms']:>8.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
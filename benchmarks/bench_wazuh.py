@@ -0,0 +1,65 @@
+"""量測 Wazuh logtest 階段的吞吐量（lines/sec）。
+
+以 ``tests/mock_wazuh.py`` 在本機啟動模擬伺服器並加入固定延遲，比較：
+逐行以新連線送出（舊版作法）、共用連線池並行送出，以及結果快取命中時的速度。
+
+用法::
+
+    python benchmarks/bench_wazuh.py --lines 500 --latency 0.01 --concurrency 8
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from lms_log_analyzer.src import wazuh_api  # noqa: E402
+from tests.mock_wazuh import MockWazuh  # noqa: E402
+
+
+def per_line(url: str, lines) -> None:
+    """舊版行為：每行各自認證並開新連線。"""
+    for line in lines:
+        token = requests.post(f"{url}/security/user/authenticate", auth=("wazuh", "secret"), timeout=5).json()
+        requests.put(
+            f"{url}/logtest",
+            json={"event": line},
+            headers={"Authorization": f"Bearer {token['data']['token']}"},
+            timeout=5,
+        )
+
+
+def rate(func, lines) -> float:
+    start = time.perf_counter()
+    func(lines)
+    return len(lines) / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lines", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.01, help="simulated server latency per request (sec)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    lines = [f"Jan  1 00:00:00 web sshd[{i}]: Failed password for u{i} from 10.0.{i % 250}.1" for i in range(args.lines)]
+    with MockWazuh(latency=args.latency) as server:
+        client = wazuh_api.WazuhClient(server.url, "wazuh", "secret", max_concurrency=args.concurrency)
+        try:
+            print(f"{'mode':<12} {'lines/sec':>12}")
+            print(f"{'per-line':<12} {rate(lambda ls: per_line(server.url, ls), lines):>12,.0f}")
+            print(f"{'pooled':<12} {rate(client.logtest_many, lines):>12,.0f}")
+            print(f"{'cached':<12} {rate(client.logtest_many, lines):>12,.0f}")
+            print(f"connections={server.counts['connections']} authentications={server.counts['authentications']}")
+        finally:
+            client.close()
+
+
+if __name__ == "__main__":
+    main()
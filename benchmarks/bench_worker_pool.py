@@ -0,0 +1,66 @@
+"""比較單一行程與多行程 worker pool 的過濾、評分與解析吞吐量（lines/sec）。
+
+以合成的 combined 與 auth.log 日誌行組成一批，分別直接呼叫規則引擎與
+``parse_record``，以及透過 :class:`~lms_log_analyzer.src.worker_pool.CpuPool`
+分片處理。
+
+用法::
+
+    python benchmarks/bench_worker_pool.py --lines 200000 --workers 8 --cpus 0-7
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from lms_log_analyzer.src import log_parser, worker_pool  # noqa: E402
+from lms_log_analyzer.src.rule_engine import RULE_ENGINE  # noqa: E402
+
+TEMPLATES = [
+    '10.0.{a}.{b} - - [01/Jan/2024:00:00:00 +0000] "GET /etc/passwd?id={a} HTTP/1.1" 404 512 "-" "nmap" resp_time:0.{b}',
+    'Jan  1 00:00:00 web sshd[{a}]: Failed password for invalid user u{b} from 10.1.{a}.{b} port 22 ssh2',
+]
+
+
+def make_lines(n: int):
+    return [TEMPLATES[i % len(TEMPLATES)].format(a=i % 250, b=(i * 7) % 250) for i in range(n)]
+
+
+def rate(func, lines) -> float:
+    start = time.perf_counter()
+    func(lines)
+    return len(lines) / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lines", type=int, default=100000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--cpus", default="", help='core list to pin workers to, e.g. "0-7"')
+    args = parser.parse_args()
+
+    lines = make_lines(args.lines)
+    pool = worker_pool.CpuPool(workers=args.workers, cpus=worker_pool.parse_cpu_list(args.cpus))
+    # 先送一批讓子行程啟動並載入規則，不列入計時
+    pool.score_batch(lines[: pool.min_shard * args.workers])
+    jobs = {
+        "filter": (RULE_ENGINE.filter_mask, pool.filter_mask),
+        "score": (RULE_ENGINE.score_batch, pool.score_batch),
+        "parse": (lambda ls: [log_parser.parse_record(l) for l in ls], pool.parse_records),
+    }
+    print(f"{'job':<8} {'single':>12} {f'pool x{args.workers}':>12}")
+    try:
+        for name, (single, pooled) in jobs.items():
+            print(f"{name:<8} {rate(single, lines):>12,.0f} {rate(pooled, lines):>12,.0f}")
+    finally:
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -19,8 +19,30 @@ EMBED_MODEL_NAME = os.getenv(
     "LMS_EMBED_MODEL",
     "sentence-transformers/all-MiniLM-L6-v2",
 )
+# 句向量快取容量（以正規化後的日誌行雜湊為鍵）與單次送入模型的批次大小
+EMBED_CACHE_SIZE = int(os.getenv("LMS_EMBED_CACHE_SIZE", 50_000))
+EMBED_BATCH_SIZE = int(os.getenv("LMS_EMBED_BATCH_SIZE", 64))
+# 向量索引類型：flat（暴力搜尋）、ivf_flat、ivf_pq 或 hnsw。
+# IVF 類型會先使用 flat 索引，向量數達 ``IVF_TRAIN_MIN`` 後於背景訓練並遷移。
+VECTOR_INDEX_TYPE = os.getenv("LMS_VECTOR_INDEX_TYPE", "flat").lower()
+IVF_NLIST = int(os.getenv("LMS_IVF_NLIST", 256))
+IVF_TRAIN_MIN = int(os.getenv("LMS_IVF_TRAIN_MIN", 39 * IVF_NLIST))
+IVF_NPROBE = int(os.getenv("LMS_IVF_NPROBE", 16))
+# IVF-PQ 子向量數，必須能整除嵌入維度
+IVF_PQ_M = int(os.getenv("LMS_IVF_PQ_M", 16))
+HNSW_M = int(os.getenv("LMS_HNSW_M", 32))
+HNSW_EF_CONSTRUCTION = int(os.getenv("LMS_HNSW_EF_CONSTRUCTION", 80))
+HNSW_EF_SEARCH = int(os.getenv("LMS_HNSW_EF_SEARCH", 64))
 # 儲存每筆向量對應的歷史案例（包含原始日誌與分析結果）
+# ``CASE_DB_PATH`` 為舊版整份 JSON 格式，僅於首次啟動時匯入 append-only 案例庫
 CASE_DB_PATH = DATA_DIR / "cases.json"
+CASE_STORE_DIR = Path(os.getenv("LMS_CASE_STORE_DIR", DATA_DIR / "cases"))
+CASE_SEGMENT_BYTES = int(os.getenv("LMS_CASE_SEGMENT_BYTES", 64 * 1024 * 1024))
+# 累積多少筆新向量後將完整 FAISS 索引寫回磁碟（其間新向量僅附加至 delta 檔）
+INDEX_CHECKPOINT_EVERY = int(os.getenv("LMS_INDEX_CHECKPOINT_EVERY", 10_000))
+# 背景持久化：距上次變更超過秒數或累積變更筆數達上限時寫入狀態與向量資料
+PERSIST_INTERVAL_SEC = float(os.getenv("LMS_PERSIST_INTERVAL_SEC", 30))
+PERSIST_MAX_DIRTY = int(os.getenv("LMS_PERSIST_MAX_DIRTY", 1000))
 # 已標註向量資料集，用於後續模型訓練
 LABELED_DATA_FILE = DATA_DIR / "labeled_dataset.jsonl"
 
@@ -32,14 +54,75 @@ DEFAULT_OPERATIONAL_LOG_FILE = BASE_DIR / "analyzer_script.log"
 LMS_TARGET_LOG_DIR = Path(os.getenv("LMS_TARGET_LOG_DIR", DEFAULT_TARGET_LOG_DIR))
 LMS_ANALYSIS_OUTPUT_FILE = Path(os.getenv("LMS_ANALYSIS_OUTPUT_FILE", DEFAULT_ANALYSIS_OUTPUT_FILE))
 LMS_OPERATIONAL_LOG_FILE = Path(os.getenv("LMS_OPERATIONAL_LOG_FILE", str(DEFAULT_OPERATIONAL_LOG_FILE)))
+# 直接讀取日誌檔時符合的檔名樣式、每次讀取的位元組數與每批送入分析的行數
+LOG_FILE_PATTERNS = [p for p in os.getenv("LMS_LOG_FILE_PATTERNS", "*.log,*.log.*,*.gz,*.bz2").split(",") if p]
+FILE_READ_CHUNK_BYTES = int(os.getenv("LMS_FILE_READ_CHUNK_BYTES", 1024 * 1024))
+FILE_BATCH_LINES = int(os.getenv("LMS_FILE_BATCH_LINES", 1000))
+# follow 模式：監看方式（auto 優先使用 inotify，poll 強制以 stat 輪詢）、
+# 輪詢間隔，以及未滿一批時最長等待秒數
+FOLLOW_WATCHER = os.getenv("LMS_FOLLOW_WATCHER", "auto").lower()
+FOLLOW_POLL_INTERVAL_SEC = float(os.getenv("LMS_FOLLOW_POLL_INTERVAL_SEC", 0.25))
+FOLLOW_BATCH_MAX_WAIT_SEC = float(os.getenv("LMS_FOLLOW_BATCH_MAX_WAIT_SEC", 0.5))
+# 批次處理失敗時自上次完成的檢查點重讀，重試間隔由 1 秒逐次加倍至此上限
+FOLLOW_RETRY_MAX_SEC = float(os.getenv("LMS_FOLLOW_RETRY_MAX_SEC", 30))
+# 分段非同步管線：main.py 是否預設使用、階段之間的佇列容量（批次數），
+# 以及各階段的 worker 數（例如 "llm=8,graph=2"，未列出者為 1）
+PIPELINE_ENABLED = os.getenv("LMS_PIPELINE_ENABLED", "false").lower() in ("1", "true", "yes")
+PIPELINE_QUEUE_SIZE = int(os.getenv("LMS_PIPELINE_QUEUE_SIZE", 4))
+PIPELINE_CONCURRENCY = {
+    "wazuh": 2, "embed": 2, "graph": 2, "llm": 4,
+    **{
+        name.strip(): max(1, int(value))
+        for name, _, value in (part.partition("=") for part in os.getenv("LMS_PIPELINE_CONCURRENCY", "").split(","))
+        if name.strip() and value.strip().isdigit()
+    },
+}
+# 多行程 CPU worker pool：子行程數（0 或 1 表示不啟用）、綁定的核心清單
+# （例如 "2-31"，空字串不綁定）、分片的最少行數與子行程啟動方式。
+# 每批切成 min(子行程數, 行數 // 分片最少行數) 片，預設一批 FILE_BATCH_LINES
+# （1000）行可分給最多 15 個子行程；不足兩片的批次直接在本行程計算
+CPU_WORKERS = int(os.getenv("LMS_CPU_WORKERS", 0))
+CPU_AFFINITY = os.getenv("LMS_CPU_AFFINITY", "")
+CPU_POOL_MIN_SHARD = int(os.getenv("LMS_CPU_POOL_MIN_SHARD", 64))
+CPU_POOL_START_METHOD = os.getenv("LMS_CPU_POOL_START_METHOD", "spawn")
 
 # 下列參數控制取樣比例、批次大小與成本上限，可依環境需求調整。
 CACHE_SIZE = int(os.getenv("LMS_CACHE_SIZE", 10_000))
+# LLM 判定快取的有效秒數與磁碟層 SQLite 路徑（設為空字串則僅使用記憶體）
+VERDICT_CACHE_TTL_SEC = int(os.getenv("LMS_VERDICT_CACHE_TTL_SEC", 24 * 3600))
+VERDICT_CACHE_PATH = os.getenv("LMS_VERDICT_CACHE_PATH", str(DATA_DIR / "verdict_cache.sqlite3"))
+# 啟發式評分規則（過濾關鍵字、加權特徵與狀態碼門檻）設定檔
+RULES_FILE = Path(os.getenv("LMS_RULES_FILE", Path(__file__).resolve().parent / "rules.json"))
+# Drain 樣板探勘：每批日誌中同一樣板只分析一筆代表行，判定再套用到其他成員
+TEMPLATE_MINING_ENABLED = os.getenv("LMS_TEMPLATE_MINING_ENABLED", "true").lower() in ("1", "true", "yes")
+TEMPLATE_TREE_DEPTH = int(os.getenv("LMS_TEMPLATE_TREE_DEPTH", 4))
+TEMPLATE_SIM_THRESHOLD = float(os.getenv("LMS_TEMPLATE_SIM_THRESHOLD", 0.5))
+TEMPLATE_MAX_CHILDREN = int(os.getenv("LMS_TEMPLATE_MAX_CHILDREN", 100))
+TEMPLATE_MAX_CLUSTERS = int(os.getenv("LMS_TEMPLATE_MAX_CLUSTERS", 50_000))
+# 來源實體（IP／使用者）視窗彙總：視窗內事件數達門檻時整段爆量只送出一筆 session 告警
+SESSION_ENABLED = os.getenv("LMS_SESSION_ENABLED", "true").lower() in ("1", "true", "yes")
+SESSION_WINDOW_MODE = os.getenv("LMS_SESSION_WINDOW_MODE", "sliding").lower()
+SESSION_WINDOW_SEC = float(os.getenv("LMS_SESSION_WINDOW_SEC", 60))
+SESSION_BURST_THRESHOLD = int(os.getenv("LMS_SESSION_BURST_THRESHOLD", 20))
+SESSION_IDLE_SEC = float(os.getenv("LMS_SESSION_IDLE_SEC", 300))
+SESSION_MAX_KEYS = int(os.getenv("LMS_SESSION_MAX_KEYS", 100_000))
+SESSION_MAX_SAMPLES = int(os.getenv("LMS_SESSION_MAX_SAMPLES", 5))
 SAMPLE_TOP_PERCENT = int(os.getenv("LMS_SAMPLE_TOP_PERCENT", 20))
 BATCH_SIZE = int(os.getenv("LMS_LLM_BATCH_SIZE", 10))
 MAX_HOURLY_COST_USD = float(os.getenv("LMS_MAX_HOURLY_COST_USD", 5.0))
 PRICE_IN_PER_1K_TOKENS = float(os.getenv("LMS_PRICE_IN_PER_1K_TOKENS", 0.000125))
 PRICE_OUT_PER_1K_TOKENS = float(os.getenv("LMS_PRICE_OUT_PER_1K_TOKENS", 0.000375))
+# 單則提示（日誌、相似案例與子圖脈絡）的 token 預算與各段長度上限
+PROMPT_TOKEN_BUDGET = int(os.getenv("LMS_PROMPT_TOKEN_BUDGET", 1500))
+PROMPT_LOG_MAX_CHARS = int(os.getenv("LMS_PROMPT_LOG_MAX_CHARS", 2000))
+PROMPT_MAX_EXAMPLES = int(os.getenv("LMS_PROMPT_MAX_EXAMPLES", 3))
+PROMPT_EXAMPLE_MAX_CHARS = int(os.getenv("LMS_PROMPT_EXAMPLE_MAX_CHARS", 300))
+# 最近一小時花費超過預算的此比例後開始縮減取樣數；因預算延後的候選最多保留筆數
+COST_SOFT_LIMIT_RATIO = float(os.getenv("LMS_COST_SOFT_LIMIT_RATIO", 0.5))
+COST_BACKLOG_MAX = int(os.getenv("LMS_COST_BACKLOG_MAX", 10_000))
+# 每批最多自延後佇列補入的項目數，避免預算恢復時一次送出整個佇列
+COST_DRAIN_PER_BATCH = int(os.getenv("LMS_COST_DRAIN_PER_BATCH", 50))
+# 沿用最近鄰案例判定的距離門檻（一般 L2 距離，非 FAISS 回傳的平方值）
 SIM_T_ATTACK_L2_THRESHOLD = float(os.getenv("LMS_SIM_T_ATTACK_L2_THRESHOLD", 0.3))
 SIM_N_NORMAL_L2_THRESHOLD = float(os.getenv("LMS_SIM_N_NORMAL_L2_THRESHOLD", 0.2))
 
@@ -47,17 +130,50 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 # 可相容使用新的 GOOGLE_API_KEY 環境變數
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY", GEMINI_API_KEY)
 LLM_MODEL_NAME = os.getenv("LMS_LLM_MODEL_NAME", "gemini-1.5-flash-latest")
+# LLM 併發呼叫上限、每分鐘請求數上限（0 表示不限制）與 429/5xx 重試設定
+LLM_MAX_CONCURRENCY = int(os.getenv("LMS_LLM_MAX_CONCURRENCY", 4))
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LMS_LLM_REQUESTS_PER_MINUTE", 600))
+LLM_MAX_RETRIES = int(os.getenv("LMS_LLM_MAX_RETRIES", 3))
+LLM_RETRY_BASE_DELAY_SEC = float(os.getenv("LMS_LLM_RETRY_BASE_DELAY_SEC", 1.0))
 
 # Wazuh API 整合設定，若三項皆存在，處理流程會先透過 Wazuh 篩選可疑日誌。
 WAZUH_API_URL = os.getenv("WAZUH_API_URL")
 WAZUH_API_USER = os.getenv("WAZUH_API_USER")
 WAZUH_API_PASSWORD = os.getenv("WAZUH_API_PASSWORD")
 WAZUH_ENABLED = bool(WAZUH_API_URL and WAZUH_API_USER and WAZUH_API_PASSWORD)
+# logtest 並行請求數（亦為連線池大小）、單次請求逾時秒數與是否驗證 TLS 憑證
+WAZUH_MAX_CONCURRENCY = int(os.getenv("LMS_WAZUH_MAX_CONCURRENCY", 8))
+WAZUH_TIMEOUT_SEC = float(os.getenv("LMS_WAZUH_TIMEOUT_SEC", 5))
+WAZUH_VERIFY_SSL = os.getenv("LMS_WAZUH_VERIFY_SSL", "true").lower() in ("1", "true", "yes")
+WAZUH_LOG_FORMAT = os.getenv("LMS_WAZUH_LOG_FORMAT", "syslog")
+# JWT 無法解析到期時間時的有效秒數（Wazuh 預設 900 秒）
+WAZUH_TOKEN_TTL_SEC = float(os.getenv("LMS_WAZUH_TOKEN_TTL_SEC", 900))
+# logtest 結果快取（以正規化後的日誌行為鍵）的容量與有效秒數
+WAZUH_CACHE_SIZE = int(os.getenv("LMS_WAZUH_CACHE_SIZE", 50_000))
+WAZUH_CACHE_TTL_SEC = float(os.getenv("LMS_WAZUH_CACHE_TTL_SEC", 3600))
 
 # Neo4j connection settings (optional)
 NEO4J_URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
 NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
 NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "test1234")
+# 圖譜後端："neo4j"（預設）或 "memory"（行程內圖譜，保存於 GRAPH_MEMORY_DIR）
+GRAPH_BACKEND = os.getenv("LMS_GRAPH_BACKEND", "neo4j").lower()
+GRAPH_MEMORY_DIR = Path(os.getenv("LMS_GRAPH_MEMORY_DIR", DATA_DIR / "graph"))
+# 記憶體圖譜的異動紀錄累積此筆數後寫出新快照
+GRAPH_MEMORY_COMPACT_EVERY = int(os.getenv("LMS_GRAPH_MEMORY_COMPACT_EVERY", 1000))
+# 圖譜批次寫入：背景佇列上限、單批最多節點加關係數與最長等待秒數
+GRAPH_WRITE_QUEUE_MAX = int(os.getenv("LMS_GRAPH_WRITE_QUEUE_MAX", 10_000))
+GRAPH_WRITE_BATCH_SIZE = int(os.getenv("LMS_GRAPH_WRITE_BATCH_SIZE", 1000))
+GRAPH_WRITE_FLUSH_SEC = float(os.getenv("LMS_GRAPH_WRITE_FLUSH_SEC", 2.0))
+# 寫入失敗的批次保留並併入下次寫入，最多重試次數與退避上限秒數；超過後捨棄並計數
+GRAPH_WRITE_MAX_RETRIES = int(os.getenv("LMS_GRAPH_WRITE_MAX_RETRIES", 5))
+GRAPH_WRITE_RETRY_MAX_SEC = float(os.getenv("LMS_GRAPH_WRITE_RETRY_MAX_SEC", 30.0))
+# 啟動時額外建立 id 索引的節點標籤（所有節點皆另有 Entity.id 唯一性約束）
+GRAPH_INDEXED_LABELS = [l for l in os.getenv("LMS_GRAPH_INDEXED_LABELS", "IP,User,Host").split(",") if l]
+# 子圖查詢：k-hop 鄰域快取容量與有效秒數，以及每個實體最多展開的路徑數
+GRAPH_CACHE_SIZE = int(os.getenv("LMS_GRAPH_CACHE_SIZE", 10_000))
+GRAPH_CACHE_TTL_SEC = float(os.getenv("LMS_GRAPH_CACHE_TTL_SEC", 300))
+GRAPH_RETRIEVAL_FANOUT = int(os.getenv("LMS_GRAPH_RETRIEVAL_FANOUT", 50))
 
 # OpenSearch 連線設定
 OPENSEARCH_HOST = os.getenv("OPENSEARCH_HOST", "localhost")
@@ -66,9 +182,23 @@ OPENSEARCH_PASSWORD = os.getenv("OPENSEARCH_PASSWORD", "admin")
 
 # Construct OpenSearch URL from components
 OPENSEARCH_URL = os.getenv("OPENSEARCH_URL", f"http://{OPENSEARCH_HOST}:9200")
+# 輪詢的索引樣式、每頁筆數與 point-in-time 保留時間
+OPENSEARCH_INDEX = os.getenv("LMS_OPENSEARCH_INDEX", "filebeat-*")
+OPENSEARCH_PAGE_SIZE = int(os.getenv("LMS_OPENSEARCH_PAGE_SIZE", 500))
+OPENSEARCH_PIT_KEEP_ALIVE = os.getenv("LMS_OPENSEARCH_PIT_KEEP_ALIVE", "2m")
+# 單次輪詢最多讀取的頁數；達上限表示仍有積壓，主迴圈會立即再次輪詢
+OPENSEARCH_MAX_PAGES = int(os.getenv("LMS_OPENSEARCH_MAX_PAGES", 20))
+# 每隔此秒數由頭掃描一次未完成的文件，補上時間戳早於游標的延遲文件與回寫失敗的文件
+OPENSEARCH_SWEEP_INTERVAL_SEC = int(os.getenv("LMS_OPENSEARCH_SWEEP_INTERVAL_SEC", 300))
 
-# Polling interval for main.py loop (in seconds)
+# 水平擴充：共 ``WORKER_COUNT`` 個消費者以 PIT ``slice`` 分割文件，本程序負責 ``WORKER_ID``
+WORKER_ID = int(os.getenv("LMS_WORKER_ID", 0))
+WORKER_COUNT = int(os.getenv("LMS_WORKER_COUNT", 1))
+
+# Polling interval for main.py loop (in seconds). 閒置時輪詢間隔由
+# ``POLL_MIN_INTERVAL_SEC`` 逐次加倍，最長為 ``POLL_INTERVAL_SEC``。
 POLL_INTERVAL_SEC = int(os.getenv("POLL_INTERVAL_SEC", 30))
+POLL_MIN_INTERVAL_SEC = float(os.getenv("LMS_POLL_MIN_INTERVAL_SEC", 1))
 
 # 確保必要的目錄存在，避免首次執行時因目錄缺失而出錯。
 DATA_DIR.mkdir(parents=True, exist_ok=True)
@@ -1,8 +1,12 @@
 from __future__ import annotations
 """程式入口點
 
-此版本會持續輪詢 OpenSearch，將新日誌交由 ``log_processor`` 處理。"""
+此版本會持續輪詢 OpenSearch，將新日誌交由 ``log_processor`` 處理。
+可同時啟動多個程序並以 ``--workers``／``--worker-id`` 分割文件。
+沒有 Filebeat 的感測器可改用 ``--follow`` 直接追蹤 ``LMS_TARGET_LOG_DIR``；
+``--pipeline`` 讓查詢、分析與回寫以分段管線重疊執行。"""
 
+import argparse
 import logging
 import sys
 from pathlib import Path
@@ -12,7 +16,6 @@ from time import sleep
 sys.path.insert(0, str(Path(__file__).parent))
 
 import config
-from src import log_processor
 from src.utils import logger
 
 # 統一設定 logging handler
@@ -30,17 +33,74 @@ logging.basicConfig(
 )
 
 
-def main() -> None:
+def next_delay(previous: float, processed: int, has_more: bool) -> float:
+    """計算下次輪詢前的等待秒數。
+
+    仍有積壓時立即輪詢；有新資料時回到最短間隔；閒置時逐次加倍，
+    最長為 ``POLL_INTERVAL_SEC``。
+    """
+    if has_more:
+        return 0.0
+    if processed:
+        return config.POLL_MIN_INTERVAL_SEC
+    return min(max(previous * 2, config.POLL_MIN_INTERVAL_SEC), config.POLL_INTERVAL_SEC)
+
+
+def _parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="LMS log analyzer OpenSearch consumer")
+    parser.add_argument("--worker-id", type=int, default=config.WORKER_ID,
+                        help="index of this worker, 0 <= id < workers (LMS_WORKER_ID)")
+    parser.add_argument("--workers", type=int, default=config.WORKER_COUNT,
+                        help="total number of consumer processes (LMS_WORKER_COUNT)")
+    parser.add_argument("--follow", action="store_true",
+                        help="tail log files directly instead of polling OpenSearch")
+    parser.add_argument("--log-dir", type=Path, default=config.LMS_TARGET_LOG_DIR,
+                        help="directory watched in --follow mode (LMS_TARGET_LOG_DIR)")
+    parser.add_argument("--pipeline", action=argparse.BooleanOptionalAction, default=config.PIPELINE_ENABLED,
+                        help="overlap fetching, analysis and write-back as a staged pipeline (LMS_PIPELINE_ENABLED)")
+    args = parser.parse_args(argv)
+    if not 0 <= args.worker_id < max(1, args.workers):
+        parser.error("--worker-id must be between 0 and --workers - 1")
+    return args
+
+
+def main(argv=None) -> None:
     """Main polling loop."""
-    logger.info("Starting OpenSearch polling loop")
+    # CPU worker pool 以 spawn 啟動的子行程會重新匯入此檔；處理模組在此才載入，
+    # 子行程因此不會建立圖譜、向量庫等單例或註冊其結束時的寫入
+    from src import log_processor
+
+    args = _parse_args(argv)
+    if args.follow:
+        logger.info("Following log files in %s", args.log_dir)
+        delay = config.POLL_MIN_INTERVAL_SEC
+        while True:
+            try:
+                log_processor.follow_logs(args.log_dir, pipelined=args.pipeline)
+                return
+            except KeyboardInterrupt:
+                logger.info("Follow mode stopped")
+                return
+            except Exception as exc:
+                # 重新開始時自 ``STATE`` 中已完成的檢查點繼續，失敗的批次會再讀一次
+                logger.error("Follow mode failed, restarting from the last checkpoint: %s", exc)
+            sleep(delay)
+            delay = min(delay * 2, config.FOLLOW_RETRY_MAX_SEC)
+    logger.info("Starting OpenSearch polling loop as worker %d/%d", args.worker_id, args.workers)
+    delay = config.POLL_MIN_INTERVAL_SEC
     while True:
+        processed, has_more = 0, False
         try:
-            count = log_processor.process_new_logs()
-            if count:
-                logger.info("Processed %d new logs", count)
+            processed, has_more = log_processor.poll_opensearch(
+                worker_id=args.worker_id, workers=args.workers, pipelined=args.pipeline
+            )
+            if processed:
+                logger.info("Processed %d new logs", processed)
         except Exception as exc:  # pragma: no cover - log unexpected errors
             logger.error("Error processing logs: %s", exc)
-        sleep(config.POLL_INTERVAL_SEC)
+        delay = next_delay(delay, processed, has_more)
+        if delay:
+            sleep(delay)
 
 
 if __name__ == "__main__":
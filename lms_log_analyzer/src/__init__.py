@@ -1,14 +1,12 @@
 """
 lms_log_analyzer 套件初始化。
 
-僅匯入輕量模組以避免拉入額外依賴，方便單元測試執行。
+僅匯入輕量模組以避免拉入額外依賴，方便單元測試執行。子模組於第一次
+存取時才載入：``log_processor`` 匯入時會建立圖譜、向量庫等單例，CPU
+worker pool 的子行程只需要規則與解析模組，不應連帶建立這些單例。
 """
 
-from . import log_parser
-from . import log_processor
-from . import utils
-from . import graph_builder
-from . import graph_retrieval_tool
+from importlib import import_module
 
 __all__ = [
     "log_parser",
@@ -17,3 +15,9 @@ __all__ = [
     "graph_builder",
     "graph_retrieval_tool",
 ]
+
+
+def __getattr__(name):
+    if name in __all__:
+        return import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
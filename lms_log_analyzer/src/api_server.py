@@ -1,16 +1,31 @@
 from __future__ import annotations
 """提供日誌分析 API 的 FastAPI 服務。"""
 
-from typing import List
+from typing import Dict, List, Sequence
 
 from fastapi import FastAPI
 from pydantic import BaseModel
 
-from .log_processor import analyse_lines
-from .utils import save_state, STATE
-from .vector_db import VECTOR_DB, embed
+from .log_processor import (
+    analyse_lines_async,
+    build_pipeline,
+    CPU_POOL,
+    GRAPH_BUILDER,
+    GRAPH_RETRIEVER,
+    GRAPH_WRITER,
+    PIPELINE_STATS,
+)
+from .cost_tracker import COST_TRACKER
+from .persistence import PERSISTENCE
+from .prompt_builder import PROMPT_STATS
+from .sessionizer import SESSIONIZER
+from .vector_db import VECTOR_DB, embed_many
+from .verdict_cache import VERDICT_CACHE
+from .wazuh_api import WAZUH_CLIENT
 
 app = FastAPI()
+# 各請求的批次共用同一條管線，LLM 等待期間其他請求的前處理可同時進行
+PIPELINE = build_pipeline()
 
 
 class Logs(BaseModel):
@@ -27,6 +42,27 @@ class InvestigateQuery(BaseModel):
     top_k: int = 5
 
 
+class InvestigateBatchQuery(BaseModel):
+    """``/investigate/batch`` 端點的查詢格式。"""
+
+    logs: List[str]
+    top_k: int = 5
+
+
+def _matches(ids: Sequence[int], dists: Sequence[float]) -> List[Dict]:
+    """將單列搜尋結果轉換為案例與距離列表，略過補位值與已不存在的案例。
+
+    ``kind`` 為 ``"log"``（原始日誌）或 ``"session"``（爆量 session 的彙總）。
+    """
+    cases = VECTOR_DB.get_cases([int(i) for i in ids])
+    return [
+        {"log": c.get("log", c.get("line")), "kind": c.get("kind", "log"), "analysis": c.get("analysis"),
+         "distance": float(d)}
+        for c, d in zip(cases, dists)
+        if c is not None
+    ]
+
+
 @app.post("/analyze/logs")
 async def analyze_logs(payload: Logs):
     """分析日誌並回傳結構化結果。
@@ -42,24 +78,61 @@ async def analyze_logs(payload: Logs):
         每條選定日誌的分析結果列表。
     """
 
-    return analyse_lines(payload.logs)
+    await PIPELINE.start()
+    return await analyse_lines_async(PIPELINE, payload.logs)
 
 
 @app.post("/investigate")
 async def investigate_log(query: InvestigateQuery):
     """搜尋與指定日誌相似的歷史案例。"""
 
-    vec = embed(query.log)
-    ids, dists = VECTOR_DB.search(vec, k=query.top_k)
-    cases = VECTOR_DB.get_cases(ids)
+    vecs = embed_many([query.log])
+    ids, dists = VECTOR_DB.search_many(vecs, k=query.top_k)
+    return _matches(ids[0], dists[0])
+
+
+@app.post("/investigate/batch")
+async def investigate_logs(query: InvestigateBatchQuery):
+    """一次搜尋多筆日誌的相似歷史案例，所有查詢合併為單次向量搜尋。"""
+
+    if not query.logs:
+        return []
+    vecs = embed_many(query.logs)
+    ids, dists = VECTOR_DB.search_many(vecs, k=query.top_k)
     return [
-        {"log": c.get("log"), "analysis": c.get("analysis"), "distance": d}
-        for c, d in zip(cases, dists)
+        {"log": log, "matches": _matches(row_ids, row_dists)}
+        for log, row_ids, row_dists in zip(query.logs, ids, dists)
     ]
 
 
+@app.get("/stats")
+async def stats():
+    """回傳處理流程的快取與成本相關統計。"""
+
+    return {
+        "pipeline": dict(PIPELINE_STATS),
+        "verdict_cache": VERDICT_CACHE.stats(),
+        "persistence": PERSISTENCE.stats(),
+        "sessions": SESSIONIZER.stats(),
+        "llm_cost": COST_TRACKER.stats(),
+        "prompts": PROMPT_STATS.stats(),
+        "graph_writer": GRAPH_WRITER.stats(),
+        "graph_cache": GRAPH_RETRIEVER.stats(),
+        "pipeline_stages": PIPELINE.stats(),
+        "cpu_pool": CPU_POOL.stats() if CPU_POOL is not None else None,
+        "wazuh": WAZUH_CLIENT.stats(),
+    }
+
+
+@app.on_event("startup")
+async def _startup() -> None:
+    await PIPELINE.start()
+
+
 @app.on_event("shutdown")
-def _shutdown() -> None:
-    """應用停止前寫入狀態與向量資料。"""
-    save_state(STATE)
-    VECTOR_DB.save()
+async def _shutdown() -> None:
+    """應用停止前處理完管線中的批次，並寫入狀態、向量資料與尚未送出的圖譜批次。"""
+    await PIPELINE.close()
+    GRAPH_WRITER.stop()
+    GRAPH_BUILDER.close()
+    PERSISTENCE.stop()
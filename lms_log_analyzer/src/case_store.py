@@ -0,0 +1,244 @@
+"""Append-only 案例儲存。
+
+每筆案例以一行 JSON 附加寫入分段檔（``segment-000001.jsonl`` …），並在
+``offsets.idx`` 中附加一筆固定長度的位移紀錄（分段編號、位移、長度）。
+讀取時依位移透過 mmap 直接取出該行，不需把整個案例庫載入記憶體，
+啟動時也只需讀取位移索引而非解析整份 JSON。"""
+
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .utils import logger
+
+# 每筆位移紀錄：分段編號、該行在分段中的起始位移與位元組長度
+OFFSET_DTYPE = np.dtype([("segment", "<u4"), ("offset", "<u8"), ("length", "<u4")])
+
+
+def _segment_name(number: int) -> str:
+    return f"segment-{number:06d}.jsonl"
+
+
+class CaseStore:
+    """以分段 JSONL 與位移索引組成的 append-only 案例庫。"""
+
+    def __init__(self, directory: Path, segment_bytes: int = 64 * 1024 * 1024):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_bytes = segment_bytes
+        self.index_path = self.directory / "offsets.idx"
+        self._lock = threading.RLock()
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._offsets, self._count = self._load_offsets()
+        self._segment = int(self._offsets["segment"][:self._count].max()) if self._count else 1
+        self._recover_segment_tail()
+        self._writer = open(self.directory / _segment_name(self._segment), "ab")
+        self._index_writer = open(self.index_path, "ab")
+        self._unsynced_bytes = 0
+
+    # -- 開啟與復原 -------------------------------------------------------
+    def _load_offsets(self) -> Tuple[np.ndarray, int]:
+        """讀取位移索引，捨棄因中斷寫入而不完整或指向不存在資料的紀錄。
+
+        回傳預留成長空間的位移陣列與其中有效紀錄的筆數。
+        """
+        if not self.index_path.exists():
+            return np.zeros(1024, dtype=OFFSET_DTYPE), 0
+        raw = self.index_path.read_bytes()
+        usable = len(raw) - len(raw) % OFFSET_DTYPE.itemsize
+        records = np.frombuffer(raw[:usable], dtype=OFFSET_DTYPE)
+        valid = len(records)
+        sizes: Dict[int, int] = {}
+        for i in range(len(records) - 1, -1, -1):
+            seg = int(records["segment"][i])
+            if seg not in sizes:
+                path = self.directory / _segment_name(seg)
+                sizes[seg] = path.stat().st_size if path.exists() else 0
+            if int(records["offset"][i]) + int(records["length"][i]) <= sizes[seg]:
+                break
+            valid = i
+        if valid != len(records) or usable != len(raw):
+            logger.warning("Case store index truncated from %d to %d records", len(records), valid)
+            with open(self.index_path, "r+b") as fh:
+                fh.truncate(valid * OFFSET_DTYPE.itemsize)
+        buf = np.zeros(max(1024, valid * 2), dtype=OFFSET_DTYPE)
+        buf[:valid] = records[:valid]
+        return buf, valid
+
+    def _segment_end(self, segment: int) -> int:
+        """回傳分段中最後一筆仍被引用紀錄的結尾位移。"""
+        offsets = self._offsets[:self._count]
+        rows = offsets[offsets["segment"] == segment]
+        return int((rows["offset"] + rows["length"]).max()) if len(rows) else 0
+
+    def _recover_segment_tail(self, segment: int | None = None) -> None:
+        """截去分段（預設為目前分段）尾端未被索引的殘留位元組（例如寫入中斷的半行）。"""
+        path = self.directory / _segment_name(self._segment if segment is None else segment)
+        if not path.exists():
+            return
+        end = self._segment_end(self._segment if segment is None else segment)
+        if path.stat().st_size > end:
+            with open(path, "r+b") as fh:
+                fh.truncate(end)
+
+    # -- 寫入 -------------------------------------------------------------
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, cases: Iterable[Dict]) -> List[int]:
+        """附加多筆案例並回傳其編號（與向量索引中的位置一致）。"""
+        ids: List[int] = []
+        with self._lock:
+            for case in cases:
+                data = json.dumps(case, ensure_ascii=False).encode("utf-8") + b"\n"
+                offset = self._writer.tell()
+                if offset and offset + len(data) > self.segment_bytes:
+                    self._roll_segment()
+                    offset = 0
+                self._writer.write(data)
+                self._push_offset(self._segment, offset, len(data))
+                self._unsynced_bytes += len(data) + OFFSET_DTYPE.itemsize
+                ids.append(self._count - 1)
+            # 寫入作業系統緩衝區，讓 mmap 讀取能看到新資料
+            self._writer.flush()
+            self._index_writer.flush()
+        return ids
+
+    def _push_offset(self, segment: int, offset: int, length: int) -> None:
+        if self._count == len(self._offsets):
+            grown = np.zeros(len(self._offsets) * 2, dtype=OFFSET_DTYPE)
+            grown[:self._count] = self._offsets[:self._count]
+            self._offsets = grown
+        self._offsets[self._count] = (segment, offset, length)
+        self._index_writer.write(self._offsets[self._count:self._count + 1].tobytes())
+        self._count += 1
+
+    def _roll_segment(self) -> None:
+        self._writer.close()
+        self._segment += 1
+        self._writer = open(self.directory / _segment_name(self._segment), "ab")
+
+    def truncate(self, count: int) -> None:
+        """只保留前 ``count`` 筆案例，用於與向量索引對齊。
+
+        壓縮後的分段可能混有保留與捨棄的案例，因此只刪除完全不再被引用的
+        分段，並截去其餘分段尾端不再被引用的資料；夾在保留案例之間的捨棄
+        資料留待 :meth:`compact` 回收。之後的寫入從編號最大的存活分段之後的
+        新分段開始。
+        """
+        with self._lock:
+            if count >= self._count:
+                return
+            self._count = count
+            self._index_writer.flush()
+            self._index_writer.truncate(count * OFFSET_DTYPE.itemsize)
+            self._index_writer.seek(0, os.SEEK_END)
+            self._writer.close()
+            self._close_maps()
+            live = set(np.unique(self._offsets["segment"][:count]).tolist())
+            for path in self.directory.glob("segment-*.jsonl"):
+                seg = int(path.stem.split("-")[1])
+                if seg in live:
+                    self._recover_segment_tail(seg)
+                else:
+                    path.unlink()
+            self._segment = max(live, default=0) + 1
+            self._writer = open(self.directory / _segment_name(self._segment), "ab")
+
+    def sync(self) -> int:
+        """將分段檔與位移索引 fsync 至磁碟，回傳自上次同步後新增的位元組數。"""
+        with self._lock:
+            for fh in (self._writer, self._index_writer):
+                fh.flush()
+                os.fsync(fh.fileno())
+            written, self._unsynced_bytes = self._unsynced_bytes, 0
+        return written
+
+    # -- 讀取 -------------------------------------------------------------
+    def _map(self, segment: int, end: int) -> mmap.mmap:
+        mm = self._maps.get(segment)
+        if mm is None or len(mm) < end:
+            if mm is not None:
+                mm.close()
+            with open(self.directory / _segment_name(segment), "rb") as fh:
+                mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment] = mm
+        return mm
+
+    def get(self, ids: Iterable[int]) -> List[Optional[Dict]]:
+        """依編號隨機讀取案例，結果與 ``ids`` 一一對應；超出範圍的編號回傳 ``None``。"""
+        results: List[Optional[Dict]] = []
+        with self._lock:
+            for i in ids:
+                i = int(i)
+                if not 0 <= i < self._count:
+                    results.append(None)
+                    continue
+                seg, offset, length = (int(v) for v in self._offsets[i])
+                mm = self._map(seg, offset + length)
+                results.append(json.loads(mm[offset:offset + length]))
+        return results
+
+    # -- 壓縮 -------------------------------------------------------------
+    def compact(self) -> int:
+        """將小於分段上限一半的已封存分段合併，回傳減少的分段數。
+
+        合併時只保留位移索引中仍引用的紀錄。
+        """
+        with self._lock:
+            small = sorted(
+                int(p.stem.split("-")[1])
+                for p in self.directory.glob("segment-*.jsonl")
+                if int(p.stem.split("-")[1]) != self._segment and p.stat().st_size < self.segment_bytes // 2
+            )
+            if len(small) < 2:
+                return 0
+            target = small[0]
+            tmp = self.directory / (_segment_name(target) + ".tmp")
+            offsets = self._offsets[:self._count].copy()
+            with open(tmp, "wb") as out:
+                for seg in small:
+                    # 只複製位移索引仍引用的紀錄，未被引用的資料在此回收
+                    rows = np.flatnonzero(offsets["segment"] == seg)
+                    if not len(rows):
+                        continue
+                    data = (self.directory / _segment_name(seg)).read_bytes()
+                    for i in rows[np.argsort(offsets["offset"][rows], kind="stable")]:
+                        start, length = int(offsets["offset"][i]), int(offsets["length"][i])
+                        offsets["offset"][i] = out.tell()
+                        out.write(data[start:start + length])
+                    offsets["segment"][rows] = target
+                out.flush()
+                os.fsync(out.fileno())
+            index_tmp = self.index_path.with_suffix(".idx.tmp")
+            with open(index_tmp, "wb") as out:
+                out.write(offsets.tobytes())
+                out.flush()
+                os.fsync(out.fileno())
+            self._close_maps()
+            self._index_writer.close()
+            os.replace(tmp, self.directory / _segment_name(target))
+            os.replace(index_tmp, self.index_path)
+            for seg in small[1:]:
+                (self.directory / _segment_name(seg)).unlink()
+            self._offsets[:self._count] = offsets
+            self._index_writer = open(self.index_path, "ab")
+            return len(small) - 1
+
+    def _close_maps(self) -> None:
+        for mm in self._maps.values():
+            mm.close()
+        self._maps.clear()
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_maps()
+            self._writer.close()
+            self._index_writer.close()
@@ -0,0 +1,191 @@
+"""LLM token 用量與每小時成本控管。
+
+:class:`CostTracker` 以一小時滾動視窗記錄每次 LLM 請求的輸入／輸出 token
+數，依 ``PRICE_IN_PER_1K_TOKENS`` 與 ``PRICE_OUT_PER_1K_TOKENS`` 換算成本。
+處理流程在送出分析前呼叫 :meth:`CostTracker.admit` 取得本批可負擔的告警數：
+
+* 花費低於 ``MAX_HOURLY_COST_USD * COST_SOFT_LIMIT_RATIO`` 時不限制。
+* 超過軟上限後可分析數量隨剩餘預算線性縮減，且不超過剩餘預算能負擔的筆數。
+* 達到預算上限時暫停送出，直到視窗內較舊的花費過期。
+
+被延後的候選告警放入有上限的待辦佇列，之後預算有餘裕時由
+:meth:`CostTracker.admit_with_backlog` 每批取出有限數量一併分析。
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Tuple
+
+from .. import config
+
+# 尚無實際用量時，估計每筆告警的提示與回覆 token 數
+_DEFAULT_PROMPT_TOKENS = 800
+_DEFAULT_COMPLETION_TOKENS = 200
+
+
+def estimate_tokens(text: str) -> int:
+    """以約每 4 個字元 1 個 token 粗估 token 數。"""
+    return max(1, len(text) // 4)
+
+
+def usage_from_response(response: Any, prompt: str) -> Tuple[int, int]:
+    """自 LangChain 回應取得 (輸入, 輸出) token 數，缺少時以字元數估計。"""
+    usage = getattr(response, "usage_metadata", None) or {}
+    if usage.get("input_tokens") is not None:
+        return int(usage["input_tokens"]), int(usage.get("output_tokens") or 0)
+    meta = (getattr(response, "response_metadata", None) or {}).get("usage_metadata") or {}
+    if meta.get("prompt_token_count") is not None:
+        return int(meta["prompt_token_count"]), int(meta.get("candidates_token_count") or 0)
+    return estimate_tokens(prompt), estimate_tokens(str(getattr(response, "content", "") or ""))
+
+
+class CostTracker:
+    """滾動一小時的 token／成本統計、准入控制與延後佇列。"""
+
+    def __init__(
+        self,
+        budget_usd: float | None = None,
+        price_in_per_1k: float | None = None,
+        price_out_per_1k: float | None = None,
+        window_sec: float = 3600.0,
+        soft_limit_ratio: float | None = None,
+        backlog_max: int | None = None,
+    ) -> None:
+        self.budget_usd = config.MAX_HOURLY_COST_USD if budget_usd is None else budget_usd
+        self.price_in = config.PRICE_IN_PER_1K_TOKENS if price_in_per_1k is None else price_in_per_1k
+        self.price_out = config.PRICE_OUT_PER_1K_TOKENS if price_out_per_1k is None else price_out_per_1k
+        self.window_sec = window_sec
+        self.soft_limit_ratio = config.COST_SOFT_LIMIT_RATIO if soft_limit_ratio is None else soft_limit_ratio
+        self._events: Deque[Tuple[float, int, int, float]] = deque()
+        self._tokens_in = 0
+        self._tokens_out = 0
+        self._spend = 0.0
+        # 每筆告警的平均成本（指數移動平均），用來估計剩餘預算可負擔的筆數
+        self._cost_per_item = self._cost(_DEFAULT_PROMPT_TOKENS, _DEFAULT_COMPLETION_TOKENS)
+        self._backlog: Deque[Any] = deque(maxlen=backlog_max or config.COST_BACKLOG_MAX)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.admitted = 0
+        self.deferred = 0
+        self.drained = 0
+        self.dropped = 0
+
+    def _cost(self, tokens_in: int, tokens_out: int) -> float:
+        return tokens_in / 1000 * self.price_in + tokens_out / 1000 * self.price_out
+
+    def _expire(self, now: float) -> None:
+        while self._events and self._events[0][0] <= now - self.window_sec:
+            _, tin, tout, cost = self._events.popleft()
+            self._tokens_in -= tin
+            self._tokens_out -= tout
+            self._spend -= cost
+        if not self._events:
+            self._spend = 0.0
+
+    # -- 記錄 -------------------------------------------------------------
+    def record(self, tokens_in: int, tokens_out: int, items: int = 1, now: float | None = None) -> float:
+        """記錄一次請求的用量，回傳其成本（USD）。"""
+        now = time.time() if now is None else now
+        cost = self._cost(tokens_in, tokens_out)
+        with self._lock:
+            self._expire(now)
+            self._events.append((now, tokens_in, tokens_out, cost))
+            self._tokens_in += tokens_in
+            self._tokens_out += tokens_out
+            self._spend += cost
+            self.calls += 1
+            per_item = cost / max(1, items)
+            self._cost_per_item = 0.8 * self._cost_per_item + 0.2 * per_item
+        return cost
+
+    def record_response(self, response: Any, prompt: str, items: int = 1) -> float:
+        tokens_in, tokens_out = usage_from_response(response, prompt)
+        return self.record(tokens_in, tokens_out, items)
+
+    def spend(self, now: float | None = None) -> float:
+        """回傳最近一小時的花費（USD）。"""
+        with self._lock:
+            self._expire(time.time() if now is None else now)
+            return max(0.0, self._spend)
+
+    # -- 准入控制 ---------------------------------------------------------
+    def _quota(self, requested: int, now: float | None = None) -> int:
+        if requested <= 0:
+            return 0
+        if self.budget_usd <= 0:
+            return requested
+        spent = self.spend(now)
+        remaining = self.budget_usd - spent
+        if remaining <= 0:
+            return 0
+        allowed = requested
+        soft = self.budget_usd * self.soft_limit_ratio
+        if spent > soft:
+            allowed = int(requested * remaining / (self.budget_usd - soft))
+        allowed = min(allowed, int(remaining / self._cost_per_item) if self._cost_per_item > 0 else allowed)
+        return max(0, min(requested, allowed))
+
+    def admit(self, requested: int, now: float | None = None) -> int:
+        """回傳在目前預算下可送出分析的告警數（不超過 ``requested``）。"""
+        allowed = self._quota(requested, now)
+        with self._lock:
+            self.admitted += allowed
+        return allowed
+
+    def admit_with_backlog(self, requested: int, drain_max: int, now: float | None = None) -> Tuple[int, List[Any]]:
+        """決定本批可送出的告警數，預算有餘裕時另自待辦佇列取出至多 ``drain_max`` 項。
+
+        回傳本批可送出的數量與取出的待辦項目；``admitted`` 只計入實際送出的數量。
+        """
+        allowed = self._quota(requested + min(max(0, drain_max), self.backlog_size()), now)
+        drained = self.drain(allowed - requested) if allowed > requested else []
+        current = min(allowed, requested)
+        with self._lock:
+            self.admitted += current + len(drained)
+        return current, drained
+
+    def defer(self, items: List[Any]) -> List[Any]:
+        """將本批無法負擔的候選放入待辦佇列；佇列已滿時捨棄最舊的項目並回傳。"""
+        dropped: List[Any] = []
+        with self._lock:
+            for item in items:
+                if len(self._backlog) == self._backlog.maxlen:
+                    dropped.append(self._backlog.popleft())
+                self._backlog.append(item)
+            self.dropped += len(dropped)
+            self.deferred += len(items)
+        return dropped
+
+    def drain(self, n: int) -> List[Any]:
+        """自待辦佇列依先進先出取出至多 ``n`` 個項目。"""
+        with self._lock:
+            items = [self._backlog.popleft() for _ in range(min(n, len(self._backlog)))]
+            self.drained += len(items)
+            return items
+
+    def backlog_size(self) -> int:
+        return len(self._backlog)
+
+    def stats(self) -> Dict[str, float]:
+        spent = self.spend()
+        with self._lock:
+            return {
+                "spend_usd_last_hour": round(spent, 6),
+                "budget_usd_per_hour": self.budget_usd,
+                "budget_utilization": round(spent / self.budget_usd, 4) if self.budget_usd > 0 else 0.0,
+                "tokens_in_last_hour": self._tokens_in,
+                "tokens_out_last_hour": self._tokens_out,
+                "llm_calls": self.calls,
+                "est_cost_per_alert_usd": self._cost_per_item,
+                "admitted": self.admitted,
+                "deferred": self.deferred,
+                "drained": self.drained,
+                "dropped": self.dropped,
+                "backlog": len(self._backlog),
+            }
+
+
+COST_TRACKER = CostTracker()
@@ -0,0 +1,316 @@
+"""圖譜儲存後端。
+
+:class:`GraphBuilder` 與 :class:`GraphRetrievalTool` 只透過 :class:`GraphBackend`
+的三項操作存取圖譜：合併節點、合併關係與取得 k-hop 鄰域。提供兩種實作：
+
+* :class:`Neo4jBackend`：以 py2neo 送出參數化的 ``UNWIND`` Cypher。
+* :class:`MemoryGraphBackend`：行程內的鄰接串列，以 id 與標籤索引節點，並以
+  快照加上 append-only 異動紀錄保存在 ``DATA_DIR`` 下，讓單機感測器不需
+  Neo4j 伺服器即可使用 GraphRAG，也可在無網路開銷下量測圖譜查詢。
+
+傳入的列已由 ``GraphBuilder`` 驗證並分組：``merge_entities`` 收到
+``{標籤: [{"id", "props"}]}``，``merge_relations`` 收到 ``{類型: [{"start", "end"}]}``；
+``neighbourhoods`` 回傳 ``{實體 id: {"nodes": [...], "relationships": [...]}}``，
+查無的實體不出現在結果中。"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+from pathlib import Path
+from typing import Dict, List, Set, Tuple
+
+from .. import config
+from .utils import atomic_write, logger
+
+# 所有實體共用的標籤，唯一性約束與端點比對都建立在此標籤上
+ENTITY_LABEL = "Entity"
+# Cypher 無法參數化標籤與關係類型，只接受安全的識別字
+IDENTIFIER_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+# 一次為舊資料補上 ``Entity`` 標籤的節點數
+_LEGACY_LABEL_BATCH = 10_000
+
+Subgraph = Dict[str, List[Dict]]
+
+
+class GraphBackend(ABC):
+    """圖譜後端介面。"""
+
+    def ensure_schema(self) -> None:
+        """建立查詢所需的索引；預設不需任何動作。"""
+
+    @abstractmethod
+    def merge_entities(self, rows_by_label: Dict[str, List[Dict]]) -> None:
+        """依標籤合併節點。"""
+
+    @abstractmethod
+    def merge_relations(self, rows_by_type: Dict[str, List[Dict]]) -> None:
+        """依類型合併兩端點皆存在的關係。"""
+
+    @abstractmethod
+    def neighbourhoods(self, entity_ids: List[str], depth: int, fanout: int) -> Dict[str, Subgraph]:
+        """回傳各實體的 k-hop 鄰域。"""
+
+    def close(self) -> None:
+        """釋放資源；預設不需任何動作。"""
+
+
+class Neo4jBackend(GraphBackend):
+    """透過 py2neo ``Graph`` 存取 Neo4j。"""
+
+    def __init__(self, graph) -> None:
+        self.graph = graph
+
+    def ensure_schema(self) -> None:
+        """建立 ``Entity.id`` 唯一性約束與常用標籤的索引，並替舊節點補上 ``Entity`` 標籤。"""
+        statements = [
+            f"CREATE CONSTRAINT entity_id IF NOT EXISTS FOR (n:{ENTITY_LABEL}) REQUIRE n.id IS UNIQUE",
+            *(
+                f"CREATE INDEX {label.lower()}_id IF NOT EXISTS FOR (n:{label}) ON (n.id)"
+                for label in config.GRAPH_INDEXED_LABELS
+                if IDENTIFIER_RE.match(label)
+            ),
+        ]
+        try:
+            for stmt in statements:
+                self.graph.run(stmt)
+            # 舊版以各自標籤 MERGE 的節點沒有 Entity 標籤，分批補上以便端點比對命中索引
+            while True:
+                row = self.graph.run(
+                    f"MATCH (n) WHERE n.id IS NOT NULL AND NOT n:{ENTITY_LABEL} "
+                    f"WITH n LIMIT $limit SET n:{ENTITY_LABEL} RETURN count(n) AS c",
+                    limit=_LEGACY_LABEL_BATCH,
+                ).evaluate()
+                if not row:
+                    break
+        except Exception as exc:  # pragma: no cover - server errors
+            logger.error("Neo4j schema setup failed: %s", exc)
+
+    def merge_entities(self, rows_by_label: Dict[str, List[Dict]]) -> None:
+        tx = self.graph.begin()
+        for label, rows in rows_by_label.items():
+            extra = f", n:{label}" if label != ENTITY_LABEL else ""
+            tx.run(
+                f"UNWIND $rows AS row MERGE (n:{ENTITY_LABEL} {{id: row.id}}) "
+                f"SET n += row.props{extra}",
+                rows=rows,
+            )
+        self.graph.commit(tx)
+
+    def merge_relations(self, rows_by_type: Dict[str, List[Dict]]) -> None:
+        tx = self.graph.begin()
+        for rtype, rows in rows_by_type.items():
+            tx.run(
+                f"UNWIND $rows AS row "
+                f"MATCH (a:{ENTITY_LABEL} {{id: row.start}}) "
+                f"MATCH (b:{ENTITY_LABEL} {{id: row.end}}) "
+                f"MERGE (a)-[:{rtype}]->(b)",
+                rows=rows,
+            )
+        self.graph.commit(tx)
+
+    def neighbourhoods(self, entity_ids: List[str], depth: int, fanout: int) -> Dict[str, Subgraph]:
+        cypher = (
+            f"UNWIND $ids AS eid "
+            f"MATCH (n:{ENTITY_LABEL} {{id: eid}}) "
+            f"CALL {{ WITH n MATCH p=(n)-[*1..{int(depth)}]-(m) RETURN p LIMIT $fanout }} "
+            "RETURN eid, nodes(p) AS nodes, relationships(p) AS rels"
+        )
+        result = self.graph.run(cypher, ids=list(entity_ids), fanout=fanout)
+        subgraphs: Dict[str, Subgraph] = {}
+        for row in result:
+            sub = subgraphs.setdefault(row.get("eid"), {"nodes": [], "relationships": []})
+            for n in row.get("nodes", []):
+                sub["nodes"].append({
+                    "id": n.get("id"),
+                    "labels": list(getattr(n, "labels", [])),
+                    "properties": dict(n),
+                })
+            for r in row.get("rels", []):
+                sub["relationships"].append({
+                    "start_id": r.start_node.get("id"),
+                    "end_id": r.end_node.get("id"),
+                    "type": type(r).__name__,
+                })
+        return subgraphs
+
+
+class MemoryGraphBackend(GraphBackend):
+    """以鄰接串列實作、保存於本機檔案的圖譜。
+
+    ``snapshot.json`` 保存完整圖譜，之後的每批異動以一行 JSON 附加到
+    ``changes.jsonl``；啟動時載入快照再重播異動紀錄，紀錄累積超過
+    ``compact_every`` 筆時寫出新快照並清空紀錄。無法解析的快照會改名為
+    ``snapshot.json.corrupt`` 保留，不會被新快照覆寫。
+    """
+
+    def __init__(self, directory: str | Path | None = None, compact_every: int | None = None) -> None:
+        self.directory = Path(directory or config.GRAPH_MEMORY_DIR)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.snapshot_path = self.directory / "snapshot.json"
+        self.log_path = self.directory / "changes.jsonl"
+        self.compact_every = compact_every or config.GRAPH_MEMORY_COMPACT_EVERY
+        self._lock = threading.RLock()
+        # id -> {"labels": set, "props": dict}；此 dict 即為節點的 id 索引
+        self._nodes: Dict[str, Dict] = {}
+        self._by_label: Dict[str, Set[str]] = {}
+        # id -> 相鄰關係 (類型, 起點, 終點)，兩端點各記錄一次
+        self._adjacency: Dict[str, List[Tuple[str, str, str]]] = {}
+        self._edges: Set[Tuple[str, str, str]] = set()
+        self._logged = 0
+        self._load()
+        self._log = open(self.log_path, "a", encoding="utf-8")
+
+    # -- 載入與保存 -------------------------------------------------------
+    def _load(self) -> None:
+        if self.snapshot_path.exists():
+            try:
+                snap = json.loads(self.snapshot_path.read_text(encoding="utf-8"))
+            except (OSError, ValueError) as exc:
+                # 保留無法讀取的快照供人工復原，避免之後的快照直接覆寫
+                corrupt = self.snapshot_path.with_name(self.snapshot_path.name + ".corrupt")
+                os.replace(self.snapshot_path, corrupt)
+                logger.error("Cannot read graph snapshot %s (%s); moved to %s", self.snapshot_path, exc, corrupt)
+                snap = {}
+            for nid, labels, props in snap.get("nodes", []):
+                self._apply_node(nid, labels, props)
+            for start, rtype, end in snap.get("edges", []):
+                self._apply_edge(start, rtype, end)
+        if not self.log_path.exists():
+            return
+        valid = 0
+        with open(self.log_path, "rb") as fh:
+            for raw in fh:
+                # 中斷寫入留下的半行：截去並停止重播
+                if not raw.endswith(b"\n"):
+                    break
+                try:
+                    change = json.loads(raw)
+                except ValueError:
+                    break
+                self._apply(change)
+                valid += len(raw)
+                self._logged += 1
+        if valid != self.log_path.stat().st_size:
+            logger.warning("Graph change log truncated to %d bytes", valid)
+            with open(self.log_path, "r+b") as fh:
+                fh.truncate(valid)
+
+    def _append(self, change: Dict) -> None:
+        self._log.write(json.dumps(change, ensure_ascii=False) + "\n")
+        self._log.flush()
+        self._logged += 1
+        if self._logged >= self.compact_every:
+            self.snapshot()
+
+    def snapshot(self) -> int:
+        """寫出完整快照並清空異動紀錄，回傳快照位元組數。"""
+        with self._lock:
+            data = json.dumps({
+                "nodes": [[nid, sorted(node["labels"]), node["props"]] for nid, node in self._nodes.items()],
+                "edges": sorted(self._edges),
+            }, ensure_ascii=False).encode("utf-8")
+            written = atomic_write(self.snapshot_path, data)
+            self._log.truncate(0)
+            self._log.seek(0)
+            os.fsync(self._log.fileno())
+            self._logged = 0
+            return written
+
+    def close(self) -> None:
+        with self._lock:
+            if self._log.closed:
+                return
+            if self._logged:
+                self.snapshot()
+            self._log.close()
+
+    # -- 異動 -------------------------------------------------------------
+    def _apply(self, change: Dict) -> None:
+        if change.get("op") == "nodes":
+            for row in change["rows"]:
+                self._apply_node(row["id"], [change["label"]], row["props"])
+        elif change.get("op") == "edges":
+            for row in change["rows"]:
+                self._apply_edge(row["start"], change["type"], row["end"])
+
+    def _apply_node(self, nid: str, labels: List[str], props: Dict) -> None:
+        node = self._nodes.setdefault(nid, {"labels": {ENTITY_LABEL}, "props": {}})
+        node["props"].update(props)
+        node["props"]["id"] = nid
+        for label in labels:
+            node["labels"].add(label)
+            self._by_label.setdefault(label, set()).add(nid)
+        self._by_label.setdefault(ENTITY_LABEL, set()).add(nid)
+
+    def _apply_edge(self, start: str, rtype: str, end: str) -> bool:
+        # 與 Cypher 的 MATCH 相同：任一端點不存在時略過
+        if start not in self._nodes or end not in self._nodes:
+            return False
+        key = (start, rtype, end)
+        if key in self._edges:
+            return False
+        self._edges.add(key)
+        edge = (rtype, start, end)
+        self._adjacency.setdefault(start, []).append(edge)
+        if end != start:
+            self._adjacency.setdefault(end, []).append(edge)
+        return True
+
+    def merge_entities(self, rows_by_label: Dict[str, List[Dict]]) -> None:
+        with self._lock:
+            for label, rows in rows_by_label.items():
+                for row in rows:
+                    self._apply_node(row["id"], [label], row["props"])
+                self._append({"op": "nodes", "label": label, "rows": rows})
+
+    def merge_relations(self, rows_by_type: Dict[str, List[Dict]]) -> None:
+        with self._lock:
+            for rtype, rows in rows_by_type.items():
+                added = [row for row in rows if self._apply_edge(row["start"], rtype, row["end"])]
+                if added:
+                    self._append({"op": "edges", "type": rtype, "rows": added})
+
+    # -- 查詢 -------------------------------------------------------------
+    def nodes_with_label(self, label: str) -> Set[str]:
+        with self._lock:
+            return set(self._by_label.get(label, ()))
+
+    def _node(self, nid: str) -> Dict:
+        node = self._nodes[nid]
+        return {"id": nid, "labels": sorted(node["labels"]), "properties": dict(node["props"])}
+
+    def neighbourhoods(self, entity_ids: List[str], depth: int, fanout: int) -> Dict[str, Subgraph]:
+        """以廣度優先走訪取得每個實體 ``depth`` 跳內的節點與關係（不分方向）。
+
+        每個實體最多走訪 ``fanout`` 條關係，對應 Neo4j 查詢的路徑數上限。
+        """
+        subgraphs: Dict[str, Subgraph] = {}
+        with self._lock:
+            for eid in entity_ids:
+                if eid not in self._nodes:
+                    continue
+                nodes = {eid: self._node(eid)}
+                rels: Dict[Tuple[str, str, str], Dict] = {}
+                frontier = deque([(eid, 0)])
+                while frontier and len(rels) < fanout:
+                    current, dist = frontier.popleft()
+                    if dist >= depth:
+                        continue
+                    for rtype, start, end in self._adjacency.get(current, ()):
+                        if len(rels) >= fanout:
+                            break
+                        if (start, rtype, end) in rels:
+                            continue
+                        rels[(start, rtype, end)] = {"start_id": start, "end_id": end, "type": rtype}
+                        other = end if start == current else start
+                        if other not in nodes:
+                            nodes[other] = self._node(other)
+                            frontier.append((other, dist + 1))
+                if rels:
+                    subgraphs[eid] = {"nodes": list(nodes.values()), "relationships": list(rels.values())}
+        return subgraphs
@@ -1,60 +1,141 @@
 """Neo4j 實體與關係建立模組。
 
 此模組負責解析 llm_analyse 回傳的 JSON，並
-透過 py2neo 將事件相關實體與關聯寫入 Neo4j。
-在單元測試或缺乏 Neo4j/py2neo 時會自動降級為無操作模式。"""
+將事件相關實體與關聯寫入圖譜後端（預設透過 py2neo 寫入 Neo4j）。
+在單元測試或缺乏 Neo4j/py2neo 時會自動降級為無操作模式；設定
+``LMS_GRAPH_BACKEND=memory`` 則改用 :class:`~.graph_backend.MemoryGraphBackend`。
+
+寫入一律以參數化的 ``UNWIND $rows`` 批次語句完成：所有節點另帶共同的
+``Entity`` 標籤並以 ``Entity.id`` 唯一性約束建立索引，關係的兩端點在
+同一段 Cypher 中依 id 比對，不再逐筆查詢節點。"""
 
 from __future__ import annotations
 
-from typing import List, Dict
+import json
+from typing import Callable, Dict, Iterable, List, Tuple
 
 from .. import config
+from .graph_backend import ENTITY_LABEL, IDENTIFIER_RE, GraphBackend, MemoryGraphBackend, Neo4jBackend
 from .utils import logger
 
 try:  # pragma: no cover - optional dependency
-    from py2neo import Graph, Node, Relationship
+    from py2neo import Graph
 except Exception:  # pragma: no cover - missing dependency
     Graph = None  # type: ignore
-    Node = None  # type: ignore
-    Relationship = None  # type: ignore
+
+
+def _identifier(value: str | None, default: str) -> str:
+    return value if value and IDENTIFIER_RE.match(value) else default
+
+
+def _property_value(value):
+    """Neo4j 屬性只接受基本型別（或其清單），其餘轉為 JSON 字串。"""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, (list, tuple)) and all(isinstance(v, (str, int, float, bool)) for v in value):
+        return list(value)
+    return json.dumps(value, ensure_ascii=False, default=str)
 
 
 class GraphBuilder:
-    """簡化的 Neo4j 連線與寫入封裝。"""
+    """圖譜連線與寫入封裝。
 
-    def __init__(self, uri: str | None = None, user: str | None = None, password: str | None = None) -> None:
+    ``graph`` 為目前使用的 :class:`GraphBackend`，無可用後端時為 ``None``；
+    指定 py2neo ``Graph`` 等物件時會自動包成 :class:`Neo4jBackend`。
+    """
+
+    def __init__(
+        self,
+        uri: str | None = None,
+        user: str | None = None,
+        password: str | None = None,
+        backend: str | GraphBackend | None = None,
+    ) -> None:
         self.uri = uri or config.NEO4J_URI
         self.user = user or config.NEO4J_USER
         self.password = password or config.NEO4J_PASSWORD
-        self.graph = None
-        if Graph is not None:
+        self._backend: GraphBackend | None = None
+        # 寫入成功後以受影響的節點 id 呼叫，供子圖快取失效
+        self._write_listeners: List[Callable[[Iterable[str]], None]] = []
+        backend = backend or config.GRAPH_BACKEND
+        if isinstance(backend, GraphBackend):
+            self._backend = backend
+        elif backend == "memory":
+            self._backend = MemoryGraphBackend()
+        elif backend == "neo4j" and Graph is not None:
             try:
-                self.graph = Graph(self.uri, auth=(self.user, self.password))
+                self._backend = Neo4jBackend(Graph(self.uri, auth=(self.user, self.password)))
             except Exception as exc:  # pragma: no cover - connection errors
                 logger.error("Neo4j connection failed: %s", exc)
-                self.graph = None
+        if self._backend is not None:
+            self._backend.ensure_schema()
+
+    @property
+    def graph(self) -> GraphBackend | None:
+        return self._backend
+
+    @graph.setter
+    def graph(self, value) -> None:
+        if value is None or isinstance(value, GraphBackend):
+            self._backend = value
+        else:
+            self._backend = Neo4jBackend(value)
+
+    def add_write_listener(self, callback: Callable[[Iterable[str]], None]) -> None:
+        """註冊寫入後的回呼，參數為本次寫入觸及的節點 id。"""
+        self._write_listeners.append(callback)
 
-    def create_entities(self, entities: List[Dict]) -> None:
-        """建立或更新多個節點。"""
-        if not self.graph or not Node:
+    def _notify(self, ids: Iterable[str]) -> None:
+        ids = set(ids)
+        if not ids:
             return
-        tx = self.graph.begin()
+        for callback in self._write_listeners:
+            try:
+                callback(ids)
+            except Exception as exc:  # pragma: no cover - listener bugs must not break writes
+                logger.error("Graph write listener failed: %s", exc)
+
+    def ensure_schema(self) -> None:
+        """建立 ``Entity.id`` 唯一性約束與常用標籤的索引（依後端而定）。"""
+        if self._backend:
+            self._backend.ensure_schema()
+
+    def close(self) -> None:
+        """關閉後端，記憶體後端會在此寫出快照。"""
+        if self._backend:
+            self._backend.close()
+
+    def create_entities(self, entities: List[Dict]) -> int:
+        """以每個標籤一則 ``UNWIND`` 語句建立或更新節點，回傳寫入的節點數。"""
+        if not self._backend or not entities:
+            return 0
+        by_label: Dict[str, Dict[str, Dict]] = {}
         for ent in entities:
-            label = ent.get("label", "Entity")
-            node = Node(label, id=ent.get("id"), **(ent.get("properties") or {}))
-            tx.merge(node, label, "id")
-        tx.commit()
-
-    def create_relations(self, relations: List[Dict]) -> None:
-        """建立多個關係。"""
-        if not self.graph or not Relationship:
-            return
-        tx = self.graph.begin()
+            if ent.get("id") is None:
+                continue
+            label = _identifier(ent.get("label"), ENTITY_LABEL)
+            rows = by_label.setdefault(label, {})
+            props = {k: _property_value(v) for k, v in (ent.get("properties") or {}).items() if k != "id"}
+            row = rows.setdefault(str(ent["id"]), {"id": str(ent["id"]), "props": {}})
+            row["props"].update(props)
+        self._backend.merge_entities({label: list(rows.values()) for label, rows in by_label.items()})
+        self._notify(nid for rows in by_label.values() for nid in rows)
+        return sum(len(rows) for rows in by_label.values())
+
+    def create_relations(self, relations: List[Dict]) -> int:
+        """以每個關係類型一則 ``UNWIND`` 語句建立關係，回傳送出的關係數。
+
+        兩端點在同一語句中以 ``Entity.id`` 比對；不存在的端點會被略過。
+        """
+        if not self._backend or not relations:
+            return 0
+        by_type: Dict[str, Dict[Tuple[str, str], Dict]] = {}
         for rel in relations:
-            start = self.graph.nodes.match(id=rel.get("start_id")).first()
-            end = self.graph.nodes.match(id=rel.get("end_id")).first()
-            if not start or not end:
+            start, end = rel.get("start_id"), rel.get("end_id")
+            if start is None or end is None:
                 continue
-            r = Relationship(start, rel.get("type", "RELATED"), end)
-            tx.merge(r)
-        tx.commit()
+            rtype = _identifier(rel.get("type"), "RELATED")
+            by_type.setdefault(rtype, {})[(str(start), str(end))] = {"start": str(start), "end": str(end)}
+        self._backend.merge_relations({rtype: list(rows.values()) for rtype, rows in by_type.items()})
+        self._notify(nid for rows in by_type.values() for pair in rows for nid in pair)
+        return sum(len(rows) for rows in by_type.values())
@@ -3,58 +3,166 @@
 此模組提供在 LangChain Agent 中使用的圖譜查詢功能，
 輸入可疑日誌行後會解析其中的實體 ID，
 並向 Neo4j 取得與其相關的節點與關係作為額外脈絡。
-在缺乏 Neo4j 或 py2neo 的環境下會自動降級為 no-op。
+在缺乏圖譜後端的環境下會自動降級為 no-op。
+
+整批日誌的實體以單一 ``UNWIND`` 查詢（記憶體後端則為一次走訪）取得，
+起點透過 ``Entity.id`` 唯一性索引比對，每個實體最多展開
+``GRAPH_RETRIEVAL_FANOUT`` 條路徑。查詢結果依
+``(實體 id, 深度)`` 保存在具 TTL 的行程內快取；``GraphBuilder`` 寫入觸及的
+節點會使包含它們的鄰域失效。
 """
 
 from __future__ import annotations
 
-from typing import List, Dict
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Sequence, Set, Tuple
 
+from .. import config
 from .graph_builder import GraphBuilder
 from .llm_handler import _extract_entities
+from .log_parser import LogRecord
+
+_CacheKey = Tuple[str, int]
+
+
+def _empty() -> Dict[str, List[Dict]]:
+    return {"nodes": [], "relationships": []}
 
 
 class GraphRetrievalTool:
-    """提供從 Neo4j 擷取子圖的能力。"""
+    """提供從圖譜後端擷取子圖的能力。"""
 
-    def __init__(self, builder: GraphBuilder | None = None) -> None:
+    def __init__(
+        self,
+        builder: GraphBuilder | None = None,
+        cache_size: int | None = None,
+        ttl: float | None = None,
+        fanout: int | None = None,
+    ) -> None:
         self.builder = builder or GraphBuilder()
-        self.graph = self.builder.graph
+        self.cache_size = cache_size or config.GRAPH_CACHE_SIZE
+        self.ttl = float(ttl if ttl is not None else config.GRAPH_CACHE_TTL_SEC)
+        self.fanout = fanout or config.GRAPH_RETRIEVAL_FANOUT
+        # (實體 id, 深度) -> (到期時間, 子圖)；另以反向索引記錄每個節點出現在哪些鄰域
+        self._cache: "OrderedDict[_CacheKey, Tuple[float, Dict[str, List[Dict]]]]" = OrderedDict()
+        self._containing: Dict[str, Set[_CacheKey]] = {}
+        self._lock = threading.Lock()
+        # 查詢期間若發生寫入，結果可能已過時，不放入快取
+        self._version = 0
+        self.hits = 0
+        self.misses = 0
+        self.queries = 0
+        self.invalidations = 0
+        self.builder.add_write_listener(self.invalidate)
 
-    def retrieve_for_line(self, line: str, depth: int = 1) -> Dict[str, List[Dict]]:
-        """依日誌行取得相關子圖。"""
-        if not self.graph:
-            return {"nodes": [], "relationships": []}
-        entities = _extract_entities(line)
-        nodes: List[Dict] = []
-        relations: List[Dict] = []
-        for ent in entities:
-            sub = self._query_subgraph(ent.get("id"), depth)
-            nodes.extend(sub["nodes"])
-            relations.extend(sub["relationships"])
-        return {"nodes": nodes, "relationships": relations}
-
-    def _query_subgraph(self, entity_id: str, depth: int) -> Dict[str, List[Dict]]:
+    @property
+    def graph(self):
+        """目前的圖譜後端，無可用後端時為 ``None``。"""
+        return self.builder.graph
+
+    def retrieve_for_line(self, line: str, depth: int = 1, record: LogRecord | None = None) -> Dict[str, List[Dict]]:
+        """依日誌行取得相關子圖；提供 ``record`` 時沿用已解析的欄位。"""
+        return self.retrieve_many([line], depth, [record])[0]
+
+    def retrieve_many(
+        self,
+        lines: Sequence[str],
+        depth: int = 1,
+        records: Sequence[LogRecord | None] | None = None,
+    ) -> List[Dict[str, List[Dict]]]:
+        """一次取得多行日誌的子圖，未命中快取的實體合併為單一查詢。"""
         if not self.graph:
-            return {"nodes": [], "relationships": []}
-        cypher = (
-            f"MATCH p=(n {{id:$eid}})-[*1..{depth}]-(m) "
-            "RETURN nodes(p) as nodes, relationships(p) as rels"
-        )
-        result = self.graph.run(cypher, eid=entity_id)
-        nodes: List[Dict] = []
-        rels: List[Dict] = []
-        for row in result:
-            for n in row.get("nodes", []):
-                nodes.append({
-                    "id": n.get("id"),
-                    "labels": list(getattr(n, "labels", [])),
-                    "properties": dict(n),
-                })
-            for r in row.get("rels", []):
-                rels.append({
-                    "start_id": r.start_node.get("id"),
-                    "end_id": r.end_node.get("id"),
-                    "type": type(r).__name__,
-                })
-        return {"nodes": nodes, "relationships": rels}
+            return [_empty() for _ in lines]
+        records = records or [None] * len(lines)
+        line_ids = [
+            [ent["id"] for ent in _extract_entities(line, record) if ent.get("id") is not None]
+            for line, record in zip(lines, records)
+        ]
+        subgraphs = self._lookup({eid for ids in line_ids for eid in ids}, depth)
+        results = []
+        for ids in line_ids:
+            # 每條路徑都會重複其節點，依 ID 與 (起點, 類型, 終點) 去重
+            nodes: Dict[str, Dict] = {}
+            relations: Dict[tuple, Dict] = {}
+            for eid in ids:
+                sub = subgraphs.get(eid) or _empty()
+                for node in sub["nodes"]:
+                    nodes.setdefault(node["id"], node)
+                for rel in sub["relationships"]:
+                    relations.setdefault((rel["start_id"], rel["type"], rel["end_id"]), rel)
+            results.append({"nodes": list(nodes.values()), "relationships": list(relations.values())})
+        return results
+
+    def _lookup(self, entity_ids: Iterable[str], depth: int) -> Dict[str, Dict[str, List[Dict]]]:
+        found: Dict[str, Dict[str, List[Dict]]] = {}
+        missing: List[str] = []
+        now = time.monotonic()
+        with self._lock:
+            for eid in entity_ids:
+                item = self._cache.get((eid, depth))
+                if item is not None and item[0] >= now:
+                    self._cache.move_to_end((eid, depth))
+                    found[eid] = item[1]
+                    self.hits += 1
+                else:
+                    missing.append(eid)
+                    self.misses += 1
+            version = self._version
+        if not missing:
+            return found
+        fetched = self._query_subgraphs(missing, depth)
+        with self._lock:
+            if version == self._version:
+                expires = time.monotonic() + self.ttl
+                for eid in missing:
+                    self._store((eid, depth), expires, fetched.get(eid) or _empty())
+        found.update(fetched)
+        return found
+
+    def _store(self, key: _CacheKey, expires: float, sub: Dict[str, List[Dict]]) -> None:
+        self._drop(key)
+        while len(self._cache) >= self.cache_size:
+            self._drop(next(iter(self._cache)))
+        self._cache[key] = (expires, sub)
+        for nid in {key[0], *(node["id"] for node in sub["nodes"])}:
+            self._containing.setdefault(nid, set()).add(key)
+
+    def _drop(self, key: _CacheKey) -> None:
+        item = self._cache.pop(key, None)
+        if item is None:
+            return
+        for nid in {key[0], *(node["id"] for node in item[1]["nodes"])}:
+            keys = self._containing.get(nid)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._containing[nid]
+
+    def invalidate(self, node_ids: Iterable[str]) -> None:
+        """移除包含任一指定節點的快取鄰域（由 ``GraphBuilder`` 寫入後呼叫）。"""
+        with self._lock:
+            self._version += 1
+            for nid in node_ids:
+                for key in list(self._containing.get(nid, ())):
+                    self._drop(key)
+                    self.invalidations += 1
+
+    def _query_subgraphs(self, entity_ids: List[str], depth: int) -> Dict[str, Dict[str, List[Dict]]]:
+        if not self.graph or not entity_ids:
+            return {}
+        self.queries += 1
+        return self.graph.neighbourhoods(list(entity_ids), depth, self.fanout)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "cached": len(self._cache),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "queries": self.queries,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,170 @@
+"""Neo4j 非同步批次寫入（write-behind）。
+
+處理流程只需呼叫 :meth:`GraphWriter.submit` 將實體與關係放入有上限的佇列；
+背景執行緒會跨多筆分析累積並合併（依 id 去重）後，以
+:class:`GraphBuilder` 的 ``UNWIND`` 批次語句寫入。佇列已滿時 ``submit`` 會
+阻塞，讓上游隨 Neo4j 的寫入速度自然降速；程式結束時會先清空佇列再離開。
+
+寫入失敗的批次不會丟棄，而是保留下來並與之後的項目合併，以指數退避
+（上限 ``GRAPH_WRITE_RETRY_MAX_SEC`` 秒）重試；連續失敗超過
+``GRAPH_WRITE_MAX_RETRIES`` 次，或程式結束時仍無法寫入，才捨棄並計入
+``dropped_*`` 統計。"""
+
+from __future__ import annotations
+
+import atexit
+import queue
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from .. import config
+from .graph_builder import GraphBuilder
+from .utils import logger
+
+_STOP = object()
+_FLUSH = object()
+
+
+class GraphWriter:
+    """以背景執行緒將實體與關係批次寫入 Neo4j。"""
+
+    def __init__(
+        self,
+        builder: GraphBuilder,
+        max_queue: int | None = None,
+        batch_size: int | None = None,
+        flush_interval: float | None = None,
+        max_retries: int | None = None,
+        retry_max: float | None = None,
+    ) -> None:
+        self.builder = builder
+        self.batch_size = batch_size or config.GRAPH_WRITE_BATCH_SIZE
+        self.flush_interval = flush_interval if flush_interval is not None else config.GRAPH_WRITE_FLUSH_SEC
+        self.max_retries = max_retries if max_retries is not None else config.GRAPH_WRITE_MAX_RETRIES
+        self.retry_max = retry_max if retry_max is not None else config.GRAPH_WRITE_RETRY_MAX_SEC
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue or config.GRAPH_WRITE_QUEUE_MAX)
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+        self._stats = {
+            "entities_written": 0, "relations_written": 0, "batches": 0, "errors": 0, "retries": 0,
+            "dropped_batches": 0, "dropped_entities": 0, "dropped_relations": 0, "last_flush_ms": 0.0,
+        }
+
+    def _ensure_thread(self) -> None:
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="graph-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, entities: List[Dict] | None = None, relations: List[Dict] | None = None,
+               timeout: float | None = None) -> None:
+        """將一筆分析的實體與關係排入寫入佇列；佇列滿時阻塞至多 ``timeout`` 秒。"""
+        if not self.builder.graph or not (entities or relations):
+            return
+        self._ensure_thread()
+        self._queue.put((list(entities or []), list(relations or [])), timeout=timeout)
+
+    def _run(self) -> None:
+        entities: Dict[str, Dict] = {}
+        relations: Dict[Tuple, Dict] = {}
+        pending = 0
+        failures = 0
+        retry_at = 0.0
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+            stop = item is _STOP
+            forced = stop or item is _FLUSH
+            if item is not None and not forced:
+                ents, rels = item
+                for ent in ents:
+                    if ent.get("id") is None:
+                        continue
+                    merged = entities.setdefault(str(ent["id"]), {"id": ent["id"], "label": ent.get("label"),
+                                                                  "properties": {}})
+                    merged["properties"].update(ent.get("properties") or {})
+                for rel in rels:
+                    relations[(rel.get("start_id"), rel.get("type"), rel.get("end_id"))] = rel
+                pending += 1
+            now = time.monotonic()
+            due = len(entities) + len(relations) >= self.batch_size or now >= deadline
+            # 退避期間即使批次已滿也不重試，只持續合併新項目
+            if forced or (due and now >= retry_at):
+                if self._write(list(entities.values()), list(relations.values())):
+                    failures = 0
+                elif stop or failures >= self.max_retries:
+                    self._drop(entities, relations, failures + 1)
+                    failures = 0
+                else:
+                    failures += 1
+                    self._stats["retries"] += 1
+                    retry_at = time.monotonic() + min(self.retry_max, 2 ** (failures - 1))
+                if not failures:
+                    entities, relations = {}, {}
+                    retry_at = 0.0
+                # 失敗的批次保留在本執行緒中重試，佇列項目仍視為已處理
+                for _ in range(pending):
+                    self._queue.task_done()
+                pending = 0
+                deadline = retry_at if failures else time.monotonic() + self.flush_interval
+            if forced:
+                self._queue.task_done()
+            if stop:
+                return
+
+    def _write(self, entities: List[Dict], relations: List[Dict]) -> bool:
+        """寫入一批節點與關係，失敗時回傳 ``False``。"""
+        if not entities and not relations:
+            return True
+        start = time.perf_counter()
+        try:
+            # 先寫節點，確保同一批關係的端點已存在
+            self._stats["entities_written"] += self.builder.create_entities(entities) or 0
+            self._stats["relations_written"] += self.builder.create_relations(relations) or 0
+            ok = True
+        except Exception as exc:
+            self._stats["errors"] += 1
+            logger.error("Graph batch write failed (%d entities, %d relations): %s",
+                         len(entities), len(relations), exc)
+            ok = False
+        self._stats["batches"] += 1
+        self._stats["last_flush_ms"] = (time.perf_counter() - start) * 1000
+        return ok
+
+    def _drop(self, entities: Dict, relations: Dict, attempts: int) -> None:
+        self._stats["dropped_batches"] += 1
+        self._stats["dropped_entities"] += len(entities)
+        self._stats["dropped_relations"] += len(relations)
+        logger.error("Dropping graph batch after %d failed attempts (%d entities, %d relations)",
+                     attempts, len(entities), len(relations))
+
+    def flush(self) -> None:
+        """立即寫入目前累積的項目，並等待佇列中所有項目處理完成。
+
+        寫入失敗時項目會留待重試，此方法不等待重試結果。
+        """
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_FLUSH)
+            self._queue.join()
+
+    def stop(self) -> None:
+        """寫入剩餘項目並結束背景執行緒。"""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        thread.join()
+
+    def stats(self) -> Dict[str, float]:
+        return {**self._stats, "queued": self._queue.qsize()}
+
+
+def create_writer(builder: GraphBuilder) -> GraphWriter:
+    """建立寫入器並於程式結束時清空其佇列。"""
+    writer = GraphWriter(builder)
+    atexit.register(writer.stop)
+    return writer
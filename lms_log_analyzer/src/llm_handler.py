@@ -3,13 +3,19 @@
 from __future__ import annotations
 
 import json
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Dict
 
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import SystemMessage, HumanMessage
 import re
 
 from .. import config
+from .cost_tracker import COST_TRACKER
+from .log_parser import LogRecord
+from .prompt_builder import build_prompt
+from .utils import logger, RateLimiter, retry_with_backoff, retryable_status
+from .verdict_cache import VERDICT_CACHE, verdict_key
 
 _SYSTEM_PROMPT = (
     "你是資安日誌分析助手，請依使用者輸入判斷是否為攻擊並輸出 JSON。\n"
@@ -17,10 +23,28 @@ _SYSTEM_PROMPT = (
     "{\"is_attack\": bool, \"attack_type\": str, \"entities\": list, \"relations\": list}"
 )
 
+_BATCH_SYSTEM_PROMPT = (
+    "你是資安日誌分析助手，使用者會一次提供多筆以編號標示的告警，請逐筆判斷是否為攻擊並輸出 JSON。\n"
+    "必須僅回傳 JSON 陣列，每筆告警對應一個元素，index 為告警編號，格式如下："
+    "[{\"index\": int, \"is_attack\": bool, \"attack_type\": str, \"entities\": list, \"relations\": list}]"
+)
+
+_CHAT: ChatGoogleGenerativeAI | None = None
+_RATE_LIMITER = RateLimiter(config.LLM_REQUESTS_PER_MINUTE, burst=config.LLM_MAX_CONCURRENCY)
+
 
-def _extract_entities(text: str) -> List[Dict]:
-    """簡易擷取 IP 與使用者名稱為實體 (供 GraphRetrievalTool 使用)。"""
+def _extract_entities(text: str, record: LogRecord | None = None) -> List[Dict]:
+    """簡易擷取 IP 與使用者名稱為實體 (供 GraphRetrievalTool 使用)。
+
+    若已有 :class:`LogRecord`，直接使用其解析結果，不再重新比對正規表示式。
+    """
     entities: List[Dict] = []
+    if record is not None:
+        if record.ip:
+            entities.append({"id": f"ip_{record.ip}", "label": "IP", "properties": {"address": record.ip}})
+        if record.user:
+            entities.append({"id": f"user_{record.user}", "label": "User", "properties": {"name": record.user}})
+        return entities
     for ip in re.findall(r"\b\d{1,3}(?:\.\d{1,3}){3}\b", text):
         entities.append({"id": f"ip_{ip}", "label": "IP", "properties": {"address": ip}})
     m = re.search(r"user(?:name)?[=:]?\s*(\w+)", text, re.I)
@@ -31,31 +55,164 @@ def _extract_entities(text: str) -> List[Dict]:
 
 
 def _chat() -> ChatGoogleGenerativeAI:
-    return ChatGoogleGenerativeAI(
-        model=config.LLM_MODEL_NAME,
-        google_api_key=config.GOOGLE_API_KEY or config.GEMINI_API_KEY,
+    """回傳共用的 Gemini client，避免每次呼叫都重新建立連線。"""
+    global _CHAT
+    if _CHAT is None:
+        _CHAT = ChatGoogleGenerativeAI(
+            model=config.LLM_MODEL_NAME,
+            google_api_key=config.GOOGLE_API_KEY or config.GEMINI_API_KEY,
+        )
+    return _CHAT
+
+
+def _is_retryable(exc: Exception) -> bool:
+    """判斷 LLM 呼叫失敗是否為 429／5xx 等暫時性錯誤。"""
+    for attr in ("status_code", "code", "status"):
+        if retryable_status(getattr(exc, attr, None)):
+            return True
+    resp = getattr(exc, "response", None)
+    if resp is not None and retryable_status(getattr(resp, "status_code", None)):
+        return True
+    text = str(exc)
+    return any(tok in text for tok in ("429", "ResourceExhausted", "503", "500 ", "ServiceUnavailable"))
+
+
+def _invoke(chat: ChatGoogleGenerativeAI, messages: List) -> Any:
+    """經限流器送出請求，暫時性錯誤以帶抖動的指數退避重試。"""
+
+    def _call():
+        _RATE_LIMITER.acquire()
+        return chat.invoke(messages)
+
+    return retry_with_backoff(
+        _call,
+        retries=config.LLM_MAX_RETRIES,
+        base_delay=config.LLM_RETRY_BASE_DELAY_SEC,
+        is_retryable=_is_retryable,
     )
 
 
-def llm_analyse(payloads: List[Dict]) -> List[Dict]:
-    """使用 Gemini Pro 產生安全分析結果。"""
+def _format_payload(payload: Dict) -> str:
+    """將單筆告警與其脈絡轉為提示文字（去重、排序並限制於 token 預算內）。"""
+    built = build_prompt(payload)
+    logger.debug("Prompt built with ~%d tokens (truncated=%s)", built.tokens, built.truncated)
+    return built.text
 
-    chat = _chat()
-    results: List[Dict] = []
-    for payload in payloads:
-        line = payload.get("alert", {}).get("original_log", "")
-        examples = payload.get("examples", [])
-        graph = payload.get("graph", {})
-        user_prompt = (
-            f"Log: {line}\n"
-            f"Examples: {examples}\n"
-            f"Graph: {json.dumps(graph, ensure_ascii=False)}"
-        )
-        messages = [SystemMessage(content=_SYSTEM_PROMPT), HumanMessage(content=user_prompt)]
-        try:
-            response = chat.invoke(messages)
-            data = json.loads(response.content)
-        except Exception:
-            data = {}
-        results.append(data)
+
+def _parse_json(content: str) -> Any:
+    """解析模型輸出的 JSON，容許外層包有 Markdown code fence。"""
+    text = content.strip()
+    if text.startswith("```"):
+        text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text)
+    return json.loads(text)
+
+
+def _analyse_single(chat: ChatGoogleGenerativeAI, payload: Dict) -> Dict:
+    """以單一請求分析一筆告警，失敗時回傳空 dict。"""
+    user_prompt = _format_payload(payload)
+    messages = [SystemMessage(content=_SYSTEM_PROMPT), HumanMessage(content=user_prompt)]
+    try:
+        response = _invoke(chat, messages)
+        COST_TRACKER.record_response(response, _SYSTEM_PROMPT + user_prompt)
+        data = _parse_json(response.content)
+    except Exception:
+        data = {}
+    return data if isinstance(data, dict) else {}
+
+
+def _analyse_batch(chat: ChatGoogleGenerativeAI, payloads: List[Dict]) -> List[Dict]:
+    """將多筆告警打包成單一請求，並依 ``index`` 對應回原本的順序。
+
+    回傳的陣列若不完整或格式錯誤，只有缺漏的項目會再逐筆重送。
+    """
+    user_prompt = "\n\n".join(
+        f"[Alert {i}]\n{_format_payload(p)}" for i, p in enumerate(payloads)
+    )
+    messages = [SystemMessage(content=_BATCH_SYSTEM_PROMPT), HumanMessage(content=user_prompt)]
+    try:
+        response = _invoke(chat, messages)
+        COST_TRACKER.record_response(response, _BATCH_SYSTEM_PROMPT + user_prompt, items=len(payloads))
+        data = _parse_json(response.content)
+    except Exception as exc:
+        logger.warning("Batched LLM call failed, retrying items individually: %s", exc)
+        data = []
+
+    results: List[Dict | None] = [None] * len(payloads)
+    if isinstance(data, list):
+        for item in data:
+            if not isinstance(item, dict):
+                continue
+            idx = item.get("index")
+            if isinstance(idx, int) and 0 <= idx < len(payloads) and results[idx] is None:
+                results[idx] = {k: v for k, v in item.items() if k != "index"}
+
+    for i, res in enumerate(results):
+        if res is None:
+            results[i] = _analyse_single(chat, payloads[i])
+    return results  # type: ignore[return-value]
+
+
+def _rebind_entities(verdict: Dict, source: str, line: str) -> Dict:
+    """將其他日誌行的判定套用到 ``line``，實體改由本行重新擷取。"""
+    data = dict(verdict)
+    if source == line or "entities" not in data:
+        return data
+    data["entities"] = _extract_entities(line)
+    ids = {e["id"] for e in data["entities"]}
+    data["relations"] = [
+        r for r in data.get("relations") or []
+        if r.get("start_id") in ids and r.get("end_id") in ids
+    ]
+    return data
+
+
+def llm_analyse(payloads: List[Dict], batch_size: int | None = None) -> List[Dict]:
+    """使用 Gemini Pro 產生安全分析結果。
+
+    先查詢 :data:`VERDICT_CACHE`，同一日誌樣板在本批次中也只送出一次。
+    其餘告警每 ``batch_size`` 筆（預設為 ``config.BATCH_SIZE``）合併為一次請求，
+    各請求以最多 ``config.LLM_MAX_CONCURRENCY`` 個執行緒併發送出，
+    回傳結果的順序與 ``payloads`` 相同。
+    """
+
+    lines = [p.get("alert", {}).get("original_log", "") for p in payloads]
+    results: List[Dict] = [{} for _ in payloads]
+    pending: Dict[str, List[int]] = {}
+    for i, line in enumerate(lines):
+        cached = VERDICT_CACHE.get(line)
+        if cached is not None:
+            results[i] = _rebind_entities(cached[0], cached[1], line)
+        else:
+            pending.setdefault(verdict_key(line), []).append(i)
+
+    groups = list(pending.values())
+    analyses = _dispatch([payloads[idxs[0]] for idxs in groups], batch_size)
+    for idxs, analysis in zip(groups, analyses):
+        source = lines[idxs[0]]
+        if analysis:
+            VERDICT_CACHE.put(source, analysis)
+        for i in idxs:
+            results[i] = _rebind_entities(analysis, source, lines[i])
     return results
+
+
+def _dispatch(payloads: List[Dict], batch_size: int | None = None) -> List[Dict]:
+    """分批併發送出請求並依輸入順序回傳結果。"""
+    size = max(1, batch_size or config.BATCH_SIZE)
+    chunks = [payloads[i:i + size] for i in range(0, len(payloads), size)]
+    if not chunks:
+        return []
+    chat = _chat()
+
+    def _run(chunk: List[Dict]) -> List[Dict]:
+        if len(chunk) == 1:
+            return [_analyse_single(chat, chunk[0])]
+        return _analyse_batch(chat, chunk)
+
+    workers = min(max(1, config.LLM_MAX_CONCURRENCY), len(chunks))
+    if workers == 1:
+        chunk_results = [_run(c) for c in chunks]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            chunk_results = list(pool.map(_run, chunks))
+    return [res for chunk in chunk_results for res in chunk]
@@ -0,0 +1,231 @@
+"""事件驅動的日誌目錄追蹤（follow 模式）。
+
+在沒有 Filebeat 的感測器上直接監看 ``LMS_TARGET_LOG_DIR``：Linux 上透過
+inotify 在檔案附加、改名（輪替）或新增時立即喚醒，其他平台或 inotify
+無法使用時改以定期 ``stat`` 比對。喚醒後只讀取有變動的檔案中新增的行，
+累積成微批次，達到 ``FILE_BATCH_LINES`` 行或最早一行已等待
+``FOLLOW_BATCH_MAX_WAIT_SEC`` 秒時交給處理函式；目錄閒置時不做任何讀取。"""
+
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import fnmatch
+import os
+import select
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Sequence, Set, Tuple
+
+from .. import config
+from . import log_reader
+from .utils import logger
+
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_WATCH_MASK = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+_EVENT = struct.Struct("iIII")
+# 等待事件時至少每隔此秒數醒來檢查是否應停止
+_STOP_CHECK_SEC = 0.5
+
+
+def _matches(name: str, patterns: Sequence[str]) -> bool:
+    return any(fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+
+class PollingWatcher:
+    """以 ``stat`` 比對 inode、大小與修改時間偵測變動的後備方案。"""
+
+    def __init__(self, directory: Path, patterns: Sequence[str] | None = None, interval: float | None = None):
+        self.directory = Path(directory)
+        self.patterns = list(patterns or config.LOG_FILE_PATTERNS)
+        self.interval = interval if interval is not None else config.FOLLOW_POLL_INTERVAL_SEC
+        self._seen = self._snapshot()
+
+    def _snapshot(self) -> Dict[Path, Tuple[int, int, int]]:
+        snap = {}
+        for path in log_reader.discover_logs(self.directory, self.patterns):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            snap[path] = (st.st_ino, st.st_size, st.st_mtime_ns)
+        return snap
+
+    def wait(self, timeout: float | None) -> Set[Path]:
+        """等待至多 ``timeout`` 秒，回傳期間有變動的檔案。"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            current = self._snapshot()
+            changed = {p for p, sig in current.items() if self._seen.get(p) != sig}
+            self._seen = current
+            if changed:
+                return changed
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return set()
+            time.sleep(self.interval if remaining is None else min(self.interval, remaining))
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyWatcher:
+    """以 Linux inotify 監看目錄，事件到達即喚醒。"""
+
+    def __init__(self, directory: Path, patterns: Sequence[str] | None = None):
+        self.directory = Path(directory)
+        self.patterns = list(patterns or config.LOG_FILE_PATTERNS)
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self._fd, os.fsencode(str(self.directory)), _WATCH_MASK) < 0:
+            err = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(err, f"inotify_add_watch failed for {self.directory}")
+
+    def wait(self, timeout: float | None) -> Set[Path]:
+        """等待至多 ``timeout`` 秒，回傳期間有事件的檔案。"""
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+        changed: Set[Path] = set()
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset + _EVENT.size <= len(data):
+                _, mask, _, length = _EVENT.unpack_from(data, offset)
+                name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0")
+                offset += _EVENT.size + length
+                if mask & _IN_Q_OVERFLOW:
+                    # 事件佇列溢位，無法得知哪些檔案變動，全部重新檢查
+                    changed.update(log_reader.discover_logs(self.directory, self.patterns))
+                elif name and not mask & _IN_DELETE:
+                    decoded = os.fsdecode(name)
+                    if _matches(decoded, self.patterns):
+                        changed.add(self.directory / decoded)
+        return {p for p in changed if p.exists()}
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+def _by_mtime(paths: Set[Path]) -> List[Path]:
+    """依修改時間排序，讓輪替出的舊檔先於新檔讀取。"""
+    keyed = []
+    for path in paths:
+        try:
+            keyed.append((path.stat().st_mtime, str(path), path))
+        except OSError:
+            continue
+    return [path for _, _, path in sorted(keyed)]
+
+
+def create_watcher(directory: Path, patterns: Sequence[str] | None = None):
+    """依 ``FOLLOW_WATCHER`` 建立 inotify 或輪詢監看器；inotify 不可用時自動改用輪詢。"""
+    if config.FOLLOW_WATCHER != "poll":
+        try:
+            return InotifyWatcher(directory, patterns)
+        except (OSError, AttributeError) as exc:
+            logger.warning("inotify unavailable, falling back to stat polling: %s", exc)
+    return PollingWatcher(directory, patterns)
+
+
+def follow(
+    handle: Callable[[List[log_reader.LogLine]], None],
+    checkpoints: Dict[str, Dict],
+    directory: Path | None = None,
+    stop: threading.Event | None = None,
+    watcher=None,
+    batch_size: int | None = None,
+    max_wait: float | None = None,
+    retry_max: float | None = None,
+) -> None:
+    """持續追蹤目錄直到 ``stop`` 被設定，將新行以微批次交給 ``handle``。
+
+    ``checkpoints`` 為已處理完成的位移，只用於啟動時決定起點；``handle``
+    負責在處理完一批後保存檢查點。``handle`` 拋出例外時不會結束追蹤：
+    該批各檔的讀取位置退回上次成功的檢查點，等待後重新讀取（間隔逐次
+    加倍，最長 ``retry_max`` 秒）。已刪除檔案的位置會被移除，避免記錄
+    無限增長，或被之後重複使用同一 inode 的新檔誤用。
+    """
+    directory = Path(directory or config.LMS_TARGET_LOG_DIR)
+    stop = stop or threading.Event()
+    batch_size = max(1, batch_size or config.FILE_BATCH_LINES)
+    max_wait = config.FOLLOW_BATCH_MAX_WAIT_SEC if max_wait is None else max_wait
+    retry_max = config.FOLLOW_RETRY_MAX_SEC if retry_max is None else retry_max
+    watcher = watcher or create_watcher(directory)
+    # 已讀入（但可能尚未處理完成）的位移，避免重複讀取仍在批次中的行；
+    # ``committed`` 則是已由 ``handle`` 處理完成的位移
+    positions = dict(checkpoints)
+    committed = dict(checkpoints)
+    pending: List[log_reader.LogLine] = []
+    first_pending = 0.0
+    failures = 0
+    retry: Set[Path] = set()
+
+    def flush() -> bool:
+        nonlocal pending, failures
+        if not pending:
+            return True
+        batch, pending = pending, []
+        try:
+            handle(batch)
+        except Exception as exc:
+            failures += 1
+            paths = {item.path for item in batch}
+            logger.error("Failed to process %d followed lines (attempt %d): %s", len(batch), failures, exc)
+            for path in paths:
+                if path in committed:
+                    positions[path] = committed[path]
+                else:
+                    positions.pop(path, None)
+            retry.update(Path(path) for path in paths)
+            return False
+        failures = 0
+        for item in batch:
+            committed[item.path] = item.checkpoint
+        return True
+
+    try:
+        changed: Set[Path] = set(log_reader.discover_logs(directory, watcher.patterns))
+        while not stop.is_set():
+            log_reader.prune(positions)
+            log_reader.prune(committed)
+            if changed:
+                for item in log_reader.iter_new_lines(_by_mtime(changed), positions):
+                    positions[item.path] = item.checkpoint
+                    if not pending:
+                        first_pending = time.monotonic()
+                    pending.append(item)
+                    if len(pending) >= batch_size and not flush():
+                        break
+            if pending and time.monotonic() - first_pending >= max_wait:
+                flush()
+            if retry:
+                # 失敗後等待再自檢查點重讀；等待期間的檔案變動也一併處理
+                stop.wait(min(retry_max, 2.0 ** (failures - 1)))
+                changed = watcher.wait(0) | retry
+                retry.clear()
+                continue
+            # 有待處理的行時最多等到批次時限；閒置時僅定期醒來檢查 stop
+            timeout = _STOP_CHECK_SEC
+            if pending:
+                timeout = min(timeout, max(0.0, first_pending + max_wait - time.monotonic()))
+            changed = watcher.wait(timeout)
+        flush()
+    finally:
+        watcher.close()
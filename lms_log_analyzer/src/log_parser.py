@@ -1,4 +1,8 @@
+import json
 import re
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, NamedTuple, Union
 
 try:
     from grok import GrokPattern
@@ -12,6 +16,28 @@ if GrokPattern is not None:
     except Exception:  # fallback silently if pattern unavailable
         APACHE_GROK = None
 
+# 正規化日誌行時依序遮蔽的可變欄位：時間戳、UUID／長十六進位 session ID、
+# key=value 形式的 session 參數、IP 與其餘數字
+_MASKS = [
+    (re.compile(r"\[\d{1,2}/\w{3}/\d{4}(?::\d{2}){3}(?: [+-]\d{4})?\]"), "<TS>"),
+    (re.compile(r"\b\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?"), "<TS>"),
+    (re.compile(r"\b[A-Z][a-z]{2} [ \d]\d \d{2}:\d{2}:\d{2}\b"), "<TS>"),
+    (re.compile(r"\b[0-9a-fA-F]{8}-(?:[0-9a-fA-F]{4}-){3}[0-9a-fA-F]{12}\b"), "<ID>"),
+    (re.compile(r"\b[0-9a-fA-F]{16,}\b"), "<ID>"),
+    (re.compile(r"((?:session|sess|sid|token|jsessionid|phpsessid)(?:_?id)?=)[^\s&;\"]+", re.I), r"\1<ID>"),
+    (re.compile(r"\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b"), "<IP>"),
+    (re.compile(r"\b(?:[0-9a-fA-F]{0,4}:){2,7}[0-9a-fA-F]{1,4}\b"), "<IP>"),
+    (re.compile(r"\d+(?:\.\d+)?"), "<NUM>"),
+]
+
+
+def mask_variables(line: str) -> str:
+    """遮蔽 IP、數字、時間戳與 session ID，回傳可作為快取鍵的日誌樣板。"""
+    text = line.strip()
+    for pattern, repl in _MASKS:
+        text = pattern.sub(repl, text)
+    return " ".join(text.split())
+
 
 def parse_line(line: str) -> dict:
     """Parse a log line using Grok when available."""
@@ -20,53 +46,271 @@ def parse_line(line: str) -> dict:
         if m:
             data = m.groupdict()
             extras = data.get("extras", "") or ""
-            rt = re.search(r"resp_time:(\d+(?:\.\d+)?)", extras)
+            rt = _RESP_TIME_RE.search(extras)
             if rt:
                 data["resp_time"] = rt.group(1)
             return data
     return {}
 
-def parse_status(line: str) -> int:
-    """Extract HTTP status code from a log line."""
+
+class LogRecord:
+    """Compact result of parsing one log line once.
+
+    The same record is shared by scoring, entity extraction and the prompt
+    builder so a line is never parsed twice.
+    """
+
+    __slots__ = ("raw", "fmt", "ip", "user", "method", "path", "status", "resp_time", "agent", "timestamp")
+
+    def __init__(self, raw: str, fmt: str = "raw", ip: str = "", user: str = "", method: str = "",
+                 path: str = "", status: int = 0, resp_time: float = 0.0, agent: str = "", timestamp: str = ""):
+        self.raw = raw
+        self.fmt = fmt
+        self.ip = ip
+        self.user = user
+        self.method = method
+        self.path = path
+        self.status = status
+        self.resp_time = resp_time
+        self.agent = agent
+        self.timestamp = timestamp
+
+    def fields(self) -> Dict[str, Union[str, int, float]]:
+        """Return the non-empty parsed fields (without the raw line)."""
+        return {k: getattr(self, k) for k in self.__slots__[1:] if getattr(self, k)}
+
+    def __repr__(self) -> str:
+        return f"LogRecord({self.fields()!r})"
+
+
+class LogFormat(NamedTuple):
+    """A registered log format: a cheap ``sniff`` test and the actual ``parse``."""
+
+    name: str
+    sniff: Callable[[str], bool]
+    parse: Callable[[str], Union[LogRecord, None]]
+
+
+_RESP_TIME_RE = re.compile(r"\b(?:resp_time|request_time|rt)\b[:=]\s*(\d+(?:\.\d+)?)")
+_STATUS_RE = re.compile(r"\"\S+\s+\S+\s+HTTP/\d\.\d\"\s+(\d{3})")
+_IP_RE = re.compile(r"\b\d{1,3}(?:\.\d{1,3}){3}\b")
+_USER_RE = re.compile(r"user(?:name)?[=:]?\s*(\w+)", re.I)
+
+_COMBINED_RE = re.compile(
+    r'^(?P<ip>\S+) \S+ (?P<user>\S+) \[(?P<ts>[^\]]+)\] '
+    r'"(?P<method>[A-Z]+) (?P<path>\S+)(?: HTTP/[\d.]+)?" (?P<status>\d{3}) \S+'
+    r'(?: "[^"]*" "(?P<agent>[^"]*)")?(?P<extras>.*)$'
+)
+_SYSLOG_RE = re.compile(
+    r"^(?P<ts>[A-Z][a-z]{2} [ \d]\d \d{2}:\d{2}:\d{2}|\d{4}-\d{2}-\d{2}T\S+) (?P<host>\S+) "
+    r"(?P<program>[\w./-]+)(?:\[\d+\])?: (?P<message>.*)$"
+)
+_AUTH_PROGRAMS = frozenset({"sshd", "sudo", "su", "login", "passwd", "systemd-logind", "vsftpd", "dovecot"})
+_AUTH_USER_RE = re.compile(
+    r"(?:for (?:invalid user )?|user[= ]|ruser=|USER=|^\s*)(?P<user>[\w.@-]+)(?= from| :| by|\s*$)"
+)
+_AUTH_IP_RE = re.compile(r"(?:from|rhost=)\s*(?P<ip>[0-9a-fA-F:.]+\d)")
+
+
+def _to_int(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _to_float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _parse_combined(line: str) -> Union[LogRecord, None]:
+    m = _COMBINED_RE.match(line)
+    if not m:
+        return None
+    rt = _RESP_TIME_RE.search(m.group("extras"))
+    user = m.group("user")
+    return LogRecord(
+        line, "combined", ip=m.group("ip"), user="" if user == "-" else user,
+        method=m.group("method"), path=m.group("path"), status=int(m.group("status")),
+        resp_time=float(rt.group(1)) if rt else 0.0, agent=m.group("agent") or "", timestamp=m.group("ts"),
+    )
+
+
+def _parse_syslog(line: str, auth: bool) -> Union[LogRecord, None]:
+    m = _SYSLOG_RE.match(line)
+    if not m:
+        return None
+    program = m.group("program").rsplit("/", 1)[-1]
+    if auth != (program in _AUTH_PROGRAMS):
+        return None
+    message = m.group("message")
+    if auth:
+        ip = _AUTH_IP_RE.search(message)
+        user = _AUTH_USER_RE.search(message)
+        ip_value = ip.group("ip") if ip else ""
+        user_value = user.group("user") if user else ""
+    else:
+        ip = _IP_RE.search(message)
+        user = _USER_RE.search(message)
+        ip_value = ip.group(0) if ip else ""
+        user_value = user.group(1) if user else ""
+    return LogRecord(line, "auth" if auth else "syslog", ip=ip_value, user=user_value, timestamp=m.group("ts"))
+
+
+_JSON_KEYS = {
+    "ip": ("client_ip", "remote_addr", "src_ip", "source_ip", "clientip", "ip"),
+    "user": ("user", "username", "remote_user", "user_name"),
+    "method": ("method", "http_method", "verb"),
+    "path": ("path", "url", "uri", "request_uri", "request"),
+    "status": ("status", "status_code", "response", "http_status"),
+    "resp_time": ("resp_time", "response_time", "request_time", "duration"),
+    "agent": ("user_agent", "http_user_agent", "agent"),
+    "timestamp": ("@timestamp", "timestamp", "time", "ts"),
+}
+
+
+def _parse_json(line: str) -> Union[LogRecord, None]:
+    try:
+        data = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    def pick(field):
+        for key in _JSON_KEYS[field]:
+            value = data.get(key)
+            if value not in (None, ""):
+                return value
+        return ""
+
+    return LogRecord(
+        line, "json", ip=str(pick("ip")), user=str(pick("user")), method=str(pick("method")),
+        path=str(pick("path")), status=_to_int(pick("status")), resp_time=_to_float(pick("resp_time")),
+        agent=str(pick("agent")), timestamp=str(pick("timestamp")),
+    )
+
+
+# Formats are tried in order; ``sniff`` must be a cheap substring/prefix check
+# so that only plausible parsers run their regular expression.
+FORMATS: List[LogFormat] = [
+    LogFormat("json", lambda line: line[:1] == "{", _parse_json),
+    LogFormat("combined", lambda line: ' HTTP/' in line or '] "' in line, _parse_combined),
+    LogFormat("auth", lambda line: "]: " in line or ": " in line[15:40], lambda line: _parse_syslog(line, True)),
+    LogFormat("syslog", lambda line: ": " in line, lambda line: _parse_syslog(line, False)),
+]
+
+
+def register_format(fmt: LogFormat, first: bool = False) -> None:
+    """Add a log format to the registry, optionally ahead of the built-in ones."""
+    if first:
+        FORMATS.insert(0, fmt)
+    else:
+        FORMATS.append(fmt)
+
+
+def _parse_grok(line: str) -> Union[LogRecord, None]:
     data = parse_line(line)
-    if data and data.get("response"):
-        try:
-            return int(data["response"])
-        except ValueError:
-            pass
-    m = re.search(r"\"\S+\s+\S+\s+HTTP/\d\.\d\"\s+(\d{3})", line)
-    if m:
+    if not data:
+        return None
+    user = data.get("auth") or ""
+    return LogRecord(
+        line, "grok", ip=data.get("clientip") or "", user="" if user == "-" else user,
+        method=data.get("verb") or "", path=data.get("request") or "", status=_to_int(data.get("response")),
+        resp_time=_to_float(data.get("resp_time")), agent=(data.get("agent") or "").strip('"'),
+        timestamp=data.get("timestamp") or "",
+    )
+
+
+def parse_record(line: str) -> LogRecord:
+    """Parse ``line`` once into a :class:`LogRecord`.
+
+    Registered formats are sniffed first; the expensive Grok pattern is only
+    used when none of them match, and a generic record built from a few
+    precompiled regular expressions is returned as the last resort.
+    """
+    for fmt in FORMATS:
+        if fmt.sniff(line):
+            record = fmt.parse(line)
+            if record is not None:
+                return record
+    record = _parse_grok(line) if APACHE_GROK is not None and ' HTTP/' in line else None
+    if record is not None:
+        return record
+    status = _STATUS_RE.search(line)
+    rt = _RESP_TIME_RE.search(line)
+    ip = _IP_RE.search(line)
+    user = _USER_RE.search(line)
+    return LogRecord(
+        line, ip=ip.group(0) if ip else "", user=user.group(1) if user else "",
+        status=int(status.group(1)) if status else 0, resp_time=float(rt.group(1)) if rt else 0.0,
+    )
+
+
+LineOrRecord = Union[str, LogRecord]
+
+
+def _record(line: LineOrRecord) -> LogRecord:
+    return line if isinstance(line, LogRecord) else parse_record(line)
+
+
+def event_time(line: LineOrRecord, now: Union[float, None] = None) -> Union[float, None]:
+    """Return the event time of a log line as epoch seconds, or ``None``.
+
+    Understands the combined-log ``[10/Oct/2023:13:55:36 +0000]`` form, ISO 8601
+    and epoch (seconds or milliseconds) values from JSON logs, and the year-less
+    syslog form; the latter takes the year of ``now`` unless that would put the
+    event more than a day in the future (a December line read in January).
+    """
+    ts = str(_record(line).timestamp or "").strip()
+    if not ts:
+        return None
+    try:
+        value = float(ts)
+        return value / 1000.0 if value > 1e11 else value
+    except ValueError:
+        pass
+    for parse in (
+        lambda text: datetime.strptime(text, "%d/%b/%Y:%H:%M:%S %z"),
+        lambda text: datetime.fromisoformat(text.replace("Z", "+00:00")),
+    ):
         try:
-            return int(m.group(1))
+            return parse(ts).timestamp()
         except ValueError:
-            pass
-    return 0
+            continue
+    try:
+        parsed = datetime.strptime(" ".join(ts.split()), "%b %d %H:%M:%S")
+    except ValueError:
+        return None
+    now = time.time() if now is None else now
+    year = datetime.fromtimestamp(now).year
+    value = parsed.replace(year=year).timestamp()
+    if value > now + 86400:
+        value = parsed.replace(year=year - 1).timestamp()
+    return value
+
 
-def response_time(text: str) -> float:
+def parse_status(line: LineOrRecord) -> int:
+    """Extract HTTP status code from a log line or parsed record."""
+    return _record(line).status
+
+
+def response_time(text: LineOrRecord) -> float:
     """Return the response time value in seconds if present."""
-    data = parse_line(text)
-    if data and data.get("resp_time"):
-        try:
-            return float(data["resp_time"])
-        except ValueError:
-            pass
-    m = re.search(r"resp_time:(\d+(?:\.\d+)?)", text)
-    if m:
-        try:
-            return float(m.group(1))
-        except ValueError:
-            pass
-    return 0.0
-
-def fast_score(line: str) -> float:
-    """A very rough heuristic scoring suspicious log lines."""
-    score = 0.0
-    lower = line.lower()
-    if '/etc/passwd' in lower:
-        score += 0.5
-    if 'nmap' in lower:
-        score += 0.3
-    status = parse_status(line)
-    if status >= 400:
-        score += 0.1
-    return min(score, 1.0)
+    return _record(text).resp_time
+
+
+def fast_score(line: LineOrRecord) -> float:
+    """A very rough heuristic scoring suspicious log lines.
+
+    Uses the configured :mod:`rule_engine` signatures; prefer
+    ``RULE_ENGINE.score_batch`` when scoring many lines.
+    """
+    from .rule_engine import RULE_ENGINE
+
+    if isinstance(line, LogRecord):
+        return float(RULE_ENGINE.score_batch([line.raw], statuses=[line.status])[0])
+    return float(RULE_ENGINE.score_batch([line])[0])
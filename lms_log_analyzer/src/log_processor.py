@@ -5,24 +5,63 @@
 查詢 Neo4j 子圖作為 GraphRAG 的額外脈絡。"""
 from __future__ import annotations
 
+import asyncio
+import atexit
+import copy
+import json
+import math
+import queue
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter
 from pathlib import Path
-from typing import List, Dict
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Sequence, Tuple
 
-from opensearchpy import OpenSearch
+import numpy as np
+from opensearchpy import OpenSearch, helpers
 
 from .. import config
-from .utils import logger, STATE, save_state
-from .log_parser import fast_score
-from .vector_db import VECTOR_DB, embed
-from .llm_handler import llm_analyse
-from . import wazuh_api
+from .utils import logger, STATE, STATE_LOCK, save_state
+from .persistence import PERSISTENCE
+from .log_parser import parse_record
+from .rule_engine import RULE_ENGINE
+from .template_miner import TEMPLATE_MINER
+from .sessionizer import SESSIONIZER
+from .cost_tracker import COST_TRACKER
+from .vector_db import VECTOR_DB, embed_many, set_encoder
+from .llm_handler import llm_analyse, _rebind_entities
+from . import log_follower, log_reader, wazuh_api
 from .graph_builder import GraphBuilder
+from .graph_writer import create_writer
 from .graph_retrieval_tool import GraphRetrievalTool
+from .pipeline import Pipeline, Stage
+from .worker_pool import create_pool
 
 
 # Initialize once so processed events accumulate into Neo4j
 GRAPH_BUILDER = GraphBuilder()
 GRAPH_RETRIEVER = GraphRetrievalTool(GRAPH_BUILDER)
+# 結束時依註冊的相反順序執行：先清空寫入佇列，再關閉後端（記憶體後端會寫出快照）
+atexit.register(GRAPH_BUILDER.close)
+# 圖譜寫入改由背景執行緒批次完成，處理流程只負責排入佇列
+GRAPH_WRITER = create_writer(GRAPH_BUILDER)
+
+# 狀態與向量資料改由背景排程合併寫入，處理流程只標記有變更
+PERSISTENCE.register("state", lambda: save_state(STATE))
+PERSISTENCE.register("vector_db", lambda: VECTOR_DB.save())
+
+# 啟用 ``LMS_CPU_WORKERS`` 時，過濾、評分、解析與句向量編碼改由多行程
+# worker pool 分片處理；未啟用時為 ``None``，直接在本行程計算
+CPU_POOL = create_pool()
+if CPU_POOL is not None:
+    set_encoder(CPU_POOL.encode)
+
+# 處理流程統計（例如因相似案例而省下的 LLM 呼叫次數），由 ``/stats`` 對外提供
+PIPELINE_STATS: Counter = Counter()
+# 最近一次 :func:`run_pipeline` 各階段的處理筆數、錯誤數與忙碌秒數
+PIPELINE_STAGE_STATS: Dict[str, Dict[str, float]] = {}
 
 # Lazily initialized OpenSearch client for polling logs
 _os_client: OpenSearch | None = None
@@ -42,131 +81,797 @@ def _get_os_client() -> OpenSearch:
     return _os_client
 
 
-def filter_logs(lines: List[str]) -> List[Dict]:
+def _rules():
+    """回傳負責整批過濾與評分的物件：worker pool 或本行程的規則引擎。"""
+    return CPU_POOL or RULE_ENGINE
+
+
+def _parse_records(lines: List[str]) -> List:
+    if CPU_POOL is not None:
+        return CPU_POOL.parse_records(lines)
+    return [parse_record(line) for line in lines]
+
+
+def filter_logs(lines: List[str], sources: Sequence[Dict | None] | None = None) -> List[Dict]:
     """使用簡單關鍵字篩選可疑日誌行。
 
-    此為漏斗的第一層防線，僅檢查行內是否包含 ``error`` 或 ``fail``，
-    並將原始字串包裝成類似 Wazuh 回傳格式的 dict。
+    此為漏斗的第一層防線，僅檢查行內是否包含規則設定中的過濾關鍵字
+    （預設為 ``error`` 或 ``fail``），整批以單一正規表示式掃描一次，
+    並將原始字串包裝成類似 Wazuh 回傳格式的 dict。``sources`` 與 ``lines``
+    對齊時，各行的來源（OpenSearch 文件或檔案位移）記錄於 ``source``。
+    """
+    mask = _rules().filter_mask(lines)
+    entries = []
+    for i in mask.nonzero()[0]:
+        entry = {"line": lines[i], "alert": {"original_log": lines[i]}}
+        if sources is not None and sources[i]:
+            entry["source"] = sources[i]
+        entries.append(entry)
+    return entries
+
+
+def _inherit_verdict(line: str, ids: Sequence[int], dists: Sequence[float]) -> Dict | None:
+    """若最近鄰案例已足以判定，回傳沿用其分析結果的 dict。
+
+    最近案例為攻擊且距離在 ``SIM_T_ATTACK_L2_THRESHOLD`` 內，或為正常案例且
+    距離在 ``SIM_N_NORMAL_L2_THRESHOLD`` 內時沿用。FAISS 的 flat、IVF 與 HNSW
+    索引回傳的是 L2 距離的平方，因此與門檻的平方比較；門檻與
+    ``inherited_distance`` 皆為一般 L2 距離。
+    """
+    for idx, dist in zip(ids, dists):
+        if idx < 0:
+            continue
+        case = VECTOR_DB.get_cases([idx])[0]
+        analysis = case.get("analysis") if case else None
+        if not analysis or "is_attack" not in analysis:
+            return None
+        threshold = (
+            config.SIM_T_ATTACK_L2_THRESHOLD if analysis["is_attack"] else config.SIM_N_NORMAL_L2_THRESHOLD
+        )
+        if dist > threshold ** 2:
+            return None
+        inherited = _rebind_entities(analysis, case.get("line", ""), line)
+        inherited.update({"inherited": True, "inherited_distance": math.sqrt(max(float(dist), 0.0))})
+        return inherited
+    return None
+
+
+def _group_by_template(
+    candidates: List[Dict], scores: np.ndarray
+) -> Tuple[List[Dict], List[List[Dict]], np.ndarray]:
+    """依 Drain 樣板將候選行分組，回傳各組代表行、組員清單與代表行的規則分數。
+
+    分組以批次為視窗；規則分數（``scores``，與 ``candidates`` 對齊）不同的行
+    （例如其中一行命中攻擊特徵）即使樣板相同也不會共用判定。每筆 entry 會
+    加上 ``template_id`` 與本批的 ``template_count``。
+    """
+    groups: Dict[Tuple[int, float], List[Dict]] = {}
+    first: Dict[Tuple[int, float], int] = {}
+    for i, (entry, score) in enumerate(zip(candidates, scores.tolist())):
+        key = (TEMPLATE_MINER.add(entry["line"]).cluster_id, score)
+        groups.setdefault(key, []).append(entry)
+        first.setdefault(key, i)
+    for (template_id, _), group in groups.items():
+        for entry in group:
+            entry["template_id"] = template_id
+            entry["template_count"] = len(group)
+    members = list(groups.values())
+    return [group[0] for group in members], members, scores[list(first.values())]
+
+
+def _defer(groups: List[List[Dict]]) -> None:
+    """把預算不足的組放入延後佇列，並與檢查點一同寫入 ``STATE["deferred"]``。
+
+    每組以 ``{"id", "members"}`` 保存，組員保留各自的 ``source``；重新啟動後
+    由 :func:`_restore_deferred` 放回佇列。佇列已滿而被捨棄的項目同時自
+    ``STATE`` 移除，其 OpenSearch 文件未標記完成，之後的輪詢會再次取回。
+    """
+    items = [{"id": uuid.uuid4().hex, "members": group} for group in groups]
+    dropped = COST_TRACKER.defer(items)
+    with STATE_LOCK:
+        backlog = STATE.setdefault("deferred", [])
+        # 狀態中保存副本：分析時會修改組員，背景寫入狀態時不可與之競爭
+        backlog.extend(copy.deepcopy(items))
+        if dropped:
+            gone = {item["id"] for item in dropped}
+            backlog[:] = [item for item in backlog if item["id"] not in gone]
+    PERSISTENCE.mark_dirty("state")
+
+
+def _restore_deferred() -> None:
+    with STATE_LOCK:
+        items = copy.deepcopy(STATE.get("deferred") or [])
+    dropped = COST_TRACKER.defer(items) if items else []
+    if dropped:
+        gone = {item["id"] for item in dropped}
+        with STATE_LOCK:
+            STATE["deferred"] = [item for item in STATE.get("deferred", []) if item["id"] not in gone]
+
+
+# 上次執行留下的延後項目放回佇列，預算有餘裕時再分析
+_restore_deferred()
+
+
+def _deferred_docs() -> set:
+    """回傳仍在延後佇列中的 OpenSearch 文件 ``(index, _id)``。"""
+    with STATE_LOCK:
+        items = list(STATE.get("deferred") or [])
+    return {
+        (index, doc_id)
+        for item in items
+        for member in item["members"]
+        for index, doc_id in (member.get("source") or {}).get("opensearch", [])
+    }
+
+
+def _deliver_deferred(entries: List[Dict], ids: List[str]) -> None:
+    """把延後項目的結果寫回各自的來源，並自 ``STATE["deferred"]`` 移除。
+
+    來自 OpenSearch 的行以 bulk API 更新原文件並標記完成；來自檔案或 HTTP
+    請求的行已沒有等待結果的呼叫端，改附加到 ``LMS_ANALYSIS_OUTPUT_FILE``。
+    回寫失敗的文件保持未完成，之後的輪詢會重新取回。
     """
-    result = []
-    for line in lines:
-        if "error" in line.lower() or "fail" in line.lower():
-            result.append({"line": line, "alert": {"original_log": line}})
-    return result
+    actions = []
+    others = []
+    for entry in entries:
+        docs = (entry.get("source") or {}).get("opensearch")
+        if not docs:
+            others.append(entry)
+            continue
+        doc = {"ai_analysis_completed": True, "analysis": entry.get("analysis", {})}
+        actions.extend({"_op_type": "update", "_index": index, "_id": doc_id, "doc": doc} for index, doc_id in docs)
+    if actions:
+        try:
+            _, errors = helpers.bulk(_get_os_client(), actions, raise_on_error=False)
+            if errors:
+                logger.error("Bulk update failed for %d deferred documents", len(errors))
+        except Exception as exc:
+            logger.error("Failed to write back deferred documents: %s", exc)
+    if others:
+        try:
+            with open(config.LMS_ANALYSIS_OUTPUT_FILE, "a", encoding="utf-8") as fh:
+                for entry in others:
+                    record = {"line": entry["line"], "source": entry.get("source"), "analysis": entry.get("analysis")}
+                    fh.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as exc:
+            logger.error("Failed to write deferred results to %s: %s", config.LMS_ANALYSIS_OUTPUT_FILE, exc)
+    done = set(ids)
+    with STATE_LOCK:
+        STATE["deferred"] = [item for item in STATE.get("deferred", []) if item["id"] not in done]
+    PERSISTENCE.mark_dirty("state")
+    PIPELINE_STATS["deferred_delivered"] += len(entries)
+
 
+class _Batch:
+    """在各處理階段之間傳遞的一批日誌與其中間結果。
+
+    ``done`` 為真表示後續階段已無事可做，``results`` 即為最終結果。
+    ``origins`` 與 ``selected`` 對齊：本批的行為 ``None``，自延後佇列補入的
+    項目為其佇列 id，這些項目的結果寫回各自的來源而不放入 ``results``。
+    """
 
-def analyse_lines(lines: List[str]) -> List[Dict]:
+    def __init__(self, lines: List[str], sources: Sequence[Dict | None] | None = None) -> None:
+        self.lines = lines
+        self.sources = sources
+        self.done = False
+        self.results: List[Dict] = []
+        self.candidates: List[Dict] = []
+        self.members: List[List[Dict]] = []
+        self.scores = np.zeros(0, dtype=np.float32)
+        self.sessions: List[List[Dict]] = []
+        self.absorbed: List[Dict] = []
+        self.waiting: List[List[Dict]] = []
+        self.selected: List[Dict] = []
+        self.selected_members: List[List[Dict]] = []
+        self.origins: List[str | None] = []
+        self.records: List = []
+        self.vecs = None
+        self.analyses: List[Dict] = []
+        self.prompts: List[Dict] = []
+        self.pending: List[int] = []
+
+    def finish(self, results: List[Dict]) -> "_Batch":
+        self.results = results
+        self.done = True
+        return self
+
+
+def _stage_prefilter(batch: _Batch) -> _Batch:
+    """關鍵字過濾、session 彙總與樣板分組。"""
+    # 階段 0：透過關鍵字快速排除明顯無害的行
+    candidates = filter_logs(batch.lines, batch.sources)
+    if not candidates:
+        return batch.finish([])
+
+    # 依來源 IP／使用者做視窗彙總：爆量的行合併為一筆 session 告警，
+    # 已告警 session 的後續行直接沿用其判定
+    sessions: List[List[Dict]] = []
+    absorbed: List[Dict] = []
+    if config.SESSION_ENABLED:
+        candidates, sessions, absorbed = SESSIONIZER.split(candidates)
+        PIPELINE_STATS["session_alerts"] += len(sessions)
+        PIPELINE_STATS["session_lines_folded"] += sum(len(g) - 1 for g in sessions) + len(absorbed)
+    batch.sessions = sessions
+    batch.absorbed = [entry for entry in absorbed if "analysis" in entry]
+    # 所屬 session 尚無判定（前一批仍在分析或已延後）的行不可丟棄：依 session
+    # 分組，以每組第一行為代表照常分析，結果套用到整組
+    waiting: Dict[str, List[Dict]] = {}
+    for entry in absorbed:
+        if "analysis" not in entry:
+            waiting.setdefault(entry["session_id"], []).append(entry)
+    batch.waiting = list(waiting.values())
+    PIPELINE_STATS["session_lines_waiting"] += len(absorbed) - len(batch.absorbed)
+
+    # 規則引擎整批評分一次，樣板分組與取樣共用同一組分數
+    scores = _rules().score_batch([entry["line"] for entry in candidates])
+    # 樣板探勘：之後的階段只處理每個樣板的代表行
+    members: List[List[Dict]] = [[entry] for entry in candidates]
+    if config.TEMPLATE_MINING_ENABLED:
+        total = len(candidates)
+        candidates, members, scores = _group_by_template(candidates, scores)
+        PIPELINE_STATS["template_members_folded"] += total - len(candidates)
+    batch.candidates, batch.members, batch.scores = candidates, members, scores
+    if not candidates and not sessions and not batch.waiting:
+        return batch.finish(batch.absorbed)
+    return batch
+
+
+def _stage_wazuh(batch: _Batch) -> _Batch:
+    """階段 1：如設定啟用，透過 Wazuh logtest 進一步比對規則。"""
+    if config.WAZUH_ENABLED:
+        # 整批去重、查詢快取後並行送出，不再逐行同步呼叫
+        alerts = wazuh_api.logtest_many([entry["line"] for entry in batch.candidates])
+        kept = [i for i, alert in enumerate(alerts) if alert]
+        batch.candidates = [batch.candidates[i] for i in kept]
+        batch.members = [batch.members[i] for i in kept]
+        batch.scores = batch.scores[kept]
+    if not batch.candidates and not batch.sessions and not batch.waiting:
+        return batch.finish(batch.absorbed)
+    return batch
+
+
+def _stage_score(batch: _Batch) -> _Batch:
+    """階段 2：規則評分、取樣與成本控管。"""
+    candidates, members = batch.candidates, batch.members
+    # 以前置階段的規則分數，透過 argpartition 取出分數最高的候選行；
+    # session 告警與等待判定的 session 行代表一整段爆量，不參與取樣一律送入後續階段
+    scores = batch.scores
+    top_n = max(1, int(len(candidates) * config.SAMPLE_TOP_PERCENT / 100))
+    order = RULE_ENGINE.top_indices(scores, top_n)
+    selected = [(group[0], group) for group in batch.sessions + batch.waiting]
+    selected += [(candidates[i], members[i]) for i in order]
+
+    # 成本控管：依最近一小時的花費決定本批可分析的數量，分數較低者延後；
+    # 預算有餘裕時補入有限數量的先前延後候選
+    allowed, drained = COST_TRACKER.admit_with_backlog(len(selected), config.COST_DRAIN_PER_BATCH)
+    origins: List[str | None] = [None] * len(selected)
+    if allowed < len(selected):
+        _defer([group for _, group in selected[allowed:]])
+        PIPELINE_STATS["deferred_for_budget"] += len(selected) - allowed
+        selected, origins = selected[:allowed], origins[:allowed]
+    for item in drained:
+        selected.append((item["members"][0], item["members"]))
+        origins.append(item["id"])
+    if not selected:
+        return batch.finish(batch.absorbed)
+    batch.selected = [entry for entry, _ in selected]
+    batch.selected_members = [group for _, group in selected]
+    batch.origins = origins
+    # 只有選中的行才完整解析一次，解析結果同時供實體擷取與提示使用；
+    # 解析結果不放入 entry，避免其隨結果一併持久化
+    batch.records = _parse_records([entry["line"] for entry in batch.selected])
+    return batch
+
+
+def _stage_embed(batch: _Batch) -> _Batch:
+    """階段 3：向量搜尋；最近鄰已能判定者不再送入 LLM。"""
+    selected = batch.selected
+    # 一次批次嵌入所有選定行，同一組向量供搜尋與寫入共用
+    batch.vecs = embed_many([entry["line"] for entry in selected])
+    batch.analyses = [{} for _ in selected]
+    batch.prompts = []
+    batch.pending = []
+    # 所有選定行以單次 FAISS 查詢完成 k-NN 搜尋
+    ids_mat, dists_mat = VECTOR_DB.search_many(batch.vecs, k=3)
+    for i, (entry, record, ids, dists) in enumerate(zip(selected, batch.records, ids_mat, dists_mat)):
+        # 最近鄰案例已能判定時直接沿用其結果，不再呼叫 LLM
+        inherited = _inherit_verdict(entry["line"], ids, dists)
+        if inherited is not None:
+            batch.analyses[i] = inherited
+            continue
+        examples = [c.get("line") for c in VECTOR_DB.get_cases(ids.tolist()) if c is not None]
+        batch.prompts.append({
+            "alert": entry.get("alert"),
+            "examples": examples,
+            "fields": record.fields(),
+        })
+        batch.pending.append(i)
+
+    avoided = len(selected) - len(batch.pending)
+    if avoided:
+        PIPELINE_STATS["llm_calls_avoided"] += avoided
+        logger.info("Similarity short-circuit skipped %d of %d LLM calls", avoided, len(selected))
+    return batch
+
+
+def _stage_graph(batch: _Batch) -> _Batch:
+    """所有待分析行的實體以單次圖譜查詢（或快取）取得子圖。"""
+    if batch.pending:
+        graphs = GRAPH_RETRIEVER.retrieve_many(
+            [batch.selected[i]["line"] for i in batch.pending],
+            records=[batch.records[i] for i in batch.pending],
+        )
+        for prompt, graph in zip(batch.prompts, graphs):
+            prompt["graph"] = graph
+    return batch
+
+
+def _stage_llm(batch: _Batch) -> _Batch:
+    """將準備好的提示送入 LLM 進行深度分析。"""
+    for i, analysis in zip(batch.pending, llm_analyse(batch.prompts) if batch.prompts else []):
+        batch.analyses[i] = analysis
+    PIPELINE_STATS["llm_prompts"] += len(batch.prompts)
+    return batch
+
+
+def _stage_persist(batch: _Batch) -> _Batch:
+    """把判定套用到各組員，排入圖譜寫入並保存新案例。"""
+    results: List[Dict] = []
+    drained: List[Dict] = []
+    drained_ids: List[str] = []
+    new_vecs = []
+    new_cases = []
+    rows = zip(batch.selected, batch.selected_members, batch.vecs, batch.analyses, batch.origins)
+    for entry, group, vec, analysis, origin in rows:
+        # 代表行的判定套用到同樣板的每一行，實體依各行重新擷取
+        for member in group:
+            member_analysis = analysis if member is entry else _rebind_entities(analysis, entry["line"], member["line"])
+            member["analysis"] = member_analysis
+            GRAPH_WRITER.submit(member_analysis.get("entities"), member_analysis.get("relations"))
+            (results if origin is None else drained).append(member)
+        if origin is not None:
+            drained_ids.append(origin)
+        if "session" in entry:
+            SESSIONIZER.record_verdict(entry["session"]["session_id"], analysis)
+        if not analysis.get("inherited"):
+            new_vecs.append(vec)
+            new_cases.append(entry)
+    results.extend(batch.absorbed)
+    if drained_ids:
+        _deliver_deferred(drained, drained_ids)
+
+    # Store new vectors along with the representative entries so future
+    # searches can surface them as examples. Inherited cases already have a
+    # close neighbour in the index and are not added again.
+    VECTOR_DB.add(new_vecs, new_cases)
+
+    # Persist state and vector index so that context is preserved between runs.
+    # Writes are deferred and coalesced by the background scheduler.
+    PERSISTENCE.mark_dirty(count=len(results))
+    return batch.finish(results)
+
+
+# 處理階段依序排列；kind 決定在 CPU executor 或各自的 I/O 執行緒池中執行
+STAGES: List[Tuple[str, object, str]] = [
+    ("prefilter", _stage_prefilter, "cpu"),
+    ("wazuh", _stage_wazuh, "io"),
+    ("score", _stage_score, "cpu"),
+    ("embed", _stage_embed, "cpu"),
+    ("graph", _stage_graph, "io"),
+    ("llm", _stage_llm, "io"),
+    ("persist", _stage_persist, "io"),
+]
+
+
+def analyse_lines(lines: List[str], sources: Sequence[Dict | None] | None = None) -> List[Dict]:
     """執行多層過濾流程並回傳分析結果。
 
     參數
     ----
     lines:
         待處理的原始日誌行，可來自檔案或 HTTP 服務。
+    sources:
+        與 ``lines`` 對齊的來源識別（OpenSearch 文件或檔案位移）；因預算延後
+        的行依此在之後寫回原來源。
 
     回傳
     ----
     list[dict]
-        通過所有過濾階段且已由語言模型分析之日誌行。
+        通過所有過濾階段且已由語言模型分析之日誌行；同一樣板的組員會沿用
+        代表行的判定一併回傳。因預算延後的行不在其中。爆量 session 另有一筆
+        ``"kind": "session"`` 的彙總項目，其 ``line`` 為合成的摘要而非原始日誌。
     """
-    # 階段 0：透過關鍵字快速排除明顯無害的行
-    candidates = filter_logs(lines)
+    batch = _Batch(lines, sources)
+    for _, func, _ in STAGES:
+        if batch.done:
+            break
+        batch = func(batch)
+    return batch.results
 
-    # 階段 1：如設定啟用，透過 Wazuh logtest 進一步比對規則
-    if config.WAZUH_ENABLED:
-        filtered: List[Dict] = []
-        for entry in candidates:
-            if wazuh_api.logtest(entry["line"]):
-                filtered.append(entry)
-        candidates = filtered
 
-    if not candidates:
-        return []
+def build_pipeline(queue_size: int | None = None, concurrency: Dict[str, int] | None = None) -> Pipeline:
+    """以 :data:`STAGES` 建立非同步管線，每個階段的並行數取自 ``PIPELINE_CONCURRENCY``。"""
+    concurrency = {**config.PIPELINE_CONCURRENCY, **(concurrency or {})}
+    stages = [Stage(name, func, kind, concurrency.get(name, 1)) for name, func, kind in STAGES]
+    return Pipeline(stages, queue_size or config.PIPELINE_QUEUE_SIZE)
+
 
-    # 階段 2：套用 ``log_parser`` 的啟發式規則計算分數
-    scored = [(entry, fast_score(entry["line"])) for entry in candidates]
-    scored.sort(key=lambda x: x[1], reverse=True)
+async def analyse_lines_async(pipeline: Pipeline, lines: List[str]) -> List[Dict]:
+    """透過已啟動的 ``pipeline`` 分析一批日誌，與其他批次重疊執行。"""
+    batch = await pipeline.submit(_Batch(lines))
+    return batch.results
 
-    top_n = max(1, int(len(scored) * config.SAMPLE_TOP_PERCENT / 100))
-    selected = [e for e, _ in scored[:top_n]]
 
-    # 階段 3：向量搜尋與圖譜查詢提供更多脈絡
-    prompts = []
-    for entry in selected:
-        vec = embed(entry["line"])
-        ids, _ = VECTOR_DB.search(vec, k=3)
-        examples = [c.get("line") for c in VECTOR_DB.get_cases(ids)]
-        graph = GRAPH_RETRIEVER.retrieve_for_line(entry["line"])
-        prompts.append({"alert": entry.get("alert"), "examples": examples, "graph": graph})
+def run_pipeline(batches: Iterable, to_lines, on_done, to_sources=None) -> int:
+    """以管線處理 ``batches``，每批完成後依原順序呼叫 ``on_done(batch, results)``。
 
-    # 最後階段：將準備好的提示送入 LLM 進行深度分析
-    analyses = llm_analyse(prompts) if prompts else []
+    ``to_lines`` 將來源的一批資料轉為日誌行，``to_sources`` 取得對齊的來源
+    識別；供讀檔與 OpenSearch 輪詢等同步呼叫端使用，回傳完成的批數。
+    """
+
+    async def _run() -> int:
+        pipeline = build_pipeline()
+        await pipeline.start()
+        try:
+            return await pipeline.map_ordered(
+                batches,
+                lambda item, batch: on_done(item, batch.results),
+                prepare=lambda item: _Batch(to_lines(item), to_sources(item) if to_sources else None),
+            )
+        finally:
+            await pipeline.close()
+            PIPELINE_STAGE_STATS.update(pipeline.stats())
+
+    return asyncio.run(_run())
+
+
+def _file_batch_lines(batch: List[log_reader.LogLine]) -> List[str]:
+    return [item.line for item in batch if item.line]
+
+
+def _file_batch_sources(batch: List[log_reader.LogLine]) -> List[Dict]:
+    return [{"file": item.path, "offset": item.checkpoint.get("offset")} for item in batch if item.line]
+
+
+def _commit_file_batch(batch: List[log_reader.LogLine]) -> None:
+    """批次分析完成後才把各檔位移寫入 ``STATE["files"]``，並移除已刪除檔案的檢查點。"""
+    with STATE_LOCK:
+        files = STATE.setdefault("files", {})
+        log_reader.commit(files, batch)
+        log_reader.prune(files)
+    PERSISTENCE.mark_dirty("state")
 
+
+def analyse_file_batch(batch: List[log_reader.LogLine]) -> List[Dict]:
+    """分析一批讀自日誌檔的行，完成後才把各檔位移寫入 ``STATE["files"]``。
+
+    因預算延後的行已連同來源保存在 ``STATE["deferred"]``，與檢查點在同一次
+    狀態寫入中持久化，因此位移照常前進。
+    """
+    lines = _file_batch_lines(batch)
+    results = analyse_lines(lines, _file_batch_sources(batch)) if lines else []
+    _commit_file_batch(batch)
+    return results
+
+
+def process_logs(
+    paths: List[Path] | None = None,
+    batch_size: int | None = None,
+    pipelined: bool = False,
+) -> List[Dict]:
+    """串流讀取日誌檔的新內容，分批呼叫 :func:`analyse_lines` 進行處理。
+
+    ``paths`` 預設為 ``LMS_TARGET_LOG_DIR`` 中的日誌檔。每個檔案的 inode 與
+    已讀位移記錄在 ``STATE["files"]``，每批分析完成後才前進，重新執行時只讀
+    新增的部分；同一時間最多只有一批（``FILE_BATCH_LINES`` 行）留在記憶體。
+    ``pipelined`` 為真時改以分段管線處理，多個批次在不同階段重疊執行。
+    """
+    if paths is None:
+        paths = log_reader.discover_logs()
+    with STATE_LOCK:
+        checkpoints = dict(STATE.get("files") or {})
+    batches = log_reader.micro_batches(log_reader.iter_new_lines(paths, checkpoints), batch_size)
     results: List[Dict] = []
-    for entry, analysis in zip(selected, analyses):
-        # Store new vectors along with the original entry so future searches
-        # can surface them as examples
-        vec = embed(entry["line"])
-        VECTOR_DB.add([vec], [entry])
-        entry["analysis"] = analysis
-        if analysis.get("entities"):
-            GRAPH_BUILDER.create_entities(analysis["entities"])
-        if analysis.get("relations"):
-            GRAPH_BUILDER.create_relations(analysis["relations"])
-        results.append(entry)
-
-    # Persist state and vector index so that context is preserved between runs
-    save_state(STATE)
-    VECTOR_DB.save()
+    if pipelined:
+        def _done(batch: List[log_reader.LogLine], batch_results: List[Dict]) -> None:
+            results.extend(batch_results)
+            _commit_file_batch(batch)
+
+        run_pipeline(batches, _file_batch_lines, _done, _file_batch_sources)
+    else:
+        for batch in batches:
+            results.extend(analyse_file_batch(batch))
+    with STATE_LOCK:
+        pruned = log_reader.prune(STATE.setdefault("files", {}))
+    if pruned:
+        PERSISTENCE.mark_dirty("state")
     return results
 
 
-def process_logs(paths: List[Path]) -> List[Dict]:
-    """讀取檔案並呼叫 :func:`analyse_lines` 進行處理。
+def follow_logs(
+    directory: Path | None = None,
+    stop: threading.Event | None = None,
+    pipelined: bool = False,
+) -> None:
+    """以 follow 模式持續追蹤日誌目錄，新行以微批次送入分析流程。
 
-    此輔助函式主要供單元測試使用，避免在測試中啟動完整的 FastAPI；
-    它僅將檔案內容逐行讀入後傳給 :func:`analyse_lines`。
+    ``pipelined`` 為真時，追蹤執行緒把批次放入有上限的佇列交給分段管線；
+    管線處理不及時追蹤端會在佇列上等待。
     """
-    lines: List[str] = []
-    for p in paths:
-        with open(p, "r", encoding="utf-8") as f:
-            lines.extend([l.rstrip("\n") for l in f])
-    return analyse_lines(lines)
+    with STATE_LOCK:
+        checkpoints = dict(STATE.get("files") or {})
+    if not pipelined:
+        log_follower.follow(analyse_file_batch, checkpoints, directory, stop)
+        return
+    stop = stop or threading.Event()
+    batches: "queue.Queue" = queue.Queue(maxsize=config.PIPELINE_QUEUE_SIZE)
+
+    def _follow() -> None:
+        try:
+            log_follower.follow(batches.put, checkpoints, directory, stop)
+        finally:
+            batches.put(None)
+
+    thread = threading.Thread(target=_follow, name="log-follower", daemon=True)
+    thread.start()
+    try:
+        run_pipeline(
+            iter(batches.get, None),
+            _file_batch_lines,
+            lambda batch, _: _commit_file_batch(batch),
+            _file_batch_sources,
+        )
+    finally:
+        stop.set()
+        # 讓仍在等待佇列空位的追蹤執行緒得以結束
+        while thread.is_alive():
+            try:
+                batches.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def _open_pit(client: OpenSearch, index: str) -> str | None:
+    """建立 point-in-time；叢集不支援時回傳 ``None`` 改用一般搜尋。"""
+    try:
+        resp = client.create_pit(index=index, params={"keep_alive": config.OPENSEARCH_PIT_KEEP_ALIVE})
+        return resp.get("pit_id")
+    except Exception as exc:
+        logger.warning("Point-in-time unavailable, paging without it: %s", exc)
+        return None
+
+
+def _close_pit(client: OpenSearch, pit_id: str) -> None:
+    try:
+        client.delete_pit(body={"pit_id": [pit_id]})
+    except Exception as exc:  # pragma: no cover - PIT expires on its own
+        logger.warning("Failed to delete point-in-time: %s", exc)
+
+
+def _group_hits(hits: List[Dict]) -> Dict[str, List[Dict]]:
+    """依 ``message`` 將文件分組，相同內容只分析一次。"""
+    by_line: Dict[str, List[Dict]] = {}
+    for hit in hits:
+        line = (hit.get("_source") or {}).get("message") or ""
+        by_line.setdefault(line, []).append(hit)
+    return by_line
+
+
+def _write_back(client: OpenSearch, by_line: Dict[str, List[Dict]], results: List[Dict]) -> None:
+    """以 bulk API 回寫分析結果。
+
+    被漏斗篩掉的文件同樣標記為已完成，避免每次輪詢都重新取回；因預算延後
+    的文件不標記，待延後佇列分析後由 :func:`_deliver_deferred` 回寫。
+    """
+    analyses = {r["line"]: r.get("analysis", {}) for r in results}
+    deferred = _deferred_docs()
+    actions = []
+    for line, group in by_line.items():
+        doc: Dict = {"ai_analysis_completed": True}
+        if line in analyses:
+            doc["analysis"] = analyses[line]
+        for hit in group:
+            if (hit["_index"], hit["_id"]) in deferred:
+                continue
+            actions.append({"_op_type": "update", "_index": hit["_index"], "_id": hit["_id"], "doc": doc})
+    if not actions:
+        return
+    _, errors = helpers.bulk(client, actions, raise_on_error=False)
+    if errors:
+        logger.error("Bulk update failed for %d documents", len(errors))
+
+
+class PollResult(NamedTuple):
+    """單次輪詢的結果：本 worker 處理的文件數與是否仍有積壓。"""
+
+    processed: int
+    has_more: bool
+
 
+def owns_document(doc_id: str, worker_id: int, workers: int) -> bool:
+    """以 ``_id`` 的 CRC32 對 ``workers`` 取餘數，決定文件是否由此 worker 負責。
 
-def process_new_logs(index: str = "filebeat-*") -> int:
+    僅在叢集不支援 point-in-time（因而無法以 ``slice`` 在伺服器端分割）時使用。
+    """
+    return workers <= 1 or zlib.crc32(doc_id.encode("utf-8")) % workers == worker_id
+
+
+def _cursor_key(index: str, worker_id: int, workers: int) -> str:
+    return f"{index}#{worker_id}/{workers}"
+
+
+# 各游標上次自頭掃描的時間（``time.monotonic()``）；啟動後第一次輪詢一律掃描
+_LAST_SWEEP: Dict[str, float] = {}
+
+
+class _Page(NamedTuple):
+    """一頁查詢結果中屬於此 worker 的文件，以及該頁最後一筆的排序值。"""
+
+    by_line: Dict[str, List[Dict]]
+    count: int
+    sort: List | None
+    last_id: str
+
+
+def _iter_pages(
+    client: OpenSearch,
+    index: str,
+    query: Dict,
+    size: int,
+    max_pages: int,
+    worker_id: int,
+    workers: int,
+    status: Dict,
+    search_after: List | None = None,
+) -> Iterator[_Page]:
+    """以 point-in-time 與 ``search_after`` 逐頁取回文件，結束或中斷時關閉 PIT。
+
+    依 ``@timestamp`` 與 ``_id`` 排序，``search_after`` 為起始位置。多個 worker
+    時以 PIT ``slice`` 在伺服器端分割，每個 worker 只讀取自己的部分。頁數達到
+    ``max_pages`` 而仍有資料時，將 ``status["has_more"]`` 設為真。
+    """
+    pit_id = _open_pit(client, index)
+    sliced = bool(pit_id) and workers > 1
+    if workers > 1 and not sliced:
+        logger.warning("Point-in-time unavailable, partitioning documents client-side")
+    pages = 0
+    try:
+        while True:
+            body: Dict = {
+                "size": size,
+                "_source": ["message"],
+                "query": query,
+                "sort": [{"@timestamp": {"order": "asc"}}, {"_id": {"order": "asc"}}],
+            }
+            if search_after is not None:
+                body["search_after"] = search_after
+            if sliced:
+                body["slice"] = {"id": worker_id, "max": workers}
+            if pit_id:
+                body["pit"] = {"id": pit_id, "keep_alive": config.OPENSEARCH_PIT_KEEP_ALIVE}
+                resp = client.search(body=body)
+                pit_id = resp.get("pit_id", pit_id)
+            else:
+                resp = client.search(index=index, body=body)
+            hits = resp.get("hits", {}).get("hits", [])
+            if not hits:
+                break
+            # 已在延後佇列中的文件不再重複取回分析
+            deferred = _deferred_docs()
+            mine = [
+                h for h in hits
+                if (sliced or owns_document(h["_id"], worker_id, workers)) and (h["_index"], h["_id"]) not in deferred
+            ]
+            pages += 1
+            search_after = hits[-1].get("sort")
+            yield _Page(_group_hits(mine), len(mine), search_after, hits[-1]["_id"])
+            if len(hits) < size or not search_after:
+                break
+            if pages >= max_pages:
+                status["has_more"] = True
+                break
+    finally:
+        if pit_id:
+            _close_pit(client, pit_id)
+
+
+def poll_opensearch(
+    index: str | None = None,
+    page_size: int | None = None,
+    worker_id: int | None = None,
+    workers: int | None = None,
+    max_pages: int | None = None,
+    pipelined: bool = False,
+) -> PollResult:
+    """讀取未分析的文件並處理屬於此 worker 的部分。
+
+    是否需要分析只由 ``must_not ai_analysis_completed`` 決定。未完成的文件以
+    point-in-time 搭配 ``search_after``（依 ``@timestamp`` 與 ``_id`` 排序）
+    分頁讀取，只取回 ``message`` 欄位；每頁一次送入 :func:`analyse_lines`，
+    再以 bulk API 一次回寫。每頁處理完後將最後一筆文件的時間戳與 ``_id``
+    記錄為游標，存於 ``STATE`` 並寫入 ``LOG_STATE_FILE``，下次輪詢由此接續。
+
+    較晚才寫入、時間戳早於游標的文件，以及回寫失敗的文件不會被游標之後的
+    查詢取回；因此每隔 ``OPENSEARCH_SWEEP_INTERVAL_SEC`` 秒（以及啟動後的第
+    一次輪詢）改由頭開始掃描所有未完成的文件。
+
+    ``pipelined`` 為真時，下一頁的查詢與前一頁的分析重疊進行；回寫與游標
+    仍依頁面順序前進。
+    """
+    client = _get_os_client()
+    index = index or config.OPENSEARCH_INDEX
+    size = page_size or config.OPENSEARCH_PAGE_SIZE
+    worker_id = config.WORKER_ID if worker_id is None else worker_id
+    workers = max(1, config.WORKER_COUNT if workers is None else workers)
+    max_pages = max_pages or config.OPENSEARCH_MAX_PAGES
+    key = _cursor_key(index, worker_id, workers)
+    with STATE_LOCK:
+        cursor = dict(STATE.get("opensearch_cursor", {}).get(key) or {})
+
+    query: Dict = {"bool": {"must_not": {"term": {"ai_analysis_completed": True}}}}
+    start: List | None = None
+    now = time.monotonic()
+    last_sweep = _LAST_SWEEP.get(key)
+    if last_sweep is None or now - last_sweep >= config.OPENSEARCH_SWEEP_INTERVAL_SEC:
+        _LAST_SWEEP[key] = now
+    elif cursor.get("timestamp") is not None and cursor.get("id") is not None:
+        start = [cursor["timestamp"], cursor["id"]]
+
+    status = {"has_more": False}
+    processed = 0
+
+    def _lines(page: _Page) -> List[str]:
+        return [line for line in page.by_line if line]
+
+    def _sources(page: _Page) -> List[Dict]:
+        return [{"opensearch": [[h["_index"], h["_id"]] for h in page.by_line[line]]} for line in _lines(page)]
+
+    def _done(page: _Page, results: List[Dict]) -> None:
+        nonlocal processed
+        if page.count:
+            _write_back(client, page.by_line, results)
+            processed += page.count
+        if not page.sort:
+            return
+        with STATE_LOCK:
+            cursors = STATE.setdefault("opensearch_cursor", {})
+            current = cursors.get(key) or {}
+            # 掃描時的頁面可能位於游標之前，游標只會往後移動
+            position = [page.sort[0], page.last_id]
+            if current.get("timestamp") is None or position > [current["timestamp"], current.get("id", "")]:
+                cursors[key] = {"timestamp": page.sort[0], "id": page.last_id}
+        PERSISTENCE.mark_dirty("state")
+
+    pages = _iter_pages(client, index, query, size, max_pages, worker_id, workers, status, start)
+    try:
+        if pipelined:
+            run_pipeline(pages, _lines, _done, _sources)
+        else:
+            for page in pages:
+                lines = _lines(page)
+                _done(page, analyse_lines(lines, _sources(page)) if lines else [])
+    finally:
+        pages.close()
+    return PollResult(processed, status["has_more"])
+
+
+def process_new_logs(index: str | None = None, page_size: int | None = None) -> int:
     """Query OpenSearch for new logs and analyse them.
 
+    Thin wrapper around :func:`poll_opensearch` using the configured worker
+    partition.
+
     Parameters
     ----------
     index:
-        Index pattern to search for log documents.
+        Index pattern to search for log documents. Defaults to
+        ``config.OPENSEARCH_INDEX``.
+    page_size:
+        Documents per page. Defaults to ``config.OPENSEARCH_PAGE_SIZE``.
 
     Returns
     -------
     int
         Number of documents processed.
     """
-    client = _get_os_client()
-    query = {
-        "query": {
-            "bool": {"must_not": {"term": {"ai_analysis_completed": True}}}
-        }
-    }
-    resp = client.search(index=index, body=query, size=100)
-    hits = resp.get("hits", {}).get("hits", [])
-    for hit in hits:
-        line = hit.get("_source", {}).get("message", "")
-        if not line:
-            continue
-        results = analyse_lines([line])
-        if not results:
-            continue
-        analysis = results[0].get("analysis", {})
-        update_body = {
-            "doc": {
-                "analysis": analysis,
-                "ai_analysis_completed": True,
-            }
-        }
-        client.update(index=hit["_index"], id=hit["_id"], body=update_body)
-    return len(hits)
+    return poll_opensearch(index=index, page_size=page_size).processed
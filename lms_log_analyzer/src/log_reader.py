@@ -0,0 +1,230 @@
+"""串流讀取 ``LMS_TARGET_LOG_DIR`` 下的日誌檔。
+
+檔案以固定大小的區塊讀取並切成行，``.gz``／``.bz2`` 則邊讀邊解壓縮，
+記憶體用量與檔案大小無關。每行附帶讀完該行後的位移，呼叫端在整批
+處理完成後把位移寫回檢查點，下次即可從中斷處繼續。
+
+檢查點格式為 ``{路徑: {"inode", "offset", "size"}}``，存放於
+``LOG_STATE_FILE`` 的 ``files`` 區段：
+
+* inode 改變代表原路徑已被輪替成新檔，從頭讀取；
+* 檔案比記錄的位移還小代表被截斷（copytruncate），同樣從頭讀取；
+* 新路徑的 inode 若與其他路徑的檢查點相同，代表舊檔被改名
+  （``app.log`` → ``app.log.1``），沿用原本的位移。
+
+壓縮檔的位移以解壓縮後的位元組計算；讀完整個檔案後標記為 ``complete``，
+之後除非檔案大小改變，否則不再開啟。
+
+logrotate 的 ``compress`` 會把已讀過的 ``app.log.1`` 壓縮成新 inode 的
+``app.log.2.gz``，inode 無法對應。因此檢查點另記錄檔案開頭（解壓縮後）
+至多 ``_FINGERPRINT_BYTES`` 位元組的雜湊與其長度；找不到 inode 時以相同
+長度的開頭內容比對，內容相同即沿用原檔的位移。"""
+
+from __future__ import annotations
+
+import bz2
+import gzip
+import hashlib
+import os
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, Iterator, List, NamedTuple, Sequence, Tuple, TypeVar
+
+from .. import config
+from .utils import logger
+
+_COMPRESSED = {".gz": gzip.open, ".bz2": bz2.open}
+# 內容指紋取檔案開頭的位元組數；開頭太短的檔案容易雷同，不以指紋比對
+_FINGERPRINT_BYTES = 4096
+_FINGERPRINT_MIN_BYTES = 64
+
+T = TypeVar("T")
+
+
+class LogLine(NamedTuple):
+    """一行日誌與讀完此行後的檢查點。"""
+
+    path: str
+    line: str
+    checkpoint: Dict
+
+
+def is_compressed(path: Path) -> bool:
+    return Path(path).suffix in _COMPRESSED
+
+
+def open_log(path: Path) -> BinaryIO:
+    """以二進位模式開啟日誌檔，壓縮檔以串流方式解壓縮。"""
+    opener = _COMPRESSED.get(Path(path).suffix)
+    if opener is not None:
+        return opener(path, "rb")
+    return open(path, "rb")
+
+
+def discover_logs(directory: Path | None = None, patterns: Sequence[str] | None = None) -> List[Path]:
+    """列出目錄中符合樣式的日誌檔，依修改時間由舊到新排序（輪替出的舊檔先讀）。"""
+    directory = Path(directory or config.LMS_TARGET_LOG_DIR)
+    found = {p for pattern in (patterns or config.LOG_FILE_PATTERNS) for p in directory.glob(pattern) if p.is_file()}
+    return sorted(found, key=lambda p: (p.stat().st_mtime, str(p)))
+
+
+def fingerprint(path: Path, size: int = _FINGERPRINT_BYTES) -> Tuple[str, int]:
+    """回傳檔案開頭（解壓縮後）至多 ``size`` 位元組的 SHA-1 與實際長度。"""
+    with open_log(path) as fh:
+        head = fh.read(size)
+    return hashlib.sha1(head).hexdigest(), len(head)
+
+
+def _checkpoint_for(path: Path, st: os.stat_result, checkpoints: Dict[str, Dict]) -> Tuple[Dict | None, bool]:
+    """回傳 ``(檢查點, 是否為同一 inode)``。"""
+    cp = checkpoints.get(str(path))
+    if cp is not None and cp.get("inode") == st.st_ino:
+        return cp, True
+    # 原路徑沒有同一檔案的紀錄時，尋找被改名前的檢查點
+    cp = next((c for c in checkpoints.values() if c.get("inode") == st.st_ino), None)
+    if cp is not None:
+        return cp, True
+    # 壓縮輪替會產生新 inode，改以開頭內容比對
+    heads: Dict[int, str] = {}
+    for c in checkpoints.values():
+        size = c.get("fingerprint_bytes") or 0
+        if size < _FINGERPRINT_MIN_BYTES:
+            continue
+        if size not in heads:
+            try:
+                digest, length = fingerprint(path, size)
+            except (OSError, EOFError):
+                return None, False
+            heads[size] = digest if length == size else ""
+        if heads[size] == c.get("fingerprint"):
+            return c, False
+    return None, False
+
+
+def resume_offset(path: Path, st: os.stat_result, checkpoints: Dict[str, Dict]) -> int | None:
+    """依檢查點決定 ``path`` 應從哪個位移開始讀取；已無新資料時回傳 ``None``。"""
+    return _resume(path, st, *_checkpoint_for(path, st, checkpoints))
+
+
+def _resume(path: Path, st: os.stat_result, cp: Dict | None, same_inode: bool) -> int | None:
+    if cp is None:
+        return 0
+    if not same_inode:
+        # 內容相同的另一個檔案（例如被壓縮的輪替檔）：解壓縮後的位移與原檔一致
+        logger.info("%s matches the checkpoint of a rotated file, resuming at %d", path, cp["offset"])
+        return cp["offset"]
+    if is_compressed(path):
+        # 壓縮檔大小改變代表是另一個檔案
+        if cp.get("size") != st.st_size:
+            return 0
+        return None if cp.get("complete") else cp["offset"]
+    if cp["offset"] > st.st_size:
+        logger.info("%s was truncated, reading from the start", path)
+        return 0
+    return None if cp["offset"] == st.st_size else cp["offset"]
+
+
+def read_lines(path: Path, offset: int = 0, chunk_size: int | None = None) -> Iterator[tuple[str, int]]:
+    """自 ``offset`` 起逐行產生 ``(行, 讀完此行後的位移)``。
+
+    未壓縮檔案結尾若沒有換行，視為仍在寫入中的半行，不會產生；壓縮檔則
+    視為完整檔案，最後一行照常產生。
+    """
+    chunk_size = chunk_size or config.FILE_READ_CHUNK_BYTES
+    compressed = is_compressed(path)
+    with open_log(path) as fh:
+        if offset:
+            # gzip／bz2 的 seek 會解壓縮並丟棄前段資料，記憶體用量仍固定
+            fh.seek(offset)
+        pos = offset
+        pending = b""
+        while True:
+            chunk = fh.read(chunk_size)
+            if not chunk:
+                break
+            pending += chunk
+            start = 0
+            while True:
+                nl = pending.find(b"\n", start)
+                if nl < 0:
+                    break
+                pos += nl + 1 - start
+                yield pending[start:nl].rstrip(b"\r").decode("utf-8", "replace"), pos
+                start = nl + 1
+            pending = pending[start:]
+        if pending and compressed:
+            yield pending.rstrip(b"\r").decode("utf-8", "replace"), pos + len(pending)
+
+
+def iter_new_lines(
+    paths: Iterable[Path],
+    checkpoints: Dict[str, Dict],
+    chunk_size: int | None = None,
+) -> Iterator[LogLine]:
+    """依序串流多個檔案自上次檢查點之後的新行。
+
+    ``checkpoints`` 不會被修改；請在處理完成後以 :func:`commit` 寫回。
+    壓縮檔最後一行的檢查點標記為 ``complete``，之後不再開啟該檔；壓縮檔在
+    檢查點之後已沒有資料，或檢查點來自改名前的路徑時，產生一筆空行帶出
+    此路徑的檢查點。
+    """
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError as exc:
+            logger.warning("Cannot stat %s: %s", path, exc)
+            continue
+        cp, same_inode = _checkpoint_for(path, st, checkpoints)
+        offset = _resume(path, st, cp, same_inode)
+        # 檢查點來自其他路徑（改名或壓縮輪替）時，即使沒有新行也要記到新路徑下，
+        # 否則原路徑被新檔覆寫後就再也找不到這份檢查點
+        moved = cp is not None and checkpoints.get(str(path)) is not cp
+        if offset is None:
+            if moved:
+                yield LogLine(str(path), "", {**cp, "inode": st.st_ino, "size": st.st_size})
+            continue
+        compressed = is_compressed(path)
+        previous: LogLine | None = None
+        base: Dict | None = None
+        try:
+            digest, length = fingerprint(path)
+            base = {"inode": st.st_ino, "size": st.st_size, "fingerprint": digest, "fingerprint_bytes": length}
+            for line, pos in read_lines(path, offset, chunk_size):
+                if previous is not None:
+                    yield previous
+                previous = LogLine(str(path), line, {**base, "offset": pos})
+        except (OSError, EOFError) as exc:
+            logger.error("Failed reading %s: %s", path, exc)
+            compressed = False
+        if previous is None and (compressed or moved) and base is not None:
+            previous = LogLine(str(path), "", {**base, "offset": offset})
+        if previous is not None:
+            if compressed:
+                previous.checkpoint["complete"] = True
+            yield previous
+
+
+def micro_batches(items: Iterable[T], size: int | None = None) -> Iterator[List[T]]:
+    """將任意迭代器切成最多 ``size`` 筆的批次。"""
+    size = max(1, size or config.FILE_BATCH_LINES)
+    batch: List[T] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def commit(checkpoints: Dict[str, Dict], batch: Iterable[LogLine]) -> None:
+    """把批次中每個檔案的最後位移寫入 ``checkpoints``。"""
+    for item in batch:
+        checkpoints[item.path] = item.checkpoint
+
+
+def prune(checkpoints: Dict[str, Dict]) -> int:
+    """移除已不存在之檔案的檢查點，回傳移除筆數。"""
+    gone = [path for path in checkpoints if not os.path.exists(path)]
+    for path in gone:
+        del checkpoints[path]
+    return len(gone)
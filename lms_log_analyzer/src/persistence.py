@@ -0,0 +1,119 @@
+"""延遲且合併的持久化排程。
+
+處理流程只需呼叫 :meth:`PersistenceScheduler.mark_dirty`，實際寫入由背景
+執行緒在累積足夠變更、距離上次寫入超過設定秒數，或程式結束時才統一執行，
+API 回應時間因此不再包含與案例庫大小成正比的磁碟 I/O。"""
+
+from __future__ import annotations
+
+import atexit
+import threading
+import time
+from typing import Callable, Dict, Iterable
+
+from .. import config
+from .utils import logger
+
+
+class PersistenceScheduler:
+    """管理多個持久化目標並依時間或變更數量觸發寫入。"""
+
+    def __init__(self, interval_sec: float | None = None, max_dirty: int | None = None):
+        self.interval_sec = float(interval_sec if interval_sec is not None else config.PERSIST_INTERVAL_SEC)
+        self.max_dirty = max_dirty if max_dirty is not None else config.PERSIST_MAX_DIRTY
+        self._targets: Dict[str, Callable[[], int | None]] = {}
+        self._dirty: Dict[str, int] = {}
+        self._dirty_since: Dict[str, float] = {}
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._stopping = False
+        self._stats = {"flushes": 0, "bytes_written": 0, "last_flush_ms": 0.0, "total_flush_ms": 0.0, "errors": 0}
+
+    def register(self, name: str, flush: Callable[[], int | None]) -> None:
+        """註冊持久化目標；``flush`` 回傳寫入的位元組數（未知時可回傳 ``None``）。"""
+        self._targets[name] = flush
+
+    def mark_dirty(self, name: str | None = None, count: int = 1) -> None:
+        """標記目標有待寫入的變更；``name`` 為 ``None`` 時標記全部目標。"""
+        names = [name] if name else list(self._targets)
+        with self._cond:
+            now = time.monotonic()
+            for n in names:
+                self._dirty[n] = self._dirty.get(n, 0) + max(1, count)
+                self._dirty_since.setdefault(n, now)
+            if any(c >= self.max_dirty for c in self._dirty.values()):
+                self._cond.notify()
+        self._ensure_thread()
+
+    def flush(self, names: Iterable[str] | None = None) -> int:
+        """立即寫入指定（預設為全部）有變更的目標，回傳寫入位元組數。"""
+        with self._cond:
+            wanted = list(names) if names is not None else list(self._dirty)
+            pending = [n for n in wanted if n in self._dirty]
+            for n in pending:
+                self._dirty.pop(n, None)
+                self._dirty_since.pop(n, None)
+        if not pending:
+            return 0
+        written = 0
+        with self._flush_lock:
+            start = time.perf_counter()
+            for n in pending:
+                try:
+                    written += self._targets[n]() or 0
+                except Exception as exc:
+                    self._stats["errors"] += 1
+                    logger.error("Persisting %s failed: %s", n, exc)
+                    self.mark_dirty(n)
+            elapsed = (time.perf_counter() - start) * 1000
+            self._stats["flushes"] += 1
+            self._stats["bytes_written"] += written
+            self._stats["last_flush_ms"] = elapsed
+            self._stats["total_flush_ms"] += elapsed
+        logger.debug("Flushed %s: %d bytes in %.1f ms", ", ".join(pending), written, elapsed)
+        return written
+
+    def _due(self) -> bool:
+        now = time.monotonic()
+        return any(
+            self._dirty[n] >= self.max_dirty or now - self._dirty_since[n] >= self.interval_sec
+            for n in self._dirty
+        )
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._stopping and not self._due():
+                    self._cond.wait(timeout=min(1.0, self.interval_sec))
+                if self._stopping:
+                    return
+            self.flush()
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            with self._cond:
+                if self._stopping or (self._thread is not None and self._thread.is_alive()):
+                    return
+                self._thread = threading.Thread(target=self._run, name="persistence-flusher", daemon=True)
+                self._thread.start()
+
+    def stop(self, flush: bool = True) -> None:
+        """停止背景執行緒，預設在結束前寫入所有待處理變更。"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        if flush:
+            self.flush()
+
+    def stats(self) -> Dict[str, float]:
+        """回傳寫入次數、耗時、位元組數與目前待寫入的變更數。"""
+        with self._cond:
+            pending = dict(self._dirty)
+        return {**self._stats, "pending": pending}
+
+
+PERSISTENCE = PersistenceScheduler()
+atexit.register(PERSISTENCE.stop)
@@ -0,0 +1,200 @@
+"""以 asyncio 佇列串接的分段處理引擎。
+
+每個 :class:`Stage` 由 ``concurrency`` 個 worker 組成，前後階段之間以有上限
+的 ``asyncio.Queue`` 串接；下游處理不及時佇列會被填滿，上游的 ``put`` 隨之
+等待，壓力一路傳回 :meth:`Pipeline.submit`，記憶體中的批次數因此有上限。
+
+階段函式本身是同步函式：``kind="cpu"`` 的階段在共用的 CPU executor 中執行，
+``kind="io"`` 的階段各自擁有大小等於其並行數的執行緒池，讓網路等待與 CPU
+運算在不同批次之間重疊。函式回傳的物件會交給下一個階段；物件的 ``done``
+屬性為真時略過其餘階段直接完成。"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from collections import Counter
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Sequence
+
+
+_STOP = object()
+
+
+class Stage(NamedTuple):
+    """處理階段的定義。"""
+
+    name: str
+    func: Callable[[Any], Any]
+    kind: str = "io"
+    concurrency: int = 1
+
+
+class Pipeline:
+    """多階段、有背壓的非同步處理管線。
+
+    必須在事件迴圈中先呼叫 :meth:`start`；:meth:`submit` 回傳最後一個
+    階段的輸出，佇列已滿時會等待。
+    """
+
+    def __init__(
+        self,
+        stages: Sequence[Stage],
+        queue_size: int = 4,
+        cpu_executor: Executor | None = None,
+    ) -> None:
+        self.stages = list(stages)
+        self.queue_size = max(1, queue_size)
+        self._own_cpu = cpu_executor is None
+        self._cpu = cpu_executor
+        self._io: Dict[str, ThreadPoolExecutor] = {}
+        self._queues: List[asyncio.Queue] = []
+        self._workers: List[asyncio.Task] = []
+        self._busy: Counter = Counter()
+        self._stats: Dict[str, Dict[str, float]] = {
+            s.name: {"items": 0, "errors": 0, "busy_sec": 0.0} for s in self.stages
+        }
+
+    def _executor(self, stage: Stage) -> Executor:
+        if stage.kind == "cpu":
+            return self._cpu
+        if stage.name not in self._io:
+            self._io[stage.name] = ThreadPoolExecutor(max_workers=stage.concurrency,
+                                                      thread_name_prefix=f"pipeline-{stage.name}")
+        return self._io[stage.name]
+
+    async def start(self) -> None:
+        if self._workers:
+            return
+        if self._cpu is None:
+            self._cpu = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="pipeline-cpu")
+        self._queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self.stages]
+        for i, stage in enumerate(self.stages):
+            for _ in range(max(1, stage.concurrency)):
+                self._workers.append(asyncio.create_task(self._worker(i, stage)))
+
+    async def _worker(self, index: int, stage: Stage) -> None:
+        loop = asyncio.get_running_loop()
+        inbox = self._queues[index]
+        outbox = self._queues[index + 1] if index + 1 < len(self._queues) else None
+        executor = self._executor(stage)
+        while True:
+            entry = await inbox.get()
+            if entry is _STOP:
+                inbox.task_done()
+                return
+            item, future = entry
+            try:
+                if future.done():
+                    continue
+                if not getattr(item, "done", False):
+                    self._busy[stage.name] += 1
+                    start = time.perf_counter()
+                    try:
+                        item = await loop.run_in_executor(executor, stage.func, item)
+                    finally:
+                        self._busy[stage.name] -= 1
+                        self._stats[stage.name]["busy_sec"] += time.perf_counter() - start
+                    self._stats[stage.name]["items"] += 1
+                if outbox is None or getattr(item, "done", False):
+                    future.set_result(item)
+                else:
+                    # 下游佇列已滿時在此等待，形成背壓
+                    await outbox.put((item, future))
+            except Exception as exc:
+                self._stats[stage.name]["errors"] += 1
+                if not future.done():
+                    future.set_exception(exc)
+            finally:
+                inbox.task_done()
+
+    async def submit(self, item: Any) -> Any:
+        """送入一個項目並等待其通過所有階段。"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queues[0].put((item, future))
+        return await future
+
+    async def map_ordered(
+        self,
+        items: Iterable[Any],
+        on_done: Callable[[Any, Any], None] | None = None,
+        max_in_flight: int | None = None,
+        prepare: Callable[[Any], Any] | None = None,
+    ) -> int:
+        """持續送入 ``items`` 並依送入順序對每個結果呼叫 ``on_done(item, result)``。
+
+        ``prepare`` 可將來源項目轉為送入第一個階段的物件。``items`` 的迭代
+        （例如讀檔或查詢 OpenSearch）在執行緒中進行；同時在管線中的項目最多
+        ``max_in_flight`` 筆（預設為所有佇列容量總和）。任一項目失敗時停止
+        送入新項目，等待已送入者完成後拋出該例外。回傳完成筆數。
+        """
+        loop = asyncio.get_running_loop()
+        limit = max_in_flight or self.queue_size * len(self.stages)
+        iterator = iter(items)
+        in_flight: "asyncio.Queue" = asyncio.Queue(maxsize=limit)
+        failure: List[BaseException] = []
+        completed = 0
+
+        async def feed() -> None:
+            try:
+                while not failure:
+                    item = await loop.run_in_executor(self._single("_source"), next, iterator, _STOP)
+                    if item is _STOP:
+                        break
+                    payload = prepare(item) if prepare is not None else item
+                    await in_flight.put((item, asyncio.ensure_future(self.submit(payload))))
+            except Exception as exc:
+                failure.append(exc)
+            finally:
+                await in_flight.put(None)
+
+        async def drain() -> None:
+            nonlocal completed
+            while True:
+                entry = await in_flight.get()
+                if entry is None:
+                    return
+                item, task = entry
+                try:
+                    result = await task
+                    # 前一筆失敗後不再回呼，避免檢查點越過未完成的項目
+                    if not failure:
+                        if on_done is not None:
+                            await loop.run_in_executor(self._single("_sink"), on_done, item, result)
+                        completed += 1
+                except Exception as exc:
+                    failure.append(exc)
+
+        await asyncio.gather(feed(), drain())
+        if failure:
+            raise failure[0]
+        return completed
+
+    def _single(self, name: str) -> ThreadPoolExecutor:
+        # 來源迭代與完成回呼各自在單一執行緒依序執行，保持檢查點的前進順序
+        if name not in self._io:
+            self._io[name] = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"pipeline{name}")
+        return self._io[name]
+
+    async def close(self) -> None:
+        """等待佇列清空後停止所有 worker 並關閉執行緒池。"""
+        for i, stage in enumerate(self.stages if self._workers else []):
+            await self._queues[i].join()
+            for _ in range(max(1, stage.concurrency)):
+                await self._queues[i].put(_STOP)
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for pool in self._io.values():
+            pool.shutdown(wait=False)
+        self._io = {}
+        if self._own_cpu and self._cpu is not None:
+            self._cpu.shutdown(wait=False)
+            self._cpu = None
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        out = {}
+        for i, stage in enumerate(self.stages):
+            queued = self._queues[i].qsize() if self._queues else 0
+            out[stage.name] = {**self._stats[stage.name], "queued": queued, "busy": self._busy[stage.name]}
+        return out
@@ -0,0 +1,225 @@
+"""GraphRAG 提示組裝與 token 預算控管。
+
+``GraphRetrievalTool`` 回傳的子圖以路徑為單位，同一節點與關係會重複出現；
+直接 ``json.dumps`` 不僅冗長，遇到連線數龐大的熱點 IP 時提示長度更會暴增。
+此模組將子圖去重後依與告警實體的距離排序，以精簡的逐行格式輸出，並在
+每則提示的 token 預算內截斷；相似案例同樣去重並限制長度。
+
+輸出格式::
+
+    Log: <原始日誌>
+    Fields: ip=1.2.3.4 status=404
+    Examples:
+    - <相似案例>
+    Graph (nodes 2/9, edges 1/14):
+    N ip_1.2.3.4 IP address=1.2.3.4
+    E ip_1.2.3.4 -ATTEMPTED-> user_root
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import deque
+from typing import Dict, Iterable, List, NamedTuple, Set, Tuple
+
+from .. import config
+from .cost_tracker import estimate_tokens
+from .log_parser import parse_record
+
+_VALUE_MAX_CHARS = 64
+
+
+class BuiltPrompt(NamedTuple):
+    text: str
+    tokens: int
+    truncated: bool
+
+
+def _clip(text: str, limit: int) -> str:
+    text = " ".join(str(text).split())
+    return text if len(text) <= limit else text[: limit - 1] + "…"
+
+
+def _seed_ids(payload: Dict, line: str) -> Set[str]:
+    """告警本身的實體 ID，作為子圖排序的起點。"""
+    fields = payload.get("fields") or parse_record(line).fields()
+    seeds = set()
+    if fields.get("ip"):
+        seeds.add(f"ip_{fields['ip']}")
+    if fields.get("user"):
+        seeds.add(f"user_{fields['user']}")
+    return seeds
+
+
+def dedupe_graph(graph: Dict) -> Tuple[Dict[str, Dict], List[Tuple[str, str, str]]]:
+    """合併重複節點（屬性取聯集）與重複關係。"""
+    nodes: Dict[str, Dict] = {}
+    for node in graph.get("nodes") or []:
+        nid = node.get("id")
+        if nid is None:
+            continue
+        current = nodes.setdefault(str(nid), {"labels": [], "properties": {}})
+        for label in node.get("labels") or []:
+            if label not in current["labels"]:
+                current["labels"].append(label)
+        current["properties"].update(node.get("properties") or {})
+    edges = list(dict.fromkeys(
+        (str(r.get("start_id")), str(r.get("type") or "RELATED"), str(r.get("end_id")))
+        for r in graph.get("relationships") or []
+        if r.get("start_id") is not None and r.get("end_id") is not None
+    ))
+    return nodes, edges
+
+
+def rank_graph(
+    nodes: Dict[str, Dict], edges: List[Tuple[str, str, str]], seeds: Iterable[str]
+) -> Tuple[List[str], List[Tuple[str, str, str]]]:
+    """依與告警實體的跳數排序節點與關係。
+
+    距離相同時，連到較少其他節點者優先：熱點 IP 這類高度節點資訊量低，且其
+    大量鄰居不應擠掉較具體的脈絡。
+    """
+    adjacency: Dict[str, Set[str]] = {}
+    for start, _, end in edges:
+        adjacency.setdefault(start, set()).add(end)
+        adjacency.setdefault(end, set()).add(start)
+    far = len(nodes) + len(adjacency) + 1
+    dist: Dict[str, int] = {}
+    queue = deque()
+    for seed in seeds:
+        if seed in nodes or seed in adjacency:
+            dist[seed] = 0
+            queue.append(seed)
+    while queue:
+        current = queue.popleft()
+        for nxt in adjacency.get(current, ()):
+            if nxt not in dist:
+                dist[nxt] = dist[current] + 1
+                queue.append(nxt)
+
+    def node_key(nid: str):
+        return dist.get(nid, far), len(adjacency.get(nid, ())), nid
+
+    ranked_nodes = sorted(set(nodes) | set(adjacency), key=node_key)
+    ranked_edges = sorted(
+        edges,
+        key=lambda e: (
+            min(dist.get(e[0], far), dist.get(e[2], far)),
+            max(dist.get(e[0], far), dist.get(e[2], far)),
+            len(adjacency.get(e[0], ())) + len(adjacency.get(e[2], ())),
+            e,
+        ),
+    )
+    return ranked_nodes, ranked_edges
+
+
+def _node_line(nid: str, node: Dict | None) -> str:
+    if not node:
+        return f"N {nid}"
+    labels = "|".join(node["labels"])
+    props = " ".join(
+        f"{k}={_clip(v, _VALUE_MAX_CHARS)}" for k, v in sorted(node["properties"].items()) if k != "id"
+    )
+    return " ".join(part for part in ("N", nid, labels, props) if part)
+
+
+class PromptStats:
+    """提示 token 數統計，由 ``/stats`` 對外提供。"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.prompts = 0
+        self.tokens = 0
+        self.max_tokens = 0
+        self.truncated = 0
+
+    def add(self, built: BuiltPrompt) -> None:
+        with self._lock:
+            self.prompts += 1
+            self.tokens += built.tokens
+            self.max_tokens = max(self.max_tokens, built.tokens)
+            self.truncated += int(built.truncated)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "prompts": self.prompts,
+                "avg_tokens": self.tokens / self.prompts if self.prompts else 0.0,
+                "max_tokens": self.max_tokens,
+                "truncated": self.truncated,
+            }
+
+
+PROMPT_STATS = PromptStats()
+
+
+def build_prompt(payload: Dict, budget: int | None = None) -> BuiltPrompt:
+    """將告警、相似案例與子圖組成不超過 ``budget`` token 的提示文字。
+
+    日誌行與解析欄位一律保留；相似案例最多使用剩餘預算的三分之一，其餘
+    預算依排序填入子圖的關係與節點，超出的部分以摘要行註明省略數量。
+    """
+    budget = budget or config.PROMPT_TOKEN_BUDGET
+    line = payload.get("alert", {}).get("original_log", "")
+    head = [f"Log: {_clip(line, config.PROMPT_LOG_MAX_CHARS)}"]
+    fields = payload.get("fields")
+    if fields:
+        head.append("Fields: " + " ".join(f"{k}={_clip(v, _VALUE_MAX_CHARS)}" for k, v in fields.items()))
+    used = sum(estimate_tokens(h) + 1 for h in head)
+    truncated = False
+
+    body: List[str] = []
+    examples = [e for e in dict.fromkeys(payload.get("examples") or []) if e]
+    if examples:
+        limit = used + max(0, budget - used) // 3
+        shown = []
+        for ex in examples[: config.PROMPT_MAX_EXAMPLES]:
+            text = "- " + _clip(ex, config.PROMPT_EXAMPLE_MAX_CHARS)
+            cost = estimate_tokens(text) + 1
+            if used + cost > limit:
+                break
+            shown.append(text)
+            used += cost
+        truncated |= len(shown) < len(examples)
+        if shown:
+            body.append("Examples:")
+            body.extend(shown)
+
+    nodes, edges = dedupe_graph(payload.get("graph") or {})
+    if nodes or edges:
+        ranked_nodes, ranked_edges = rank_graph(nodes, edges, _seed_ids(payload, line))
+        graph_lines: List[str] = []
+        shown_nodes: Set[str] = set()
+        shown_edges = 0
+        # 先填入關係，其端點節點隨後補上屬性；剩餘預算再依排名補齊孤立節點
+        for start, rel, end in ranked_edges:
+            text = f"E {start} -{rel}-> {end}"
+            extra = [n for n in (start, end) if n not in shown_nodes]
+            extra_lines = [_node_line(n, nodes.get(n)) for n in dict.fromkeys(extra)]
+            cost = sum(estimate_tokens(t) + 1 for t in [text, *extra_lines])
+            if used + cost > budget:
+                break
+            graph_lines.extend(extra_lines)
+            graph_lines.append(text)
+            shown_nodes.update(extra)
+            shown_edges += 1
+            used += cost
+        for nid in ranked_nodes:
+            if nid in shown_nodes:
+                continue
+            text = _node_line(nid, nodes.get(nid))
+            cost = estimate_tokens(text) + 1
+            if used + cost > budget:
+                break
+            graph_lines.append(text)
+            shown_nodes.add(nid)
+            used += cost
+        total_nodes = len(set(nodes) | {n for e in edges for n in (e[0], e[2])})
+        truncated |= shown_edges < len(edges) or len(shown_nodes) < total_nodes
+        body.append(f"Graph (nodes {len(shown_nodes)}/{total_nodes}, edges {shown_edges}/{len(edges)}):")
+        body.extend(graph_lines)
+
+    text = "\n".join(head + body)
+    built = BuiltPrompt(text, estimate_tokens(text), truncated)
+    PROMPT_STATS.add(built)
+    return built
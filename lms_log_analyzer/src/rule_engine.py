@@ -0,0 +1,230 @@
+"""批次啟發式評分規則引擎。
+
+規則（關鍵字過濾、加權特徵字串與 HTTP 狀態碼門檻）由 JSON 設定檔載入並
+預先編譯。評分時將整批日誌轉為小寫並以換行串接，每條規則以各自預先
+編譯的樣式在 C 層掃描整批文字，再依比對位置換算回所屬的行（跨行的比對不算）；結果以 NumPy
+陣列回傳，方便後續以 ``argpartition`` 挑選分數最高的候選行。
+
+不把所有規則合併成單一交替（``a|b|c``）正規表示式：CPython 的 ``re`` 無法對
+交替樣式使用字首快速搜尋，實測比逐一樣式掃描慢三倍以上。
+
+設定檔格式::
+
+    {
+      "filter_keywords": ["error", "fail"],
+      "signatures": [{"name": "nmap_scan", "pattern": "nmap", "weight": 0.3, "regex": false}],
+      "status_rules": [{"name": "http_error", "min": 400, "max": 599, "weight": 0.1}]
+    }
+
+所有比對皆不分大小寫；同一特徵在同一行中只計分一次，總分上限為 1.0。
+"""
+
+from __future__ import annotations
+
+import json
+import re
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Sequence
+
+import numpy as np
+
+from .. import config
+from .utils import logger
+
+# 設定檔不存在時使用的預設規則，與原本 ``fast_score`` 與 ``filter_logs`` 的行為一致
+DEFAULT_RULES: Dict = {
+    "filter_keywords": ["error", "fail"],
+    "signatures": [
+        {"name": "passwd_access", "pattern": "/etc/passwd", "weight": 0.5},
+        {"name": "nmap_scan", "pattern": "nmap", "weight": 0.3},
+    ],
+    "status_rules": [{"name": "http_error", "min": 400, "weight": 0.1}],
+}
+
+# combined 格式與 JSON 日誌中 HTTP 狀態碼出現的位置；``{codes}`` 為狀態碼範圍樣式
+_STATUS_FORMS = (r'http/[\d.]+"\s+(?:{codes})\b', r'"status(?:_code)?"\s*:\s*"?(?:{codes})\b')
+
+
+def _status_range_pattern(low: int, high: int) -> str:
+    """將三位數狀態碼範圍轉為正規表示式，例如 400-599 轉為 ``4\\d\\d|5\\d\\d``。"""
+    low, high = max(low, 100), min(high, 999)
+    parts: List[str] = []
+    for hundred in range(low // 100, high // 100 + 1):
+        base = hundred * 100
+        if low <= base and base + 99 <= high:
+            parts.append(rf"{hundred}\d\d")
+            continue
+        for ten in range(10):
+            start = base + ten * 10
+            digits = [str(d) for d in range(10) if low <= start + d <= high]
+            if len(digits) == 10:
+                parts.append(rf"{hundred}{ten}\d")
+            elif digits:
+                parts.append(f"{hundred}{ten}[{''.join(digits)}]")
+    return "|".join(parts) or "(?!)"
+
+
+class Signature(NamedTuple):
+    """加權特徵；``regex`` 為 False 時 ``pattern`` 視為純字串。"""
+
+    name: str
+    pattern: str
+    weight: float
+    regex: bool = False
+
+
+class StatusRule(NamedTuple):
+    """HTTP 狀態碼落在 ``[min_status, max_status]`` 時加分。"""
+
+    name: str
+    min_status: int
+    max_status: int
+    weight: float
+
+
+class RuleEngine:
+    """預先編譯規則並以整批為單位評分。"""
+
+    def __init__(
+        self,
+        signatures: Sequence[Signature],
+        status_rules: Sequence[StatusRule] = (),
+        filter_keywords: Iterable[str] = (),
+    ) -> None:
+        self.signatures = list(signatures)
+        self.status_rules = list(status_rules)
+        self.weights = np.array(
+            [s.weight for s in self.signatures] + [r.weight for r in self.status_rules], dtype=np.float32
+        )
+        # 文字會先轉為小寫，純字串樣式同樣轉小寫；使用者的正規表示式則保留 IGNORECASE，
+        # 並以 MULTILINE 讓 ^／$ 對應每一行的開頭與結尾
+        self._patterns = [
+            [re.compile(s.pattern, re.IGNORECASE | re.MULTILINE) if s.regex else re.compile(re.escape(s.pattern.lower()))]
+            for s in self.signatures
+        ]
+        self._status_patterns = [
+            [re.compile(form.format(codes=_status_range_pattern(r.min_status, r.max_status))) for form in _STATUS_FORMS]
+            for r in self.status_rules
+        ]
+        self._filters = [re.compile(re.escape(k.lower())) for k in dict.fromkeys(filter_keywords) if k]
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "RuleEngine":
+        signatures = [
+            Signature(s.get("name", s["pattern"]), s["pattern"], float(s["weight"]), bool(s.get("regex", False)))
+            for s in data.get("signatures", [])
+        ]
+        status_rules = [
+            StatusRule(r.get("name", "status"), int(r.get("min", 0)), int(r.get("max", 999)), float(r["weight"]))
+            for r in data.get("status_rules", [])
+        ]
+        return cls(signatures, status_rules, data.get("filter_keywords", []))
+
+    @classmethod
+    def from_file(cls, path: str | Path) -> "RuleEngine":
+        with open(path, "r", encoding="utf-8") as fh:
+            return cls.from_dict(json.load(fh))
+
+    # -- 內部工具 ---------------------------------------------------------
+    @staticmethod
+    def _join(lines: Sequence[str]):
+        """串接整批文字並轉小寫，回傳每行的起始位置以將比對位置換算回行號。
+
+        每行先各自轉小寫再計算長度：部分字元轉小寫後長度會改變（例如 ``"İ"``
+        變為兩個字元）。行內的換行改為空白，確保每行在串接後仍只佔一行。
+        """
+        lowered = [line.lower().replace("\n", " ") for line in lines]
+        lengths = np.fromiter(map(len, lowered), dtype=np.int64, count=len(lowered))
+        starts = np.zeros(len(lowered), dtype=np.int64)
+        np.cumsum(lengths[:-1] + 1, out=starts[1:])
+        return "\n".join(lowered), starts
+
+    @staticmethod
+    def _rows(patterns: Sequence[re.Pattern], text: str, starts: np.ndarray) -> np.ndarray:
+        """回傳任一樣式命中的行號（可能重複）。
+
+        跨越換行的比對不屬於任何一行，捨棄後自下一個字元重新搜尋；一行命中
+        後直接跳到下一行，同一行不重複計算。
+        """
+        positions: List[int] = []
+        end = len(text)
+        for pattern in patterns:
+            pos = 0
+            while pos <= end:
+                m = pattern.search(text, pos)
+                if m is None:
+                    break
+                if text.find("\n", m.start(), m.end()) >= 0:
+                    pos = m.start() + 1
+                    continue
+                positions.append(m.start())
+                nl = text.find("\n", m.end())
+                if nl < 0:
+                    break
+                pos = nl + 1
+        return np.searchsorted(starts, positions, side="right") - 1
+
+    # -- 公開介面 ---------------------------------------------------------
+    def filter_mask(self, lines: Sequence[str]) -> np.ndarray:
+        """回傳布林陣列，標示哪些行包含任一過濾關鍵字。"""
+        mask = np.zeros(len(lines), dtype=bool)
+        if not self._filters or not lines:
+            return mask
+        text, starts = self._join(lines)
+        mask[self._rows(self._filters, text, starts)] = True
+        return mask
+
+    def score_batch(self, lines: Sequence[str], statuses: Sequence[int] | None = None) -> np.ndarray:
+        """掃描整批日誌並回傳 ``float32`` 分數陣列。
+
+        ``statuses`` 可傳入已解析的狀態碼（例如來自 ``LogRecord``），此時狀態碼
+        規則直接以數值比較，不再從文字擷取。
+        """
+        n = len(lines)
+        if not n or not len(self.weights):
+            return np.zeros(n, dtype=np.float32)
+        text, starts = self._join(lines)
+        hits = np.zeros((n, len(self.weights)), dtype=bool)
+        for col, patterns in enumerate(self._patterns):
+            hits[self._rows(patterns, text, starts), col] = True
+        offset = len(self._patterns)
+        if statuses is not None:
+            status = np.asarray(statuses, dtype=np.int32)
+            for col, rule in enumerate(self.status_rules, offset):
+                hits[:, col] = (status >= rule.min_status) & (status <= rule.max_status)
+        else:
+            for col, patterns in enumerate(self._status_patterns, offset):
+                hits[self._rows(patterns, text, starts), col] = True
+        scores = hits @ self.weights
+        np.minimum(scores, 1.0, out=scores)
+        return scores
+
+    @staticmethod
+    def top_indices(scores: np.ndarray, n: int) -> np.ndarray:
+        """回傳分數最高的 ``n`` 個索引，依分數遞減排序，同分時保留原順序。"""
+        total = len(scores)
+        n = min(max(n, 0), total)
+        if n == 0:
+            return np.zeros(0, dtype=np.int64)
+        picked = np.arange(total) if n == total else np.argpartition(-scores, n - 1)[:n]
+        if n < total:
+            # argpartition 對同分的選擇不固定；門檻分數的行依原順序補足
+            cutoff = scores[picked].min()
+            above = np.flatnonzero(scores > cutoff)
+            tied = np.flatnonzero(scores == cutoff)[: n - len(above)]
+            picked = np.concatenate([above, tied])
+        return picked[np.lexsort((picked, -scores[picked]))]
+
+
+def load_rules(path: str | Path | None = None) -> RuleEngine:
+    """自設定檔載入規則；檔案不存在或格式錯誤時退回預設規則。"""
+    path = Path(path or config.RULES_FILE)
+    if path.exists():
+        try:
+            return RuleEngine.from_file(path)
+        except (OSError, ValueError, KeyError, re.error) as exc:
+            logger.error("Failed to load rules from %s, using defaults: %s", path, exc)
+    return RuleEngine.from_dict(DEFAULT_RULES)
+
+
+RULE_ENGINE = load_rules()
@@ -0,0 +1,262 @@
+"""依來源實體（IP 與使用者）做時間視窗彙總。
+
+暴力破解或掃描等攻擊會在短時間內由同一來源產生大量日誌。此模組以
+``llm_handler._extract_entities`` 擷取每行的 IP 與使用者作為鍵，為每個鍵
+維護視窗計數；計數在視窗內達到門檻即視為一次「爆量」，整段爆量只產生
+一筆彙總的 session 告警送往向量搜尋與 LLM，其餘行則沿用該告警的判定。
+
+視窗模式：
+
+* ``sliding``：以秒為單位的桶記錄最近 ``window_sec`` 秒的事件數。
+* ``tumbling``：以固定邊界切分視窗，每個新視窗重新計數。
+
+時間以日誌的事件時間為準（無法解析時使用讀取時間）。計數低於門檻或鍵閒置
+超過 ``idle_sec`` 時爆量結束，之後再次爆量會產生新的 session。鍵數量超過 ``max_keys`` 時淘汰最久未出現的鍵，記憶體用量有上限。
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Iterator, List, Tuple
+
+from .. import config
+from .llm_handler import _extract_entities, _rebind_entities
+from .log_parser import event_time
+
+SessionKey = Tuple[str, str]
+
+
+class _KeyState:
+    __slots__ = ("buckets", "count", "window_start", "first_seen", "last_seen", "events", "samples",
+                 "session_id", "verdict", "source")
+
+    def __init__(self, now: float):
+        self.buckets: Deque[List[int]] = deque()
+        self.count = 0
+        self.window_start = now
+        self.first_seen = now
+        self.last_seen = now
+        self.events = 0
+        self.samples: List[str] = []
+        self.session_id: str | None = None
+        self.verdict: Dict | None = None
+        self.source = ""
+
+
+class Sessionizer:
+    """以 (IP, 使用者) 為鍵的視窗計數與 session 告警產生器。"""
+
+    def __init__(
+        self,
+        window_sec: float | None = None,
+        mode: str | None = None,
+        threshold: int | None = None,
+        idle_sec: float | None = None,
+        max_keys: int | None = None,
+        max_samples: int | None = None,
+    ) -> None:
+        self.window_sec = float(window_sec or config.SESSION_WINDOW_SEC)
+        self.mode = (mode or config.SESSION_WINDOW_MODE).lower()
+        if self.mode not in ("sliding", "tumbling"):
+            raise ValueError(f"Unknown session window mode: {self.mode}")
+        self.threshold = max(1, threshold or config.SESSION_BURST_THRESHOLD)
+        self.idle_sec = float(idle_sec or config.SESSION_IDLE_SEC)
+        self.max_keys = max_keys or config.SESSION_MAX_KEYS
+        self.max_samples = max_samples or config.SESSION_MAX_SAMPLES
+        self._keys: "OrderedDict[SessionKey, _KeyState]" = OrderedDict()
+        self._sessions: Dict[str, SessionKey] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    @staticmethod
+    def key_for(line: str) -> SessionKey | None:
+        """回傳日誌行的 (IP, 使用者) 鍵；兩者皆無時回傳 ``None``。"""
+        ip = user = ""
+        for ent in _extract_entities(line):
+            if ent["label"] == "IP" and not ip:
+                ip = ent["properties"]["address"]
+            elif ent["label"] == "User" and not user:
+                user = ent["properties"]["name"]
+        return (ip, user) if ip or user else None
+
+    # -- 視窗計數 ---------------------------------------------------------
+    def _count(self, state: _KeyState, now: float, n: int) -> int:
+        if self.mode == "tumbling":
+            if now >= state.window_start + self.window_sec:
+                state.window_start = now - (now - state.window_start) % self.window_sec
+                state.count = 0
+            state.count += n
+            return state.count
+        second = int(now)
+        while state.buckets and state.buckets[0][0] <= second - self.window_sec:
+            state.count -= state.buckets.popleft()[1]
+        if state.buckets and state.buckets[-1][0] == second:
+            state.buckets[-1][1] += n
+        else:
+            state.buckets.append([second, n])
+        state.count += n
+        return state.count
+
+    def _state(self, key: SessionKey, now: float) -> _KeyState:
+        state = self._keys.get(key)
+        if state is None or abs(now - state.last_seen) > self.idle_sec:
+            if state is not None:
+                self._end_burst(state)
+            state = _KeyState(now)
+            self._keys[key] = state
+        self._keys.move_to_end(key)
+        return state
+
+    def _end_burst(self, state: _KeyState) -> None:
+        if state.session_id is not None:
+            self._sessions.pop(state.session_id, None)
+        state.session_id = None
+        state.verdict = None
+        state.events = 0
+        state.samples = []
+
+    def evict_idle(self, now: float | None = None) -> int:
+        """移除閒置超過 ``idle_sec`` 或超出 ``max_keys`` 的鍵，回傳移除數量。"""
+        now = time.time() if now is None else now
+        removed = 0
+        with self._lock:
+            while self._keys:
+                key, state = next(iter(self._keys.items()))
+                if len(self._keys) <= self.max_keys and now - state.last_seen <= self.idle_sec:
+                    break
+                self._keys.popitem(last=False)
+                self._end_burst(state)
+                removed += 1
+        return removed
+
+    # -- 批次切分 ---------------------------------------------------------
+    def _session_entry(self, key: SessionKey, state: _KeyState) -> Dict:
+        ip, user = key
+        summary = (
+            f"[session] ip={ip or '-'} user={user or '-'} events={state.events} "
+            f"window={int(self.window_sec)}s mode={self.mode} samples: " + " || ".join(state.samples)
+        )
+        session = {
+            "session_id": state.session_id,
+            "ip": ip,
+            "user": user,
+            "events": state.events,
+            "window_sec": self.window_sec,
+            "mode": self.mode,
+            "first_seen": state.first_seen,
+            "last_seen": state.last_seen,
+            "samples": list(state.samples),
+        }
+        # 彙總並非實際日誌行，以 kind 標示，讓結果與調查端點的使用者可分辨
+        return {"kind": "session", "line": summary, "alert": {"original_log": summary, "session": session},
+                "session": session}
+
+    @staticmethod
+    def _runs(timed: List[Tuple[float, Dict]]) -> Iterator[Tuple[float, List[Dict]]]:
+        """將依時間排序的行切成同一秒內的連續片段。"""
+        run: List[Dict] = []
+        start = 0.0
+        for ts, entry in timed:
+            if run and int(ts) != int(start):
+                yield start, run
+                run = []
+            if not run:
+                start = ts
+            run.append(entry)
+        if run:
+            yield start, run
+
+    def split(self, entries: List[Dict], now: float | None = None) -> Tuple[List[Dict], List[List[Dict]], List[Dict]]:
+        """將一批候選行依來源分流。
+
+        回傳 ``(passthrough, sessions, absorbed)``：
+
+        * ``passthrough``：未達爆量門檻、照常逐行分析的行。
+        * ``sessions``：本批新產生的 session，每組第一筆為彙總告警，其後為成員行。
+        * ``absorbed``：屬於先前已告警 session 的行；若該 session 已有判定，
+          ``analysis`` 會直接填入。
+
+        視窗以日誌本身的事件時間計算（無法解析時使用 ``now``），重播或追趕
+        舊日誌時不會把相隔甚遠的爆量合併；同一批內同一鍵的行依時間分段計數。
+        """
+        now = time.time() if now is None else now
+        by_key: "OrderedDict[SessionKey, List[Tuple[float, Dict]]]" = OrderedDict()
+        passthrough: List[Dict] = []
+        for entry in entries:
+            key = self.key_for(entry["line"])
+            if key is None:
+                passthrough.append(entry)
+            else:
+                ts = event_time(entry["line"], now)
+                by_key.setdefault(key, []).append((now if ts is None else ts, entry))
+
+        sessions: List[List[Dict]] = []
+        absorbed: List[Dict] = []
+        created: Dict[str, List[Dict]] = {}
+        latest: float | None = None
+        with self._lock:
+            for key, timed in by_key.items():
+                timed.sort(key=lambda item: item[0])
+                for ts, group in self._runs(timed):
+                    latest = ts if latest is None else max(latest, ts)
+                    state = self._state(key, ts)
+                    # 亂序的行不回推視窗，以該鍵最後出現的時間計數
+                    ts = max(ts, state.last_seen)
+                    count = self._count(state, ts, len(group))
+                    state.last_seen = ts
+                    if count < self.threshold:
+                        if state.session_id is not None:
+                            self._end_burst(state)
+                        passthrough.extend(group)
+                        continue
+                    if state.events == 0:
+                        state.first_seen = ts
+                    state.events += len(group)
+                    for entry in group:
+                        if len(state.samples) >= self.max_samples:
+                            break
+                        state.samples.append(entry["line"])
+                    if state.session_id is None:
+                        state.session_id = f"{key[0] or '-'}/{key[1] or '-'}@{int(state.first_seen)}"
+                        self._sessions[state.session_id] = key
+                        for entry in group:
+                            entry["session_id"] = state.session_id
+                        members = [self._session_entry(key, state), *group]
+                        state.source = members[0]["line"]
+                        created[state.session_id] = members
+                        sessions.append(members)
+                        continue
+                    for entry in group:
+                        entry["session_id"] = state.session_id
+                    if state.session_id in created:
+                        # 本批稍後的片段併入本批剛產生的 session，並更新其彙總告警
+                        members = created[state.session_id]
+                        members.extend(group)
+                        members[0] = self._session_entry(key, state)
+                        state.source = members[0]["line"]
+                        continue
+                    for entry in group:
+                        if state.verdict is not None:
+                            entry["analysis"] = _rebind_entities(state.verdict, state.source, entry["line"])
+                        absorbed.append(entry)
+        self.evict_idle(now if latest is None else latest)
+        return passthrough, sessions, absorbed
+
+    def record_verdict(self, session_id: str, analysis: Dict) -> None:
+        """記錄 session 的判定，之後同一爆量中的行會直接沿用。"""
+        with self._lock:
+            key = self._sessions.get(session_id)
+            state = self._keys.get(key) if key else None
+            if state is not None and state.session_id == session_id:
+                state.verdict = dict(analysis)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"keys": len(self._keys), "active_sessions": len(self._sessions)}
+
+
+SESSIONIZER = Sessionizer()
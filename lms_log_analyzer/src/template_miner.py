@@ -0,0 +1,132 @@
+"""線上日誌樣板探勘（Drain 演算法）。
+
+實際流量中大量日誌只在 IP、ID 與時間戳等變數上不同。此模組先以
+:func:`log_parser.mask_variables` 遮蔽常見變數，再以 Drain 的固定深度
+前綴樹將日誌行分群：依 token 數量與前幾個 token 找到葉節點，再於葉節點內
+以 token 相似度挑選最接近的樣板，相似度達門檻即合併，不同的位置以 ``<*>``
+取代。處理流程僅需分析每個樣板的一筆代表行，再將判定套用到其餘成員。
+
+參考：He et al., "Drain: An Online Log Parsing Approach with Fixed Depth Tree", ICWS 2017.
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+from .. import config
+from .log_parser import mask_variables
+
+WILDCARD = "<*>"
+
+
+class LogCluster:
+    """一個樣板及其累積的成員數。"""
+
+    __slots__ = ("cluster_id", "tokens", "size", "leaf")
+
+    def __init__(self, cluster_id: int, tokens: List[str], leaf: List[int]):
+        self.cluster_id = cluster_id
+        self.tokens = tokens
+        self.size = 0
+        # 所在的前綴樹葉節點；樣板泛化後前綴可能改變，淘汰時需直接由此移除
+        self.leaf = leaf
+
+    @property
+    def template(self) -> str:
+        return " ".join(self.tokens)
+
+
+class TemplateMiner:
+    """以 Drain 前綴樹線上分群日誌行。
+
+    ``max_clusters`` 限制保留的樣板數，超過時淘汰最久未命中的樣板。
+    """
+
+    def __init__(
+        self,
+        depth: int | None = None,
+        sim_threshold: float | None = None,
+        max_children: int | None = None,
+        max_clusters: int | None = None,
+    ) -> None:
+        # 深度包含根節點與 token 數量層，至少需要一層前綴 token
+        self.depth = max(3, depth or config.TEMPLATE_TREE_DEPTH)
+        self.sim_threshold = sim_threshold if sim_threshold is not None else config.TEMPLATE_SIM_THRESHOLD
+        self.max_children = max_children or config.TEMPLATE_MAX_CHILDREN
+        self.max_clusters = max_clusters or config.TEMPLATE_MAX_CLUSTERS
+        self._root: Dict[int, Dict] = {}
+        self._clusters: "OrderedDict[int, LogCluster]" = OrderedDict()
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._clusters)
+
+    @staticmethod
+    def tokenize(line: str) -> List[str]:
+        return mask_variables(line).split()
+
+    def _leaf(self, tokens: List[str]) -> List[int]:
+        """依 token 數與前綴 token 走訪（必要時建立）前綴樹，回傳葉節點的樣板清單。"""
+        node = self._root.setdefault(len(tokens), {})
+        for token in tokens[: self.depth - 2]:
+            # 含數字的 token 多半是變數，歸入萬用子節點以免前綴樹爆炸
+            key = WILDCARD if any(c.isdigit() for c in token) else token
+            child = node.get(key)
+            if child is None:
+                if len(node) >= self.max_children:
+                    key = WILDCARD
+                child = node.setdefault(key, {})
+            node = child
+        return node.setdefault(None, [])
+
+    @staticmethod
+    def _similarity(template: List[str], tokens: List[str]) -> Tuple[float, int]:
+        same = 0
+        params = 0
+        for t, tok in zip(template, tokens):
+            if t == WILDCARD:
+                params += 1
+            elif t == tok:
+                same += 1
+        return same / len(tokens) if tokens else 1.0, params
+
+    def add(self, line: str) -> LogCluster:
+        """將一行加入分群並回傳其所屬樣板。"""
+        tokens = self.tokenize(line)
+        with self._lock:
+            leaf = self._leaf(tokens)
+            best: LogCluster | None = None
+            best_key = (-1.0, -1)
+            for cid in leaf:
+                cluster = self._clusters[cid]
+                key = self._similarity(cluster.tokens, tokens)
+                if key > best_key:
+                    best, best_key = cluster, key
+            if best is not None and best_key[0] >= self.sim_threshold:
+                best.tokens = [t if t == tok else WILDCARD for t, tok in zip(best.tokens, tokens)]
+                self._clusters.move_to_end(best.cluster_id)
+            else:
+                best = LogCluster(self._next_id, tokens, leaf)
+                self._next_id += 1
+                self._clusters[best.cluster_id] = best
+                leaf.append(best.cluster_id)
+                self._evict()
+            best.size += 1
+            return best
+
+    def _evict(self) -> None:
+        while len(self._clusters) > self.max_clusters:
+            cid, cluster = self._clusters.popitem(last=False)
+            cluster.leaf.remove(cid)
+
+    def templates(self) -> List[Dict]:
+        """回傳目前的樣板清單（依成員數遞減）。"""
+        with self._lock:
+            clusters = sorted(self._clusters.values(), key=lambda c: c.size, reverse=True)
+            return [{"template_id": c.cluster_id, "template": c.template, "count": c.size} for c in clusters]
+
+
+TEMPLATE_MINER = TemplateMiner()
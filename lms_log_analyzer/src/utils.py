@@ -1,6 +1,14 @@
 """一些簡化工具供測試環境使用。"""
 
+import json
+import os
+import random
+import threading
+import time
 from collections import OrderedDict
+from pathlib import Path
+
+from .. import config
 
 class LRUCache:
     """單元測試用的簡易 LRU 快取實作。"""
@@ -23,25 +31,146 @@ class LRUCache:
             self._data.popitem(last=False)
         self._data[key] = value
 
-# 供其他模組使用的簡易存根
-STATE = {}
-
-def save_state(state):
-    return state
-
 # 最小化的 logger 取代方案
 import logging
 logger = logging.getLogger("lms_log_analyzer")
 
+
+def fsync_dir(path):
+    """fsync 目錄本身，確保 rename 後的目錄項目已寫入磁碟。"""
+    try:
+        fd = os.open(str(path), os.O_RDONLY)
+    except OSError:  # pragma: no cover - e.g. Windows
+        return
+    try:
+        os.fsync(fd)
+    except OSError:  # pragma: no cover - filesystem without dir fsync
+        pass
+    finally:
+        os.close(fd)
+
+
+def replace_durably(tmp, dest):
+    """fsync 暫存檔後以 rename 原子地取代 ``dest``。"""
+    with open(tmp, "rb") as fh:
+        os.fsync(fh.fileno())
+    os.replace(tmp, dest)
+    fsync_dir(Path(dest).parent)
+
+
+def atomic_write(path, data: bytes) -> int:
+    """以「寫入暫存檔 → fsync → rename」原子地寫入檔案，回傳寫入位元組數。"""
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.tmp")
+    with open(tmp, "wb") as fh:
+        fh.write(data)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
+    fsync_dir(path.parent)
+    return len(data)
+
+
+def load_state(path=None):
+    """讀取 ``LOG_STATE_FILE`` 中保存的處理狀態，不存在或損毀時回傳空 dict。"""
+    path = Path(path or config.LOG_STATE_FILE)
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return {}
+    except Exception as exc:
+        logger.error("Cannot read state file %s: %s", path, exc)
+        return {}
+
+
+# 跨模組共用的處理狀態，啟動時自 ``LOG_STATE_FILE`` 載入；修改時請持有 ``STATE_LOCK``
+STATE = load_state()
+STATE_LOCK = threading.RLock()
+
+
+def save_state(state, path=None):
+    """將處理狀態原子地寫入 ``LOG_STATE_FILE``，回傳寫入位元組數。"""
+    with STATE_LOCK:
+        data = json.dumps(state, ensure_ascii=False, indent=2).encode("utf-8")
+    return atomic_write(path or config.LOG_STATE_FILE, data)
+
 # 其他輔助函式
 
-def tail_since(path):
-    """讀取檔案內容並逐行回傳。"""
-    with open(path, "r", encoding="utf-8") as f:
-        return [line.rstrip("\n") for line in f]
+def tail_since(path, offset=0):
+    """自 ``offset`` 起逐行產生檔案內容（支援 ``.gz``／``.bz2``），不會一次讀入整個檔案。"""
+    from .log_reader import read_lines
 
-def http_request_with_retry(method, url, **kwargs):
-    """以 requests 重新嘗試 HTTP 呼叫的簡化函式。"""
+    for line, _ in read_lines(Path(path), offset):
+        yield line
+
+class RateLimiter:
+    """以每分鐘請求數設定速率的 token bucket 限流器（執行緒安全）。
+
+    ``rate_per_minute`` 小於等於 0 時不限制。``burst`` 為可累積的最大權杖數。
+    """
+
+    def __init__(self, rate_per_minute: float, burst: int = 1):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """取得一個權杖，不足時阻塞至權杖補足。"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def retryable_status(status) -> bool:
+    """HTTP 429 與 5xx 視為可重試的暫時性錯誤。"""
+    try:
+        code = int(status)
+    except (TypeError, ValueError):
+        return False
+    return code == 429 or 500 <= code < 600
+
+
+def retry_with_backoff(func, retries=3, base_delay=1.0, max_delay=30.0, is_retryable=lambda exc: True):
+    """呼叫 ``func``，遇到可重試的例外時以 full jitter 指數退避重新嘗試。"""
+    attempt = 0
+    while True:
+        try:
+            return func()
+        except Exception as exc:
+            if attempt >= retries or not is_retryable(exc):
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+            logger.warning("Retrying after %.2fs (attempt %d/%d): %s", delay, attempt + 1, retries, exc)
+            time.sleep(delay)
+            attempt += 1
+
+
+def http_request_with_retry(method, url, retries=3, base_delay=1.0, session=None, **kwargs):
+    """以 requests 呼叫 HTTP，遇到連線錯誤、429 或 5xx 時退避重試。"""
     import requests
-    func = getattr(requests, method)
-    return func(url, **kwargs)
+
+    client = session or requests
+
+    def _call():
+        resp = client.request(method.upper(), url, **kwargs)
+        if retryable_status(resp.status_code):
+            resp.raise_for_status()
+        return resp
+
+    def _retryable(exc):
+        if isinstance(exc, requests.HTTPError):
+            return retryable_status(getattr(exc.response, "status_code", None))
+        return isinstance(exc, (requests.ConnectionError, requests.Timeout))
+
+    return retry_with_backoff(_call, retries=retries, base_delay=base_delay, is_retryable=_retryable)
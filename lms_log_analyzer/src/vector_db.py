@@ -1,23 +1,35 @@
 """FAISS 向量資料庫與 SentenceTransformer 嵌入。
 
-此模組提供基本的向量化與搜尋能力，將案例寫入 JSON，索引則使用
-FAISS 儲存。與先前僅存檔 JSON 的實作相比，能在大量資料下提供
-更快速的相似度查詢。
+此模組提供基本的向量化與搜尋能力，案例寫入 append-only 的
+:class:`~.case_store.CaseStore`，索引則使用 FAISS 儲存。新向量先附加到
+delta 檔，累積一定數量後才將完整索引寫回（checkpoint），避免每次儲存都
+重寫整個索引與案例庫。索引類型可透過 ``LMS_VECTOR_INDEX_TYPE`` 切換為
+IVF 或 HNSW 等近似最近鄰索引。
 """
 
 from __future__ import annotations
 
+import hashlib
 import json
+import os
+import threading
 from pathlib import Path
-from typing import Iterable, List, Dict, Tuple
+from typing import Callable, Iterable, List, Dict, Optional, Sequence, Tuple
 
 import faiss
 import numpy as np
 
 from .. import config
+from .case_store import CaseStore
+from .utils import LRUCache, logger, replace_durably
 
 
 _EMBEDDER: "SentenceTransformer" | None = None
+# 以正規化日誌行的雜湊為鍵快取向量，重複的行不必再送入模型
+_EMBED_CACHE = LRUCache(config.EMBED_CACHE_SIZE)
+_EMBED_LOCK = threading.Lock()
+# 取代本行程模型的編碼函式（例如 :class:`~.worker_pool.CpuPool` 的多行程編碼）
+_ENCODER: Callable[[List[str]], np.ndarray] | None = None
 
 
 def _get_embedder() -> "SentenceTransformer":
@@ -29,67 +41,350 @@ def _get_embedder() -> "SentenceTransformer":
     return _EMBEDDER
 
 
+def encode_local(texts: Sequence[str]) -> np.ndarray:
+    """以本行程載入的模型編碼，回傳 ``float32`` 矩陣。"""
+    model = _get_embedder()
+    return model.encode(
+        list(texts),
+        batch_size=config.EMBED_BATCH_SIZE,
+        convert_to_numpy=True,
+    ).astype("float32")
+
+
+def set_encoder(encoder: Callable[[List[str]], np.ndarray] | None) -> None:
+    """設定 :func:`embed_many` 使用的編碼函式；``None`` 表示使用本行程的模型。"""
+    global _ENCODER
+    _ENCODER = encoder
+
+
+def _embed_key(text: str) -> str:
+    """回傳正規化（去除多餘空白）後日誌行的雜湊值。"""
+    normalized = " ".join(text.split())
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+def embed_many(texts: Sequence[str]) -> np.ndarray:
+    """批次產生向量並回傳 ``(n, d)`` 的 float32 矩陣。
+
+    已在快取中的行直接取用；其餘行去重後以單次 ``encode`` 呼叫送入模型。
+    """
+    keys = [_embed_key(t) for t in texts]
+    found: Dict[str, np.ndarray] = {}
+    missing: Dict[str, str] = {}
+    with _EMBED_LOCK:
+        for key, text in zip(keys, texts):
+            if key in found or key in missing:
+                continue
+            vec = _EMBED_CACHE.get(key)
+            if vec is None:
+                missing[key] = text
+            else:
+                found[key] = vec
+    if missing:
+        encoded = (_ENCODER or encode_local)(list(missing.values()))
+        with _EMBED_LOCK:
+            for key, vec in zip(missing, encoded):
+                _EMBED_CACHE.put(key, vec)
+                found[key] = vec
+    if not keys:
+        return np.zeros((0, 0), dtype="float32")
+    return np.stack([found[k] for k in keys])
+
+
 def embed(text: str) -> List[float]:
     """產生 SentenceTransformer 向量。"""
-    model = _get_embedder()
-    vec = model.encode([text], convert_to_numpy=True)[0]
-    return vec.astype("float32").tolist()
+    return embed_many([text])[0].tolist()
+
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+# delta 檔標頭：建立時索引已有的向量數（int64）與維度（int32），另保留 4 bytes
+_DELTA_HEADER = np.dtype([("base", "<i8"), ("dim", "<i4"), ("reserved", "<i4")])
 
 
 class SimpleVectorDB:
-    """封裝 FAISS index 與案例 JSON。"""
+    """封裝 FAISS index、向量 delta 檔與 append-only 案例庫。"""
+
+    def __init__(
+        self,
+        path: Path | None = None,
+        case_dir: Path | None = None,
+        index_type: str | None = None,
+        nlist: int | None = None,
+        train_min: int | None = None,
+        legacy_case_path: Path | None = None,
+    ):
+        """初始化資料庫並載入既有索引與案例。
 
-    def __init__(self, path: Path | None = None, case_path: Path | None = None):
-        """初始化資料庫並載入既有索引與案例。"""
+        ``legacy_case_path`` 為舊版 ``cases.json``；使用預設路徑時會自動帶入
+        ``config.CASE_DB_PATH``，並在案例庫為空時匯入一次。
+        """
         self.path = Path(path or config.VECTOR_DB_PATH)
-        self.case_path = Path(case_path or config.CASE_DB_PATH)
-        self.index: faiss.IndexFlatL2 | None = None
+        self.delta_path = self.path.with_name(self.path.name + ".delta")
+        self.case_dir = Path(case_dir or config.CASE_STORE_DIR)
+        if legacy_case_path is None and case_dir is None:
+            legacy_case_path = config.CASE_DB_PATH
+        self.index_type = (index_type or config.VECTOR_INDEX_TYPE).lower()
+        if self.index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown vector index type: {self.index_type}")
+        self.nlist = nlist or config.IVF_NLIST
+        self.train_min = max(train_min or config.IVF_TRAIN_MIN, self.nlist)
+        self._lock = threading.RLock()
+        self._migration: threading.Thread | None = None
+        self.index: faiss.Index | None = None
         if self.path.exists():
             try:
                 self.index = faiss.read_index(str(self.path))
             except Exception:
                 self.index = None
+        self._delta = None
+        self._delta_rows = 0
+        self._delta_unsynced = 0
+        self._checkpoint_due = False
+        self._replay_delta()
+        self._apply_search_params(self.index)
 
-        self.cases: List[Dict] = []
-        if self.case_path.exists():
-            try:
-                self.cases = json.loads(self.case_path.read_text())
-            except Exception:
-                self.cases = []
+        self.cases = CaseStore(self.case_dir, config.CASE_SEGMENT_BYTES)
+        if legacy_case_path is not None:
+            self._import_legacy_cases(Path(legacy_case_path))
+        # 案例先於向量寫入，若上次中斷於兩者之間則捨棄沒有對應向量的案例
+        ntotal = self.index.ntotal if self.index is not None else 0
+        if len(self.cases) > ntotal:
+            logger.warning("Dropping %d cases without vectors", len(self.cases) - ntotal)
+            self.cases.truncate(ntotal)
+
+        self._maybe_start_migration()
+
+    def _replay_delta(self) -> None:
+        """將上次 checkpoint 之後附加的向量重新加入索引。"""
+        if not self.delta_path.exists() or self.delta_path.stat().st_size < _DELTA_HEADER.itemsize:
+            return
+        header = np.fromfile(self.delta_path, dtype=_DELTA_HEADER, count=1)[0]
+        base, dim = int(header["base"]), int(header["dim"])
+        rows = (self.delta_path.stat().st_size - _DELTA_HEADER.itemsize) // (4 * dim)
+        self._delta_rows = rows
+        current = self.index.ntotal if self.index is not None else 0
+        skip = current - base
+        if skip < 0:
+            logger.error("Vector delta log starts at %d but index has only %d vectors", base, current)
+            return
+        if skip >= rows:
+            return
+        data = np.fromfile(
+            self.delta_path, dtype="float32", count=rows * dim, offset=_DELTA_HEADER.itemsize
+        ).reshape(rows, dim)
+        self._ensure_index(dim)
+        self.index.add(data[skip:])
+
+    def _import_legacy_cases(self, legacy: Path) -> None:
+        """匯入舊版整份 JSON 的案例檔，完成後改名避免重複匯入。"""
+        if not legacy.exists() or len(self.cases):
+            return
+        try:
+            cases = json.loads(legacy.read_text())
+        except Exception as exc:
+            logger.error("Cannot import legacy case file %s: %s", legacy, exc)
+            return
+        self.cases.append(cases)
+        self.cases.sync()
+        legacy.rename(legacy.with_name(legacy.name + ".migrated"))
+        logger.info("Imported %d legacy cases from %s", len(cases), legacy)
 
     def _ensure_index(self, dim: int) -> None:
         if self.index is None:
-            self.index = faiss.IndexFlatL2(dim)
+            if self.index_type == "hnsw":
+                index = faiss.IndexHNSWFlat(dim, config.HNSW_M)
+                index.hnsw.efConstruction = config.HNSW_EF_CONSTRUCTION
+                self._apply_search_params(index)
+                self.index = index
+            else:
+                # IVF 類型在累積足夠訓練資料前先以 flat 索引服務
+                self.index = faiss.IndexFlatL2(dim)
+
+    @staticmethod
+    def _apply_search_params(index, nprobe: int | None = None, ef_search: int | None = None) -> None:
+        """設定 IVF 的 ``nprobe`` 或 HNSW 的 ``efSearch``，其他索引類型忽略。"""
+        if index is None:
+            return
+        if hasattr(index, "nprobe"):
+            index.nprobe = nprobe or config.IVF_NPROBE
+        if hasattr(index, "hnsw"):
+            index.hnsw.efSearch = ef_search or config.HNSW_EF_SEARCH
+
+    @staticmethod
+    def _search_params(index, nprobe: int | None, ef_search: int | None):
+        """依索引類型建立單次查詢用的參數物件，不改動共用索引的設定。"""
+        if nprobe and isinstance(index, faiss.IndexIVF):
+            return faiss.SearchParametersIVF(nprobe=nprobe)
+        if ef_search and hasattr(index, "hnsw"):
+            return faiss.SearchParametersHNSW(efSearch=ef_search)
+        return None
+
+    @property
+    def is_trained_ann(self) -> bool:
+        """目前使用的索引是否已是設定的近似最近鄰索引。"""
+        with self._lock:
+            if self.index is None:
+                return False
+            if self.index_type.startswith("ivf"):
+                return isinstance(self.index, faiss.IndexIVF)
+            return True
+
+    def _maybe_start_migration(self) -> None:
+        """IVF 模式下向量數足夠時，於背景執行緒訓練並遷移 flat 索引。"""
+        if not self.index_type.startswith("ivf") or self.index is None:
+            return
+        if isinstance(self.index, faiss.IndexIVF) or self.index.ntotal < self.train_min:
+            return
+        if self._migration is not None and self._migration.is_alive():
+            return
+        self._migration = threading.Thread(target=self._migrate_to_ivf, name="faiss-ivf-train", daemon=True)
+        self._migration.start()
+
+    def _build_ivf(self, dim: int) -> faiss.IndexIVF:
+        quantizer = faiss.IndexFlatL2(dim)
+        if self.index_type == "ivf_pq":
+            return faiss.IndexIVFPQ(quantizer, dim, self.nlist, config.IVF_PQ_M, 8)
+        return faiss.IndexIVFFlat(quantizer, dim, self.nlist)
+
+    def _migrate_to_ivf(self) -> None:
+        """訓練 IVF 索引並取代 flat 索引；訓練期間搜尋仍由 flat 索引服務。"""
+        with self._lock:
+            flat = self.index
+            count = flat.ntotal
+            base = flat.reconstruct_n(0, count)
+        try:
+            ivf = self._build_ivf(flat.d)
+            ivf.train(base)
+            ivf.add(base)
+        except Exception as exc:  # pragma: no cover - faiss errors
+            logger.error("IVF index training failed: %s", exc)
+            return
+        with self._lock:
+            if self.index is not flat:
+                return
+            if flat.ntotal > count:
+                ivf.add(flat.reconstruct_n(count, flat.ntotal - count))
+            self._apply_search_params(ivf)
+            self.index = ivf
+            # 下次儲存時寫出訓練好的索引，重啟後不必重新訓練
+            self._checkpoint_due = True
+        logger.info("Migrated vector index to %s with %d vectors", self.index_type, ivf.ntotal)
+
+    def wait_for_migration(self, timeout: float | None = None) -> None:
+        """等待背景遷移完成，主要供測試與基準測試使用。"""
+        if self._migration is not None:
+            self._migration.join(timeout)
 
     def add(self, vecs: List[List[float]], cases: List[Dict]) -> None:
         """新增向量及案例。"""
-        if not vecs:
+        if len(vecs) == 0:
             return
-        arr = np.array(vecs, dtype="float32")
-        self._ensure_index(arr.shape[1])
-        self.index.add(arr)
-        self.cases.extend(cases)
+        arr = np.ascontiguousarray(vecs, dtype="float32")
+        with self._lock:
+            self._ensure_index(arr.shape[1])
+            self.cases.append(cases)
+            self._append_delta(arr)
+            self.index.add(arr)
+        self._maybe_start_migration()
+
+    def _append_delta(self, arr: np.ndarray) -> None:
+        """將新向量附加至 delta 檔；必要時以目前索引大小為起點建立新檔。"""
+        if self._delta is None:
+            if not self.delta_path.exists() or self.delta_path.stat().st_size < _DELTA_HEADER.itemsize:
+                header = np.array([(self.index.ntotal, arr.shape[1], 0)], dtype=_DELTA_HEADER)
+                self.delta_path.write_bytes(header.tobytes())
+                self._delta_rows = 0
+            self._delta = open(self.delta_path, "ab")
+        self._delta.write(arr.tobytes())
+        self._delta.flush()
+        self._delta_rows += len(arr)
+        self._delta_unsynced += arr.nbytes
+
+    def search_many(
+        self,
+        matrix: np.ndarray,
+        k: int = 3,
+        nprobe: int | None = None,
+        ef_search: int | None = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """以單次 FAISS 查詢搜尋 ``(n, d)`` 矩陣中每一列的 ``k`` 個最近向量。
 
-    def search(self, vec: List[float], k: int = 3) -> Tuple[List[int], List[float]]:
+        回傳形狀皆為 ``(n, k)`` 的 ``(ids, distances)`` 陣列；不足 ``k`` 筆時以
+        ``-1`` 與 ``inf`` 補齊。``nprobe``／``ef_search`` 可覆寫 IVF 與 HNSW 的預設搜尋參數。
+        """
+        arr = np.ascontiguousarray(matrix, dtype="float32")
+        if arr.ndim == 1:
+            arr = arr.reshape(1, -1)
+        with self._lock:
+            if self.index is None or self.index.ntotal == 0 or len(arr) == 0:
+                return (
+                    np.full((len(arr), k), -1, dtype="int64"),
+                    np.full((len(arr), k), np.inf, dtype="float32"),
+                )
+            params = self._search_params(self.index, nprobe, ef_search)
+            if params is None:
+                dists, ids = self.index.search(arr, k)
+            else:
+                dists, ids = self.index.search(arr, k, params=params)
+        return ids, dists
+
+    def search(
+        self,
+        vec: List[float],
+        k: int = 3,
+        nprobe: int | None = None,
+        ef_search: int | None = None,
+    ) -> Tuple[List[int], List[float]]:
         """搜尋 ``k`` 個最近向量並回傳索引與距離。"""
         if self.index is None or self.index.ntotal == 0:
             return [], []
-        arr = np.array([vec], dtype="float32")
-        dists, ids = self.index.search(arr, k)
+        ids, dists = self.search_many(np.asarray([vec]), k, nprobe, ef_search)
         return ids[0].tolist(), dists[0].tolist()
 
-    def get_cases(self, ids: Iterable[int]) -> List[Dict]:
-        """依向量索引取得案例。"""
-        return [self.cases[i] for i in ids if 0 <= i < len(self.cases)]
+    def get_cases(self, ids: Iterable[int]) -> List[Optional[Dict]]:
+        """依向量索引取得案例；與 ``ids`` 一一對應，不存在的案例為 ``None``。"""
+        return self.cases.get(ids)
 
-    def save(self) -> None:
-        """將索引與案例寫入磁碟。"""
-        try:
-            faiss.write_index(self.index, str(self.path))
-            self.case_path.write_text(json.dumps(self.cases))
-        except Exception:
-            # 測試環境寫入失敗可忽略
-            pass
+    def checkpoint(self) -> int:
+        """將完整索引原子地寫回磁碟，並以新的 delta 檔重新開始累積。
+
+        回傳索引檔的位元組數。
+        """
+        with self._lock:
+            if self.index is None:
+                return 0
+            tmp = self.path.with_name(self.path.name + ".tmp")
+            faiss.write_index(self.index, str(tmp))
+            replace_durably(tmp, self.path)
+            if self._delta is not None:
+                self._delta.close()
+                self._delta = None
+            header = np.array([(self.index.ntotal, self.index.d, 0)], dtype=_DELTA_HEADER)
+            tmp_delta = self.delta_path.with_name(self.delta_path.name + ".tmp")
+            tmp_delta.write_bytes(header.tobytes())
+            replace_durably(tmp_delta, self.delta_path)
+            self._delta_rows = 0
+            self.cases.compact()
+            return self.path.stat().st_size
+
+    def save(self) -> int:
+        """將新增的案例與向量 fsync 至磁碟，累積足夠時才寫入完整索引。
+
+        回傳本次寫入（或同步）的位元組數。寫入失敗時例外直接拋出，
+        :data:`PERSISTENCE` 會保留變更標記並在下次排程重試。
+        """
+        written = 0
+        with self._lock:
+            written += self.cases.sync()
+            if self._delta is not None:
+                self._delta.flush()
+                os.fsync(self._delta.fileno())
+                written += self._delta_unsynced
+                self._delta_unsynced = 0
+            if self._delta_rows >= config.INDEX_CHECKPOINT_EVERY or self._checkpoint_due:
+                written += self.checkpoint()
+                self._checkpoint_due = False
+        return written
 
 
 VECTOR_DB = SimpleVectorDB()
@@ -0,0 +1,103 @@
+"""LLM 判定結果快取。
+
+以 :func:`log_parser.mask_variables` 正規化後的日誌樣板為鍵，保存
+``llm_analyse`` 解析後的 JSON 判定並設定有效期限。記憶體層為 LRU，
+可選擇以 SQLite 作為磁碟層，讓快取在程式重新啟動後仍然有效。"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Tuple
+
+from .. import config
+from .log_parser import mask_variables
+from .utils import LRUCache, logger
+
+
+def verdict_key(line: str) -> str:
+    """回傳日誌樣板的雜湊值作為快取鍵。"""
+    return hashlib.sha1(mask_variables(line).encode("utf-8")).hexdigest()
+
+
+class VerdictCache:
+    """兩層（記憶體 LRU + 選用 SQLite）且具 TTL 的判定快取。"""
+
+    def __init__(self, capacity: int | None = None, ttl: float | None = None, db_path: str | Path | None = None):
+        self.ttl = float(ttl if ttl is not None else config.VERDICT_CACHE_TTL_SEC)
+        self._memory = LRUCache(capacity or config.CACHE_SIZE)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._db: sqlite3.Connection | None = None
+        if db_path:
+            try:
+                self._db = sqlite3.connect(str(db_path), check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS verdicts "
+                    "(key TEXT PRIMARY KEY, source TEXT NOT NULL, verdict TEXT NOT NULL, expires_at REAL NOT NULL)"
+                )
+                self._db.execute("DELETE FROM verdicts WHERE expires_at < ?", (time.time(),))
+                self._db.commit()
+            except sqlite3.Error as exc:
+                logger.error("Verdict cache database unavailable: %s", exc)
+                self._db = None
+
+    def get(self, line: str) -> Tuple[Dict, str] | None:
+        """取得仍在有效期限內的判定，並更新命中統計。
+
+        回傳 ``(verdict, source_line)``，``source_line`` 為當初產生此判定的原始日誌行。
+        """
+        key = verdict_key(line)
+        now = time.time()
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None and item[0] >= now:
+                self.hits += 1
+                return dict(item[2]), item[1]
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT source, verdict, expires_at FROM verdicts WHERE key = ?", (key,)
+                ).fetchone()
+                if row and row[2] >= now:
+                    verdict = json.loads(row[1])
+                    self._memory.put(key, (row[2], row[0], verdict))
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return dict(verdict), row[0]
+            self.misses += 1
+            return None
+
+    def put(self, line: str, verdict: Dict) -> None:
+        """寫入判定；兩層皆使用相同的到期時間。"""
+        key = verdict_key(line)
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._memory.put(key, (expires_at, line, dict(verdict)))
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO verdicts (key, source, verdict, expires_at) VALUES (?, ?, ?, ?)",
+                        (key, line, json.dumps(verdict, ensure_ascii=False), expires_at),
+                    )
+                    self._db.commit()
+                except sqlite3.Error as exc:  # pragma: no cover - disk errors
+                    logger.error("Verdict cache write failed: %s", exc)
+
+    def stats(self) -> Dict[str, float]:
+        """回傳命中／未命中次數與命中率。"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+VERDICT_CACHE = VerdictCache(db_path=config.VERDICT_CACHE_PATH or None)
@@ -1,11 +1,211 @@
-"""Wazuh ``logtest`` API 的簡易封裝，僅供測試環境使用。"""
+"""Wazuh ``logtest`` API 用戶端。
 
-from typing import Any
+所有請求共用同一個 ``requests.Session``，連線以 keep-alive 保留在連線池中。
+認證先以帳號密碼向 ``/security/user/authenticate`` 取得 JWT，之後以
+``Authorization: Bearer`` 送出；token 依其 ``exp``（無法解析時為
+``WAZUH_TOKEN_TTL_SEC``）在到期前更新，收到 401 時立即重新認證並重試一次。
+
+整批日誌以 :meth:`WazuhClient.logtest_many` 檢查：先依正規化（合併空白）後的
+日誌行去重並查詢具 TTL 的結果快取，未命中的行最多以
+``WAZUH_MAX_CONCURRENCY`` 個請求同時送出。請求失敗的行視為未觸發告警，且
+不寫入快取。"""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Sequence
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from .. import config
-from .utils import logger
+from .utils import LRUCache, logger
+
+# token 到期前提早更新的秒數，避免請求途中過期
+_TOKEN_REFRESH_MARGIN_SEC = 30
+
+
+def _line_key(line: str) -> str:
+    """回傳正規化（合併多餘空白）後日誌行的雜湊值。"""
+    return hashlib.sha1(" ".join(line.split()).encode("utf-8")).hexdigest()
+
+
+def _token_expiry(token: str, default_ttl: float) -> float:
+    """自 JWT 的 ``exp`` 欄位取得到期時間（``time.time()`` 秒數）。"""
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return time.time() + default_ttl
+
+
+def _has_alert(data: Any) -> bool:
+    """判斷 logtest 回應是否代表觸發告警。
+
+    Wazuh 4.x 回傳 ``data.alert`` 與 ``data.output.rule``；另接受舊版測試環境
+    的 ``total_alerts``／``hits``／``data`` 清單格式。
+    """
+    if not isinstance(data, dict):
+        return False
+    inner = data.get("data")
+    if isinstance(inner, dict):
+        if "alert" in inner:
+            return bool(inner["alert"])
+        rule = (inner.get("output") or {}).get("rule") or {}
+        return bool(rule.get("level"))
+    total = (
+        data.get("total_alerts")
+        or data.get("hits")
+        or (len(inner) if isinstance(inner, list) else 0)
+    )
+    return bool(total)
+
+
+class WazuhClient:
+    """共用連線、快取 JWT 與 logtest 結果的 Wazuh 用戶端。"""
+
+    def __init__(
+        self,
+        url: str | None = None,
+        user: str | None = None,
+        password: str | None = None,
+        max_concurrency: int | None = None,
+        cache_size: int | None = None,
+        cache_ttl: float | None = None,
+        timeout: float | None = None,
+    ) -> None:
+        self.url = (url or config.WAZUH_API_URL or "").rstrip("/")
+        self.user = user or config.WAZUH_API_USER
+        self.password = password or config.WAZUH_API_PASSWORD
+        self.max_concurrency = max(1, max_concurrency or config.WAZUH_MAX_CONCURRENCY)
+        self.cache_ttl = float(cache_ttl if cache_ttl is not None else config.WAZUH_CACHE_TTL_SEC)
+        self.timeout = timeout or config.WAZUH_TIMEOUT_SEC
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._session.verify = config.WAZUH_VERIFY_SSL
+        self._token: str | None = None
+        self._token_expires = 0.0
+        self._token_lock = threading.Lock()
+        self._cache = LRUCache(cache_size or config.WAZUH_CACHE_SIZE)
+        self._lock = threading.Lock()
+        self._executor: ThreadPoolExecutor | None = None
+        self._stats = {"requests": 0, "errors": 0, "cache_hits": 0, "cache_misses": 0, "token_refreshes": 0}
+
+    # -- 認證 -------------------------------------------------------------
+    def _authenticate(self) -> str:
+        resp = self._session.post(
+            f"{self.url}/security/user/authenticate",
+            auth=(self.user, self.password),
+            timeout=self.timeout,
+        )
+        resp.raise_for_status()
+        token = resp.json()["data"]["token"]
+        self._token = token
+        self._token_expires = _token_expiry(token, config.WAZUH_TOKEN_TTL_SEC)
+        with self._lock:
+            self._stats["token_refreshes"] += 1
+        return token
+
+    def _get_token(self, stale: str | None = None) -> str:
+        """回傳有效的 token；``stale`` 為剛被拒絕的 token，需強制更新。"""
+        with self._token_lock:
+            # 其他執行緒可能已在等待鎖的期間更新過 token，此時直接沿用
+            fresh = self._token is not None and time.time() < self._token_expires - _TOKEN_REFRESH_MARGIN_SEC
+            if fresh and self._token != stale:
+                return self._token
+            return self._authenticate()
+
+    # -- logtest ----------------------------------------------------------
+    def _request(self, line: str) -> bool:
+        body = {"event": line, "log_format": config.WAZUH_LOG_FORMAT, "location": "lms_log_analyzer"}
+        token = self._get_token()
+        for attempt in range(2):
+            resp = self._session.put(
+                f"{self.url}/logtest",
+                json=body,
+                headers={"Authorization": f"Bearer {token}"},
+                timeout=self.timeout,
+            )
+            with self._lock:
+                self._stats["requests"] += 1
+            if resp.status_code == 401 and attempt == 0:
+                token = self._get_token(stale=token)
+                continue
+            resp.raise_for_status()
+            return _has_alert(resp.json())
+        return False  # pragma: no cover - loop always returns or raises
+
+    def _check(self, line: str) -> bool | None:
+        try:
+            return self._request(line)
+        except Exception as exc:  # network errors must not stop the pipeline
+            with self._lock:
+                self._stats["errors"] += 1
+            logger.error("Wazuh logtest failed: %s", exc)
+            return None
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="wazuh")
+            return self._executor
+
+    def logtest_many(self, lines: Sequence[str]) -> List[bool]:
+        """檢查多行日誌是否觸發 Wazuh 告警，依輸入順序回傳結果。"""
+        keys = [_line_key(line) for line in lines]
+        verdicts: Dict[str, bool] = {}
+        missing: Dict[str, str] = {}
+        now = time.monotonic()
+        with self._lock:
+            for key, line in zip(keys, lines):
+                if key in verdicts or key in missing:
+                    continue
+                item = self._cache.get(key)
+                if item is not None and item[0] >= now:
+                    verdicts[key] = item[1]
+                    self._stats["cache_hits"] += 1
+                else:
+                    missing[key] = line
+                    self._stats["cache_misses"] += 1
+        if missing:
+            items = list(missing.items())
+            if len(items) == 1:
+                results = [self._check(items[0][1])]
+            else:
+                results = list(self._pool().map(self._check, [line for _, line in items]))
+            expires = time.monotonic() + self.cache_ttl
+            with self._lock:
+                for (key, _), result in zip(items, results):
+                    verdicts[key] = bool(result)
+                    if result is not None:
+                        self._cache.put(key, (expires, result))
+        return [verdicts[key] for key in keys]
+
+    def logtest(self, line: str) -> bool:
+        return self.logtest_many([line])[0]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+        self._session.close()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self._stats["cache_hits"] + self._stats["cache_misses"]
+            return {**self._stats, "hit_rate": self._stats["cache_hits"] / lookups if lookups else 0.0}
+
+
+WAZUH_CLIENT = WazuhClient()
 
 
 def logtest(line: str) -> bool:
@@ -21,23 +221,9 @@ def logtest(line: str) -> bool:
     bool
         若 Wazuh 產生告警則回傳 ``True``。
     """
-    url = f"{config.WAZUH_API_URL}/logtest"
-    try:
-        resp = requests.post(
-            url,
-            auth=(config.WAZUH_API_USER, config.WAZUH_API_PASSWORD),
-            json={"event": line},
-            timeout=5,
-        )
-        resp.raise_for_status()
-        data: Any = resp.json()
-        # Common fields: 'total_alerts' or 'hits'. Any non-zero indicates match
-        total = (
-            data.get("total_alerts")
-            or data.get("hits")
-            or (len(data.get("data", [])) if isinstance(data.get("data"), list) else 0)
-        )
-        return bool(total)
-    except Exception as exc:  # pragma: no cover - network errors
-        logger.error("Wazuh logtest failed: %s", exc)
-    return False
+    return WAZUH_CLIENT.logtest(line)
+
+
+def logtest_many(lines: Sequence[str]) -> List[bool]:
+    """整批檢查日誌行，重複或已快取的行不會再次送出。"""
+    return WAZUH_CLIENT.logtest_many(lines)
@@ -0,0 +1,190 @@
+"""CPU 密集工作的多行程 worker pool。
+
+關鍵字過濾、規則評分、日誌解析與 SentenceTransformer 編碼都是純 Python 或
+受 GIL 限制的運算，單一行程只能用到一顆核心。啟用 ``LMS_CPU_WORKERS`` 後，
+這些工作會把整批日誌切成連續的分片，分送給以 ``spawn`` 啟動的子行程；每個
+子行程各自載入規則與嵌入模型，可依 ``LMS_CPU_AFFINITY`` 綁定到指定核心。
+
+子行程只回傳精簡的 NumPy 陣列（過濾遮罩、``float32`` 分數與向量；解析結果
+則是逐欄位的字串清單與數值陣列，不含原始行），不回傳 dict 或物件清單；
+分片結果依原順序串接，與單一行程的結果相同。每批切成
+``min(子行程數, 行數 // LMS_CPU_POOL_MIN_SHARD)`` 片，不足兩片時直接在本行程
+計算，避免行程間傳輸的成本。
+樣板探勘、session 彙總與向量索引等具狀態的部分仍留在主行程。"""
+
+from __future__ import annotations
+
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from .. import config
+from .log_parser import LogRecord, parse_record
+from .utils import logger
+
+# 子行程內的嵌入模型，於第一次編碼時載入
+_EMBEDDER = None
+# 解析結果以欄位回傳；原始行由主行程補回，不必再傳一次
+_TEXT_FIELDS = ("fmt", "ip", "user", "method", "path", "agent", "timestamp")
+
+
+def parse_cpu_list(spec: str | None) -> List[int]:
+    """解析 ``"0-3,8"`` 形式的核心清單；空字串表示不綁定。"""
+    cpus: List[int] = []
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        low, _, high = part.partition("-")
+        cpus.extend(range(int(low), int(high or low) + 1))
+    return cpus
+
+
+def _init_worker(counter, cpus: Sequence[int]) -> None:
+    """子行程初始化：綁定核心並限制數值函式庫的執行緒數。"""
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+    if cpus and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, {cpus[index % len(cpus)]})
+        except OSError as exc:
+            logger.warning("Cannot pin worker %d to CPU %d: %s", index, cpus[index % len(cpus)], exc)
+    # 平行度來自多個行程，每個行程內的 BLAS／torch 只用一條執行緒以免超額訂閱
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ.setdefault(var, "1")
+
+
+def _rule_engine():
+    from .rule_engine import RULE_ENGINE
+
+    return RULE_ENGINE
+
+
+def _filter_shard(lines: List[str]) -> np.ndarray:
+    return _rule_engine().filter_mask(lines)
+
+
+def _score_shard(lines: List[str]) -> np.ndarray:
+    return _rule_engine().score_batch(lines)
+
+
+def _parse_shard(lines: List[str]) -> Tuple[Dict[str, List[str]], np.ndarray, np.ndarray]:
+    records = [parse_record(line) for line in lines]
+    text = {name: [getattr(r, name) for r in records] for name in _TEXT_FIELDS}
+    status = np.fromiter((r.status for r in records), dtype=np.int32, count=len(records))
+    resp_time = np.fromiter((r.resp_time for r in records), dtype=np.float64, count=len(records))
+    return text, status, resp_time
+
+
+def _encode_shard(texts: List[str]) -> np.ndarray:
+    # 子行程不匯入 vector_db，避免每個行程各自載入整個向量索引
+    global _EMBEDDER
+    if _EMBEDDER is None:
+        from sentence_transformers import SentenceTransformer
+
+        _EMBEDDER = SentenceTransformer(config.EMBED_MODEL_NAME)
+    return _EMBEDDER.encode(texts, batch_size=config.EMBED_BATCH_SIZE, convert_to_numpy=True).astype("float32")
+
+
+class CpuPool:
+    """將整批工作切片分送到多個子行程並依序合併結果。"""
+
+    def __init__(
+        self,
+        workers: int | None = None,
+        cpus: Sequence[int] | None = None,
+        min_shard: int | None = None,
+        start_method: str | None = None,
+    ) -> None:
+        self.workers = max(1, workers or config.CPU_WORKERS or 1)
+        self.cpus = list(cpus) if cpus is not None else parse_cpu_list(config.CPU_AFFINITY)
+        self.min_shard = max(1, min_shard or config.CPU_POOL_MIN_SHARD)
+        self.start_method = start_method or config.CPU_POOL_START_METHOD
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+        self._stats = {"shards": 0, "lines": 0, "inline": 0}
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                ctx = multiprocessing.get_context(self.start_method)
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=ctx,
+                    initializer=_init_worker,
+                    initargs=(ctx.Value("i", 0), self.cpus),
+                )
+            return self._executor
+
+    def _shards(self, items: Sequence) -> List[Sequence]:
+        count = min(self.workers, max(1, len(items) // self.min_shard))
+        bounds = np.linspace(0, len(items), count + 1).astype(int)
+        return [items[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+
+    def map(self, func: Callable, items: Sequence) -> List:
+        """以 ``func`` 處理 ``items`` 的每個分片，回傳各分片結果（依原順序）。"""
+        items = list(items)
+        shards = self._shards(items)
+        with self._lock:
+            self._stats["lines"] += len(items)
+            if len(shards) == 1:
+                self._stats["inline"] += 1
+            else:
+                self._stats["shards"] += len(shards)
+        if len(shards) == 1:
+            return [func(items)]
+        return list(self._pool().map(func, shards))
+
+    def filter_mask(self, lines: Sequence[str]) -> np.ndarray:
+        if not lines:
+            return np.zeros(0, dtype=bool)
+        return np.concatenate(self.map(_filter_shard, lines))
+
+    def score_batch(self, lines: Sequence[str]) -> np.ndarray:
+        if not lines:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate(self.map(_score_shard, lines))
+
+    def parse_records(self, lines: Sequence[str]) -> List[LogRecord]:
+        lines = list(lines)
+        records: List[LogRecord] = []
+        for text, status, resp_time in self.map(_parse_shard, lines):
+            columns = [text[name] for name in _TEXT_FIELDS]
+            for values, code, rt in zip(zip(*columns), status.tolist(), resp_time.tolist()):
+                fields = dict(zip(_TEXT_FIELDS, values))
+                records.append(LogRecord(lines[len(records)], status=code, resp_time=rt, **fields))
+        return records
+
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        """以子行程中的模型編碼；不足兩個分片的小批次仍使用本行程的模型。"""
+        from .vector_db import encode_local
+
+        texts = list(texts)
+        if len(texts) < self.min_shard * 2:
+            return encode_local(texts)
+        return np.concatenate(self.map(_encode_shard, texts))
+
+    def close(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"workers": self.workers, "cpus": list(self.cpus), **self._stats}
+
+
+def create_pool() -> CpuPool | None:
+    """依 ``CPU_WORKERS`` 建立 worker pool；未啟用時回傳 ``None``。"""
+    if config.CPU_WORKERS <= 1:
+        return None
+    pool = CpuPool()
+    atexit.register(pool.close)
+    return pool
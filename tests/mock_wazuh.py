@@ -0,0 +1,118 @@
+"""供測試與效能量測使用的本機 Wazuh API 模擬伺服器。
+
+實作 ``POST /security/user/authenticate``（Basic auth，回傳 JWT）與
+``PUT /logtest``（需 Bearer token）；事件內容包含任一 ``ALERT_KEYWORDS`` 時
+回報告警。伺服器使用 HTTP/1.1 keep-alive，並統計連線數、認證次數與
+logtest 請求數，``latency`` 可模擬每個請求的網路延遲。"""
+
+from __future__ import annotations
+
+import base64
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+ALERT_KEYWORDS = ("Failed password", "nmap", "/etc/passwd")
+
+
+def make_token(ttl: float) -> str:
+    def part(obj: Dict) -> str:
+        return base64.urlsafe_b64encode(json.dumps(obj).encode()).decode().rstrip("=")
+
+    return f"{part({'alg': 'none'})}.{part({'exp': time.time() + ttl, 'n': time.perf_counter_ns()})}.sig"
+
+
+class MockWazuh:
+    """在背景執行緒啟動的模擬伺服器；可作為 context manager 使用。"""
+
+    def __init__(self, user: str = "wazuh", password: str = "secret", token_ttl: float = 900, latency: float = 0.0):
+        self.user = user
+        self.password = password
+        self.token_ttl = token_ttl
+        self.latency = latency
+        self.tokens: Dict[str, float] = {}
+        self.counts = {"connections": 0, "authentications": 0, "logtests": 0, "unauthorized": 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def revoke_tokens(self) -> None:
+        with self._lock:
+            self.tokens.clear()
+
+    def __enter__(self) -> "MockWazuh":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # 標頭與內容分開寫出，關閉 Nagle 以免 keep-alive 連線受延遲 ACK 拖慢
+                self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                with mock._lock:
+                    mock.counts["connections"] += 1
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status: int, body: Dict) -> None:
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _body(self) -> Dict:
+                length = int(self.headers.get("Content-Length") or 0)
+                return json.loads(self.rfile.read(length) or b"{}")
+
+            def do_POST(self):
+                self._body()
+                if self.path != "/security/user/authenticate":
+                    return self._reply(404, {"error": 1})
+                expected = base64.b64encode(f"{mock.user}:{mock.password}".encode()).decode()
+                if self.headers.get("Authorization") != f"Basic {expected}":
+                    return self._reply(401, {"error": 401})
+                token = make_token(mock.token_ttl)
+                with mock._lock:
+                    mock.tokens[token] = time.time() + mock.token_ttl
+                    mock.counts["authentications"] += 1
+                self._reply(200, {"data": {"token": token}, "error": 0})
+
+            def do_PUT(self):
+                body = self._body()
+                if self.path != "/logtest":
+                    return self._reply(404, {"error": 1})
+                token = (self.headers.get("Authorization") or "").removeprefix("Bearer ")
+                with mock._lock:
+                    valid = mock.tokens.get(token, 0) > time.time()
+                    mock.counts["logtests" if valid else "unauthorized"] += 1
+                if not valid:
+                    return self._reply(401, {"title": "Unauthorized", "error": 401})
+                if mock.latency:
+                    time.sleep(mock.latency)
+                event = body.get("event", "")
+                alert = any(k in event for k in ALERT_KEYWORDS)
+                output = {"rule": {"level": 10, "description": "mock"}} if alert else {}
+                self._reply(200, {"data": {"output": output, "alert": alert, "messages": []}, "error": 0})
+
+        return Handler
@@ -0,0 +1,143 @@
+import json
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+import faiss
+import numpy as np
+
+from lms_log_analyzer.src.case_store import OFFSET_DTYPE, CaseStore
+from lms_log_analyzer.src.vector_db import SimpleVectorDB
+
+
+class TestCaseStore(TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.dir = Path(tmpdir.name)
+
+    def test_append_and_random_access_across_segments(self):
+        store = CaseStore(self.dir, segment_bytes=64)
+        ids = store.append([{"line": f"log {i}", "n": i} for i in range(20)])
+        self.assertEqual(ids, list(range(20)))
+        self.assertGreater(len(list(self.dir.glob("segment-*.jsonl"))), 1)
+        self.assertEqual([c and c["n"] for c in store.get([19, 3, -1, 99, 4])], [19, 3, None, None, 4])
+        store.close()
+
+        reopened = CaseStore(self.dir, segment_bytes=64)
+        self.assertEqual(len(reopened), 20)
+        self.assertEqual(reopened.get([7])[0]["line"], "log 7")
+        self.assertEqual(reopened.append([{"n": 20}]), [20])
+
+    def test_torn_write_is_discarded_on_open(self):
+        store = CaseStore(self.dir)
+        store.append([{"n": 0}, {"n": 1}])
+        store.close()
+        with open(self.dir / "segment-000001.jsonl", "ab") as fh:
+            fh.write(b'{"n": 2')
+        with open(self.dir / "offsets.idx", "ab") as fh:
+            fh.write(b"\x01\x00")
+
+        store = CaseStore(self.dir)
+        self.assertEqual(len(store), 2)
+        store.append([{"n": 2}])
+        self.assertEqual([c["n"] for c in store.get(range(3))], [0, 1, 2])
+
+    def test_compact_merges_small_segments(self):
+        store = CaseStore(self.dir, segment_bytes=200)
+        for i in range(6):
+            store.append([{"n": i, "pad": "x" * 120}])
+        self.assertEqual(store.compact(), 0)
+        store.segment_bytes = 10_000
+        merged = store.compact()
+        self.assertGreater(merged, 0)
+        self.assertEqual([c["n"] for c in store.get(range(6))], list(range(6)))
+        store.close()
+        self.assertEqual([c["n"] for c in CaseStore(self.dir).get(range(6))], list(range(6)))
+
+    def test_truncate_reclaims_dropped_cases(self):
+        store = CaseStore(self.dir, segment_bytes=64)
+        store.append([{"line": f"log {i}", "n": i} for i in range(20)])
+        segments = len(list(self.dir.glob("segment-*.jsonl")))
+        store.truncate(5)
+        self.assertLess(len(list(self.dir.glob("segment-*.jsonl"))), segments)
+        kept = store.get(range(5))
+        total = sum(p.stat().st_size for p in self.dir.glob("segment-*.jsonl"))
+        self.assertEqual(total, sum(len(json.dumps(c).encode()) + 1 for c in kept))
+        self.assertEqual(store.append([{"n": 5}]), [5])
+        store.close()
+        self.assertEqual([c["n"] for c in CaseStore(self.dir).get(range(6))], list(range(6)))
+
+    def test_truncate_after_compaction_keeps_interleaved_segments(self):
+        store = CaseStore(self.dir, segment_bytes=200)
+        # 小、大案例交錯，每筆各佔一個分段；壓縮把小分段 1、3、5 合併進 1
+        for i in range(6):
+            store.append([{"n": i, "pad": "x" * (180 if i % 2 else 0)}])
+        self.assertEqual(len(list(self.dir.glob("segment-*.jsonl"))), 6)
+        self.assertEqual(store.compact(), 2)
+        store.truncate(3)
+        self.assertEqual([c["n"] for c in store.get(range(3))], [0, 1, 2])
+        self.assertEqual(sorted(p.name for p in self.dir.glob("segment-*.jsonl")),
+                         ["segment-000001.jsonl", "segment-000002.jsonl", "segment-000003.jsonl"])
+        self.assertEqual(store.append([{"n": 3}]), [3])
+        store.close()
+        reopened = CaseStore(self.dir, segment_bytes=200)
+        self.assertEqual([c["n"] for c in reopened.get(range(4))], [0, 1, 2, 3])
+        self.assertEqual(reopened.append([{"n": 4}]), [4])
+        self.assertEqual([c["n"] for c in reopened.get(range(5))], [0, 1, 2, 3, 4])
+
+    def test_compact_drops_unreferenced_records(self):
+        store = CaseStore(self.dir, segment_bytes=200)
+        for i in range(6):
+            store.append([{"n": i, "pad": "x" * 120}])
+        store.close()
+        # 模擬舊版只截斷位移索引所留下的孤立紀錄
+        with open(self.dir / "offsets.idx", "r+b") as fh:
+            fh.truncate(3 * OFFSET_DTYPE.itemsize)
+        store = CaseStore(self.dir, segment_bytes=10_000)
+        store.append([{"n": 3}])
+        self.assertGreater(store.compact(), 0)
+        self.assertEqual([c["n"] for c in store.get(range(4))], list(range(4)))
+        # 只剩合併後的分段 1 與目前寫入中的分段 3，孤立紀錄所在的分段已移除
+        self.assertEqual(sorted(p.name for p in self.dir.glob("segment-*.jsonl")),
+                         ["segment-000001.jsonl", "segment-000003.jsonl"])
+        self.assertEqual((self.dir / "segment-000001.jsonl").read_bytes().count(b"\n"), 2)
+        store.close()
+        self.assertEqual([c["n"] for c in CaseStore(self.dir).get(range(4))], list(range(4)))
+
+
+class TestVectorDBPersistence(TestCase):
+    def test_delta_replay_and_checkpoint(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp = Path(tmpdir)
+            data = np.random.default_rng(2).random((10, 4), dtype="float32")
+            db = SimpleVectorDB(tmp / "faiss.index", tmp / "cases", index_type="flat")
+            db.add(data[:6], [{"n": i} for i in range(6)])
+            db.save()
+            self.assertFalse((tmp / "faiss.index").exists())
+
+            db = SimpleVectorDB(tmp / "faiss.index", tmp / "cases", index_type="flat")
+            self.assertEqual(db.index.ntotal, 6)
+            db.checkpoint()
+            db.add(data[6:], [{"n": i} for i in range(6, 10)])
+            db.save()
+
+            db = SimpleVectorDB(tmp / "faiss.index", tmp / "cases", index_type="flat")
+            self.assertEqual(db.index.ntotal, 10)
+            ids, _ = db.search(data[8], k=1)
+            self.assertEqual(db.get_cases(ids), [{"n": 8}])
+
+    def test_imports_legacy_json_cases(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp = Path(tmpdir)
+            legacy = tmp / "cases.json"
+            legacy.write_text('[{"n": 0}, {"n": 1}]')
+            index = faiss.IndexFlatL2(4)
+            index.add(np.eye(4, dtype="float32")[:2])
+            faiss.write_index(index, str(tmp / "faiss.index"))
+
+            db = SimpleVectorDB(tmp / "faiss.index", tmp / "cases", index_type="flat", legacy_case_path=legacy)
+            self.assertFalse(legacy.exists())
+            self.assertTrue((tmp / "cases.json.migrated").exists())
+            ids, _ = db.search([0.0, 1.0, 0.0, 0.0], k=1)
+            self.assertEqual(db.get_cases(ids), [{"n": 1}])
@@ -0,0 +1,154 @@
+import json
+import tempfile
+import time
+from contextlib import ExitStack
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import TestCase
+from unittest.mock import patch
+
+import numpy as np
+
+from lms_log_analyzer.src import llm_handler, log_processor
+from lms_log_analyzer.src.cost_tracker import CostTracker, usage_from_response
+from lms_log_analyzer.src.utils import RateLimiter
+from lms_log_analyzer.src.verdict_cache import VerdictCache
+from tests.test_integration import FakeOpenSearch
+
+
+class TestCostTracker(TestCase):
+    def test_rolling_window_expires_spend(self):
+        tracker = CostTracker(budget_usd=1.0, price_in_per_1k=1.0, price_out_per_1k=2.0)
+        self.assertAlmostEqual(tracker.record(1000, 500, now=0), 2.0)
+        tracker.record(500, 0, now=1800)
+        self.assertAlmostEqual(tracker.spend(now=1800), 2.5)
+        self.assertAlmostEqual(tracker.spend(now=3601), 0.5)
+        self.assertEqual(tracker.stats()["llm_calls"], 2)
+
+    def test_usage_metadata_or_estimate(self):
+        resp = SimpleNamespace(content="{}", usage_metadata={"input_tokens": 120, "output_tokens": 30})
+        self.assertEqual(usage_from_response(resp, "x"), (120, 30))
+        resp = SimpleNamespace(content="{}", response_metadata={
+            "usage_metadata": {"prompt_token_count": 7, "candidates_token_count": 3}})
+        self.assertEqual(usage_from_response(resp, "x"), (7, 3))
+        self.assertEqual(usage_from_response(SimpleNamespace(content="a" * 40), "b" * 400), (100, 10))
+
+    def test_admission_shrinks_near_budget(self):
+        tracker = CostTracker(budget_usd=1.0, price_in_per_1k=0.001, price_out_per_1k=0.0, soft_limit_ratio=0.5)
+        self.assertEqual(tracker.admit(100, now=0), 100)
+        tracker.record(750_000, 0, items=1000, now=0)
+        # 花費 0.75：軟上限之後剩餘一半額度，可分析數量約減半
+        self.assertEqual(tracker.admit(100, now=1), 50)
+        tracker.record(250_000, 0, now=2)
+        self.assertEqual(tracker.admit(100, now=3), 0)
+
+    def test_backlog_is_bounded(self):
+        tracker = CostTracker(backlog_max=3)
+        tracker.defer([1, 2])
+        tracker.defer([3, 4])
+        self.assertEqual(tracker.backlog_size(), 3)
+        self.assertEqual(tracker.drain(2), [2, 3])
+        self.assertEqual(tracker.stats()["dropped"], 1)
+
+    def test_backlog_drain_is_capped_per_batch(self):
+        tracker = CostTracker(budget_usd=1.0, price_in_per_1k=0.001, price_out_per_1k=0.0, backlog_max=100)
+        tracker.defer(list(range(100)))
+        allowed, drained = tracker.admit_with_backlog(5, drain_max=10, now=0)
+        self.assertEqual((allowed, drained), (5, list(range(10))))
+        self.assertEqual(tracker.admitted, 15)
+        # 預算用盡時不取出任何待辦項目，也不計入送出數
+        tracker.record(1_000_000, 0, now=1)
+        self.assertEqual(tracker.admit_with_backlog(5, drain_max=10, now=2), (0, []))
+        self.assertEqual((tracker.admitted, tracker.backlog_size()), (15, 90))
+
+
+class TestCostGovernedPipeline(TestCase):
+    def test_handler_records_usage(self):
+        tracker = CostTracker(budget_usd=5.0)
+        chat = SimpleNamespace(invoke=lambda messages: SimpleNamespace(
+            content=json.dumps({"is_attack": False}), usage_metadata={"input_tokens": 900, "output_tokens": 100}))
+        with patch.object(llm_handler, "_RATE_LIMITER", RateLimiter(0)), \
+             patch.object(llm_handler, "VERDICT_CACHE", VerdictCache(10)), \
+             patch.object(llm_handler, "COST_TRACKER", tracker), \
+             patch.object(llm_handler, "_chat", return_value=chat):
+            llm_handler.llm_analyse([{"alert": {"original_log": "x"}}])
+        self.assertEqual(tracker.stats()["tokens_in_last_hour"], 900)
+
+    def _governed(self, tracker, state):
+        return [
+            patch.object(log_processor, 'llm_analyse', side_effect=lambda p: [{'is_attack': False} for _ in p]),
+            patch.object(log_processor, 'embed_many', side_effect=lambda t: np.zeros((len(t), 3), dtype='float32')),
+            patch.object(log_processor, 'VECTOR_DB', _NullDB()),
+            patch.object(log_processor, 'COST_TRACKER', tracker),
+            patch.object(log_processor, 'STATE', state),
+            patch.object(log_processor, 'PERSISTENCE'),
+            patch.object(log_processor.config, 'SAMPLE_TOP_PERCENT', 100),
+        ]
+
+    def test_exhausted_budget_defers_then_drains(self):
+        tracker = CostTracker(budget_usd=10.0, price_in_per_1k=1.0, price_out_per_1k=0.0, window_sec=0.2)
+        tracker.record(10_000, 0, items=1000)
+        lines = ["error disk full", "fail to bind socket", "kernel error in module nf_conntrack now", "auth failure"]
+        sources = [{"file": "/var/log/app.log", "offset": 100 * (i + 1)} for i in range(4)]
+        state = {}
+        with tempfile.TemporaryDirectory() as tmpdir, ExitStack() as stack:
+            output = Path(tmpdir) / "results.json"
+            for p in self._governed(tracker, state):
+                stack.enter_context(p)
+            stack.enter_context(patch.object(log_processor.config, 'LMS_ANALYSIS_OUTPUT_FILE', output))
+            self.assertEqual(log_processor.analyse_lines(lines, sources), [])
+            self.assertEqual(tracker.backlog_size(), 4)
+            # 延後的行連同來源寫入狀態，重新啟動後仍可取回
+            self.assertEqual([item["members"][0]["source"] for item in state["deferred"]], sources)
+            time.sleep(0.25)
+            results = log_processor.analyse_lines(["error unrelated single line"])
+            delivered = [json.loads(line) for line in output.read_text(encoding="utf-8").splitlines()]
+
+        # 補入分析的項目不混入本批結果，而是依來源另行寫出
+        self.assertEqual([r["line"] for r in results], ["error unrelated single line"])
+        self.assertEqual(sorted(d["source"]["offset"] for d in delivered), [100, 200, 300, 400])
+        self.assertTrue(all(d["analysis"] == {"is_attack": False} for d in delivered))
+        self.assertEqual(tracker.backlog_size(), 0)
+        self.assertEqual(state["deferred"], [])
+        self.assertEqual(tracker.stats()["drained"], 4)
+
+    def test_deferred_documents_are_written_back_to_their_own_ids(self):
+        tracker = CostTracker(budget_usd=10.0, price_in_per_1k=1.0, price_out_per_1k=0.0, window_sec=0.2)
+        tracker.record(10_000, 0, items=1000)
+        docs = [
+            {"_index": "logs", "_id": f"doc-{i}", "_source": {"message": f"error {i}"}, "sort": [i]}
+            for i in range(3)
+        ]
+        state = {}
+        with ExitStack() as stack:
+            for p in self._governed(tracker, state):
+                stack.enter_context(p)
+            stack.enter_context(patch.object(log_processor, '_get_os_client', return_value=FakeOpenSearch(docs)))
+            mock_bulk = stack.enter_context(patch.object(log_processor.helpers, 'bulk', return_value=(0, [])))
+            log_processor.poll_opensearch(index="logs", page_size=10)
+            # 預算用盡：三份文件都延後，既不標記完成，也不會被下一次輪詢重複取回
+            self.assertEqual(mock_bulk.call_count, 0)
+            self.assertEqual(len(log_processor._deferred_docs()), 3)
+            backlog = tracker.backlog_size()
+            log_processor.poll_opensearch(index="logs", page_size=10)
+            self.assertEqual(tracker.backlog_size(), backlog)
+            time.sleep(0.25)
+            results = log_processor.analyse_lines(["error from an api caller"])
+
+        self.assertEqual([r["line"] for r in results], ["error from an api caller"])
+        actions = [a for call in mock_bulk.call_args_list for a in call.args[1]]
+        self.assertEqual(sorted(a["_id"] for a in actions), ["doc-0", "doc-1", "doc-2"])
+        self.assertTrue(all(a["doc"]["ai_analysis_completed"] for a in actions))
+        self.assertEqual(state["deferred"], [])
+
+
+class _NullDB:
+    def add(self, vecs, cases):
+        pass
+
+    def search_many(self, matrix, k=3):
+        n = len(matrix)
+        return np.full((n, k), -1), np.full((n, k), np.inf)
+
+    def get_cases(self, ids):
+        return []
@@ -1,6 +1,12 @@
+import queue
+import tempfile
+import time
+from pathlib import Path
 from unittest import TestCase
+from lms_log_analyzer.src.graph_backend import GraphBackend, MemoryGraphBackend
 from lms_log_analyzer.src.graph_builder import GraphBuilder
 from lms_log_analyzer.src.graph_retrieval_tool import GraphRetrievalTool
+from lms_log_analyzer.src.graph_writer import GraphWriter
 
 class TestGraphModules(TestCase):
     def test_builder_methods_noop_without_graph(self):
@@ -18,3 +24,273 @@ class TestGraphModules(TestCase):
         tool = GraphRetrievalTool(builder)
         result = tool.retrieve_for_line("Failed login from 1.1.1.1 user=root")
         self.assertEqual(result, {"nodes": [], "relationships": []})
+
+
+class FakeTx:
+    def __init__(self, graph):
+        self.graph = graph
+
+    def run(self, cypher, **params):
+        self.graph.statements.append((cypher, params))
+
+
+class FakeGraph:
+    """記錄送出的 Cypher 語句與參數。"""
+
+    def __init__(self, delay=0.0, rows=None, failures=0):
+        self.statements = []
+        self.failures = failures
+        self.commits = 0
+        self.delay = delay
+        self.rows = rows or []
+        self.queries = []
+
+    def run(self, cypher, **params):
+        self.queries.append((cypher, params))
+        return [row for row in self.rows if row["eid"] in params.get("ids", [])]
+
+    def begin(self):
+        return FakeTx(self)
+
+    def commit(self, tx):
+        time.sleep(self.delay)
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("neo4j unavailable")
+        self.commits += 1
+
+
+class TestBatchedGraphWrites(TestCase):
+    def _builder(self, graph):
+        builder = GraphBuilder(uri="bolt://invalid:7687")
+        builder.graph = graph
+        return builder
+
+    def test_unwind_groups_by_label_and_type(self):
+        graph = FakeGraph()
+        builder = self._builder(graph)
+        written = builder.create_entities([
+            {"id": "ip_1.1.1.1", "label": "IP", "properties": {"address": "1.1.1.1"}},
+            {"id": "user_root", "label": "User", "properties": {"meta": {"a": 1}}},
+            {"id": "ip_2.2.2.2", "label": "IP"},
+            {"id": "x", "label": "Bad Label) DETACH DELETE n //"},
+        ])
+        self.assertEqual(written, 4)
+        self.assertEqual(graph.commits, 1)
+        self.assertEqual(len(graph.statements), 3)
+        ip_stmt, ip_params = graph.statements[0]
+        self.assertTrue(ip_stmt.startswith("UNWIND $rows AS row MERGE (n:Entity {id: row.id})"))
+        self.assertIn("n:IP", ip_stmt)
+        self.assertEqual([r["id"] for r in ip_params["rows"]], ["ip_1.1.1.1", "ip_2.2.2.2"])
+        self.assertEqual(graph.statements[1][1]["rows"][0]["props"], {"meta": '{"a": 1}'})
+        self.assertNotIn("DELETE", graph.statements[2][0])
+
+        graph.statements.clear()
+        builder.create_relations([
+            {"start_id": "ip_1.1.1.1", "end_id": "user_root", "type": "LOGIN_AS"},
+            {"start_id": "ip_1.1.1.1", "end_id": "user_root", "type": "LOGIN_AS"},
+            {"start_id": "ip_2.2.2.2", "end_id": "user_root"},
+        ])
+        stmts = [c for c, _ in graph.statements]
+        self.assertEqual(len(stmts), 2)
+        self.assertIn("MATCH (a:Entity {id: row.start})", stmts[0])
+        self.assertIn("MERGE (a)-[:LOGIN_AS]->(b)", stmts[0])
+        self.assertEqual(len(graph.statements[0][1]["rows"]), 1)
+        self.assertIn("[:RELATED]", stmts[1])
+
+    def test_writer_coalesces_and_flushes(self):
+        graph = FakeGraph()
+        writer = GraphWriter(self._builder(graph), max_queue=100, batch_size=1000, flush_interval=60)
+        for i in range(20):
+            writer.submit([{"id": "ip_9.9.9.9", "label": "IP", "properties": {"n": i}}],
+                          [{"start_id": "ip_9.9.9.9", "end_id": "user_root", "type": "LOGIN_AS"}])
+        writer.flush()
+        self.assertEqual(graph.commits, 2)
+        entity_rows = graph.statements[0][1]["rows"]
+        self.assertEqual(entity_rows, [{"id": "ip_9.9.9.9", "props": {"n": 19}}])
+        self.assertEqual(len(graph.statements[1][1]["rows"]), 1)
+        self.assertEqual(writer.stats()["batches"], 1)
+        writer.submit([{"id": "late", "label": "IP"}])
+        writer.stop()
+        self.assertEqual(writer.stats()["entities_written"], 2)
+
+    def test_full_queue_applies_backpressure(self):
+        graph = FakeGraph(delay=0.2)
+        writer = GraphWriter(self._builder(graph), max_queue=1, batch_size=1, flush_interval=60)
+        writer.submit([{"id": "a", "label": "IP"}])
+        writer.submit([{"id": "b", "label": "IP"}])
+        with self.assertRaises(queue.Full):
+            writer.submit([{"id": "c", "label": "IP"}], timeout=0.01)
+        writer.stop()
+
+    def _wait(self, predicate, timeout=3.0):
+        deadline = time.monotonic() + timeout
+        while not predicate() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return predicate()
+
+    def test_failed_batch_is_merged_into_retry(self):
+        graph = FakeGraph(failures=1)
+        writer = GraphWriter(self._builder(graph), max_queue=100, batch_size=1000, flush_interval=60,
+                             retry_max=0.05)
+        writer.submit([{"id": "a", "label": "IP"}])
+        writer.flush()
+        self.assertEqual(writer.stats()["retries"], 1)
+        writer.submit([{"id": "b", "label": "IP"}])
+        self.assertTrue(self._wait(lambda: writer.stats()["entities_written"] == 2))
+        rows = [row["id"] for _, params in graph.statements for row in params["rows"]]
+        self.assertEqual(sorted(set(rows)), ["a", "b"])
+        self.assertEqual(writer.stats()["dropped_batches"], 0)
+        writer.stop()
+
+    def test_batch_is_dropped_after_retry_limit(self):
+        graph = FakeGraph(failures=100)
+        writer = GraphWriter(self._builder(graph), max_queue=100, batch_size=1000, flush_interval=60,
+                             max_retries=2, retry_max=0.01)
+        writer.submit([{"id": "a", "label": "IP"}], [{"start_id": "a", "end_id": "b", "type": "X"}])
+        writer.flush()
+        self.assertTrue(self._wait(lambda: writer.stats()["dropped_batches"] == 1))
+        stats = writer.stats()
+        self.assertEqual((stats["errors"], stats["retries"]), (3, 2))
+        self.assertEqual((stats["dropped_entities"], stats["dropped_relations"]), (1, 1))
+        graph.failures = 0
+        writer.submit([{"id": "c", "label": "IP"}])
+        writer.stop()
+        self.assertEqual(writer.stats()["entities_written"], 1)
+
+
+class FakeNode(dict):
+    labels = ("Entity",)
+
+
+class LOGIN_AS:
+    def __init__(self, start, end):
+        self.start_node = start
+        self.end_node = end
+
+
+class TestSubgraphRetrieval(TestCase):
+    def setUp(self):
+        ip, user = FakeNode(id="ip_1.1.1.1"), FakeNode(id="user_root")
+        self.graph = FakeGraph(rows=[
+            {"eid": "ip_1.1.1.1", "nodes": [ip, user], "rels": [LOGIN_AS(ip, user)]},
+            {"eid": "user_root", "nodes": [user, ip], "rels": [LOGIN_AS(ip, user)]},
+        ])
+        self.builder = GraphBuilder(uri="bolt://invalid:7687")
+        self.builder.graph = self.graph
+        self.tool = GraphRetrievalTool(self.builder, cache_size=100, ttl=60, fanout=7)
+
+    def test_batch_uses_single_indexed_query(self):
+        results = self.tool.retrieve_many([
+            "Failed login from 1.1.1.1 user=root",
+            "GET /admin from 1.1.1.1",
+            "GET / from 8.8.8.8",
+        ])
+        self.assertEqual(len(self.graph.queries), 1)
+        cypher, params = self.graph.queries[0]
+        self.assertIn("MATCH (n:Entity {id: eid})", cypher)
+        self.assertIn("LIMIT $fanout", cypher)
+        self.assertEqual(params["fanout"], 7)
+        self.assertEqual(sorted(params["ids"]), ["ip_1.1.1.1", "ip_8.8.8.8", "user_root"])
+        self.assertEqual(len(results[0]["nodes"]), 2)
+        self.assertEqual(len(results[0]["relationships"]), 1)
+        self.assertEqual(results[0]["relationships"][0]["type"], "LOGIN_AS")
+        self.assertEqual(results[2], {"nodes": [], "relationships": []})
+
+        # 熱點實體（含查無結果者）直接由快取回應
+        self.tool.retrieve_many(["GET / from 8.8.8.8", "again 1.1.1.1"])
+        self.assertEqual(len(self.graph.queries), 1)
+        self.assertEqual(self.tool.stats()["hits"], 2)
+
+    def test_writes_invalidate_neighbourhoods(self):
+        self.tool.retrieve_many(["Failed login from 1.1.1.1 user=root", "GET / from 8.8.8.8"])
+        # user_root 出現在 ip_1.1.1.1 的鄰域內，兩者皆須失效；無關的 8.8.8.8 保留
+        self.builder.create_entities([{"id": "user_root", "label": "User"}])
+        self.assertEqual(self.tool.stats()["cached"], 1)
+        self.tool.retrieve_many(["GET / from 8.8.8.8", "again 1.1.1.1"])
+        self.assertEqual(len(self.graph.queries), 2)
+        self.assertEqual(self.graph.queries[1][1]["ids"], ["ip_1.1.1.1"])
+
+    def test_expired_entries_are_refetched(self):
+        tool = GraphRetrievalTool(self.builder, ttl=0)
+        tool.retrieve_for_line("from 1.1.1.1")
+        time.sleep(0.01)
+        tool.retrieve_for_line("from 1.1.1.1")
+        self.assertEqual(len(self.graph.queries), 2)
+
+
+class TestMemoryGraphBackend(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def _populate(self, builder):
+        builder.create_entities([
+            {"id": "ip_1.1.1.1", "label": "IP", "properties": {"address": "1.1.1.1"}},
+            {"id": "user_root", "label": "User"},
+            {"id": "host_web", "label": "Host"},
+        ])
+        builder.create_relations([
+            {"start_id": "ip_1.1.1.1", "end_id": "user_root", "type": "LOGIN_AS"},
+            {"start_id": "user_root", "end_id": "host_web", "type": "ON_HOST"},
+            {"start_id": "ip_1.1.1.1", "end_id": "missing", "type": "LOGIN_AS"},
+        ])
+
+    def test_khop_retrieval_through_tool(self):
+        builder = GraphBuilder(backend=MemoryGraphBackend(self.tmp.name))
+        self._populate(builder)
+        tool = GraphRetrievalTool(builder)
+        sub = tool.retrieve_for_line("Failed login from 1.1.1.1")
+        self.assertEqual({n["id"] for n in sub["nodes"]}, {"ip_1.1.1.1", "user_root"})
+        self.assertEqual(sub["relationships"], [{"start_id": "ip_1.1.1.1", "end_id": "user_root", "type": "LOGIN_AS"}])
+        ip = next(n for n in sub["nodes"] if n["id"] == "ip_1.1.1.1")
+        self.assertEqual(ip["labels"], ["Entity", "IP"])
+        self.assertEqual(ip["properties"]["address"], "1.1.1.1")
+
+        two_hop = tool.retrieve_for_line("Failed login from 1.1.1.1", depth=2)
+        self.assertEqual(len(two_hop["relationships"]), 2)
+        capped = builder.graph.neighbourhoods(["user_root"], 1, 1)
+        self.assertEqual(len(capped["user_root"]["relationships"]), 1)
+        self.assertEqual(builder.graph.neighbourhoods(["ip_8.8.8.8"], 1, 10), {})
+
+        # 寫入新關係後快取失效，查詢看得到新鄰居
+        builder.create_entities([{"id": "user_admin", "label": "User"}])
+        builder.create_relations([{"start_id": "ip_1.1.1.1", "end_id": "user_admin", "type": "LOGIN_AS"}])
+        sub = tool.retrieve_for_line("Failed login from 1.1.1.1")
+        self.assertIn("user_admin", {n["id"] for n in sub["nodes"]})
+        builder.close()
+
+    def test_snapshot_and_change_log_survive_restart(self):
+        backend = MemoryGraphBackend(self.tmp.name, compact_every=4)
+        self._populate(GraphBuilder(backend=backend))
+        backend.merge_entities({"IP": [{"id": "ip_2.2.2.2", "props": {}}]})
+        self.assertTrue(backend.snapshot_path.exists())
+        self.assertGreater(backend.log_path.stat().st_size, 0)
+        backend._log.close()
+        with open(backend.log_path, "a", encoding="utf-8") as fh:
+            fh.write('{"op": "nodes", "label": "IP", "rows": [{"id": "ip_3')
+
+        reopened = MemoryGraphBackend(self.tmp.name)
+        self.assertEqual(reopened.nodes_with_label("IP"), {"ip_1.1.1.1", "ip_2.2.2.2"})
+        self.assertEqual(len(reopened.neighbourhoods(["user_root"], 1, 10)["user_root"]["relationships"]), 2)
+        self.assertTrue(Path(reopened.log_path).read_text().endswith("\n"))
+        reopened.close()
+        self.assertEqual(reopened.log_path.stat().st_size, 0)
+
+    def test_corrupt_snapshot_is_moved_aside(self):
+        backend = MemoryGraphBackend(self.tmp.name)
+        self._populate(GraphBuilder(backend=backend))
+        backend.close()
+        backend.snapshot_path.write_bytes(b'{"nodes": [["ip_1.1.1.1", ')
+
+        reopened = MemoryGraphBackend(self.tmp.name)
+        corrupt = Path(self.tmp.name) / "snapshot.json.corrupt"
+        self.assertEqual(corrupt.read_bytes(), b'{"nodes": [["ip_1.1.1.1", ')
+        self.assertEqual(reopened.nodes_with_label("IP"), set())
+        reopened.merge_entities({"IP": [{"id": "ip_2.2.2.2", "props": {}}]})
+        reopened.close()
+        self.assertTrue(corrupt.exists())
+
+    def test_backend_interface_is_abstract(self):
+        with self.assertRaises(TypeError):
+            GraphBackend()
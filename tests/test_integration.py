@@ -1,10 +1,15 @@
 import json
 import tempfile
+import zlib
 from pathlib import Path
 from unittest import TestCase
 from unittest.mock import patch
 
+import numpy as np
+
 from lms_log_analyzer.src import log_processor
+from lms_log_analyzer.src.sessionizer import Sessionizer
+from lms_log_analyzer.src.template_miner import TemplateMiner
 
 class DummyDB:
     def __init__(self):
@@ -19,6 +24,10 @@ class DummyDB:
     def search(self, vec, k=3):
         return [], []
 
+    def search_many(self, matrix, k=3):
+        n = len(matrix)
+        return np.full((n, k), -1), np.full((n, k), np.inf)
+
     def get_cases(self, ids):
         return []
 
@@ -37,7 +46,7 @@ class IntegrationTest(TestCase):
 
             with patch.object(log_processor, 'filter_logs', return_value=[{'line': lines[0], 'alert': {'original_log': lines[0]}}]), \
                  patch.object(log_processor, 'llm_analyse', return_value=[{'is_attack': True}]) as mock_analyse, \
-                 patch.object(log_processor, 'embed', return_value=[0.0, 0.0, 0.0]), \
+                 patch.object(log_processor, 'embed_many', return_value=np.zeros((1, 3), dtype='float32')), \
                 patch.object(log_processor, 'VECTOR_DB', DummyDB()), \
                  patch('lms_log_analyzer.src.log_processor.save_state'), \
                  patch('lms_log_analyzer.src.log_processor.STATE', {}):
@@ -50,3 +59,337 @@ class IntegrationTest(TestCase):
 
         self.assertEqual(len(results), 1)
         self.assertTrue(results[0]['analysis']['is_attack'])
+
+
+    def test_process_logs_streams_batches_and_resumes(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            log_path = Path(tmpdir) / "app.log"
+            log_path.write_text("".join(f"line {i}\n" for i in range(5)), encoding="utf-8")
+            state = {}
+            with patch.object(log_processor, 'analyse_lines', return_value=[]) as mock_analyse, \
+                 patch.object(log_processor, 'PERSISTENCE'), \
+                 patch.object(log_processor, 'STATE', state):
+                log_processor.process_logs([log_path], batch_size=2)
+                self.assertEqual([len(c.args[0]) for c in mock_analyse.call_args_list], [2, 2, 1])
+                self.assertEqual(state["files"][str(log_path)]["offset"], log_path.stat().st_size)
+
+                with open(log_path, "a", encoding="utf-8") as fh:
+                    fh.write("line 5\n")
+                mock_analyse.reset_mock()
+                log_processor.process_logs([log_path], batch_size=2)
+                self.assertEqual(mock_analyse.call_count, 1)
+                lines, sources = mock_analyse.call_args.args
+                self.assertEqual(lines, ["line 5"])
+                self.assertEqual(sources, [{"file": str(log_path), "offset": log_path.stat().st_size}])
+
+
+class WazuhStageTest(TestCase):
+    def test_candidates_checked_in_one_batch(self):
+        batch = log_processor._Batch([])
+        batch.candidates = [{"line": "a error"}, {"line": "b error"}, {"line": "c error"}]
+        batch.members = [[entry] for entry in batch.candidates]
+        batch.scores = np.array([3.0, 1.0, 2.0], dtype=np.float32)
+        with patch.object(log_processor.config, 'WAZUH_ENABLED', True), \
+             patch.object(log_processor.wazuh_api, 'logtest_many', return_value=[True, False, True]) as mock_many:
+            log_processor._stage_wazuh(batch)
+        mock_many.assert_called_once_with(["a error", "b error", "c error"])
+        self.assertEqual([e["line"] for e in batch.candidates], ["a error", "c error"])
+        self.assertEqual(len(batch.members), 2)
+        self.assertEqual(batch.scores.tolist(), [3.0, 2.0])
+
+
+class TemplateFanOutTest(TestCase):
+    def test_flood_is_analysed_once_per_template(self):
+        flood = [f"sshd error: failed password for root from 10.0.0.{i} port {4000 + i}" for i in range(50)]
+        lines = flood + ["GET /etc/passwd error from 10.0.0.99"]
+        db = DummyDB()
+        with patch.object(log_processor, 'llm_analyse', side_effect=lambda prompts: [
+                {'is_attack': True, 'attack_type': 'bruteforce', 'entities': [], 'relations': []} for _ in prompts
+             ]) as mock_analyse, \
+             patch.object(log_processor, 'embed_many',
+                          side_effect=lambda texts: np.zeros((len(texts), 3), dtype='float32')) as mock_embed, \
+             patch.object(log_processor, 'VECTOR_DB', db), \
+             patch.object(log_processor.config, 'SAMPLE_TOP_PERCENT', 100), \
+             patch.object(log_processor, 'TEMPLATE_MINER', TemplateMiner()), \
+             patch.object(log_processor.RULE_ENGINE, 'score_batch',
+                          wraps=log_processor.RULE_ENGINE.score_batch) as mock_score:
+            results = log_processor.analyse_lines(lines)
+
+        # 規則引擎每批只評分一次，樣板分組與取樣共用分數
+        mock_score.assert_called_once()
+
+        # 洪水行與命中攻擊特徵的行各自只有一筆代表行被嵌入與送入 LLM
+        self.assertEqual(len(mock_embed.call_args.args[0]), 2)
+        self.assertEqual(len(mock_analyse.call_args.args[0]), 2)
+        self.assertEqual(len(db.added), 2)
+        self.assertEqual(len(results), 51)
+        members = [r for r in results if r["line"] in flood]
+        self.assertEqual({r["template_count"] for r in members}, {50})
+        self.assertEqual(len({r["template_id"] for r in members}), 1)
+        self.assertTrue(all(r["analysis"]["is_attack"] for r in results))
+        member = next(r for r in members if r["line"].endswith("port 4007"))
+        self.assertEqual(member["analysis"]["entities"][0]["id"], "ip_10.0.0.7")
+
+
+class SessionAggregationTest(TestCase):
+    def test_brute_force_becomes_one_session_prompt(self):
+        lines = [f"sshd error: failed login user=admin port {i} from 10.6.6.6" for i in range(300)]
+        db = DummyDB()
+        with patch.object(log_processor, 'llm_analyse', side_effect=lambda prompts: [
+                {'is_attack': True, 'attack_type': 'bruteforce', 'entities': [], 'relations': []} for _ in prompts
+             ]) as mock_analyse, \
+             patch.object(log_processor, 'embed_many', side_effect=lambda texts: np.zeros((len(texts), 3), dtype='float32')), \
+             patch.object(log_processor, 'VECTOR_DB', db), \
+             patch.object(log_processor, 'SESSIONIZER', Sessionizer(window_sec=60, threshold=20)) as sessionizer:
+            results = log_processor.analyse_lines(lines)
+            later = log_processor.analyse_lines(lines[:50])
+
+        prompts = mock_analyse.call_args_list[0].args[0]
+        self.assertEqual(len(prompts), 1)
+        self.assertIn("[session] ip=10.6.6.6 user=admin events=300", prompts[0]["alert"]["original_log"])
+        self.assertEqual(mock_analyse.call_count, 1)
+        self.assertEqual(len(results), 301)
+        summaries = [r for r in results if r.get("kind") == "session"]
+        self.assertEqual(len(summaries), 1)
+        self.assertTrue(summaries[0]["line"].startswith("[session] ip=10.6.6.6"))
+        self.assertEqual(len(later), 50)
+        self.assertTrue(all(r["analysis"]["is_attack"] for r in later))
+        self.assertEqual(sessionizer.stats()["active_sessions"], 1)
+
+    def test_lines_waiting_for_session_verdict_are_analysed(self):
+        lines = [f"sshd error: failed login user=admin port {i} from 10.6.6.7" for i in range(60)]
+        sessionizer = Sessionizer(window_sec=60, threshold=20)
+        db = DummyDB()
+        with patch.object(log_processor, 'llm_analyse', side_effect=lambda prompts: [
+                {'is_attack': True, 'attack_type': 'bruteforce', 'entities': [], 'relations': []} for _ in prompts
+             ]) as mock_analyse, \
+             patch.object(log_processor, 'embed_many', side_effect=lambda texts: np.zeros((len(texts), 3), dtype='float32')), \
+             patch.object(log_processor, 'VECTOR_DB', db), \
+             patch.object(log_processor, 'SESSIONIZER', sessionizer), \
+             patch.object(sessionizer, 'record_verdict'):
+            first = log_processor.analyse_lines(lines[:30])
+            # session 的判定尚未記錄（例如前一批仍在分析中），後續行不可被丟棄
+            later = log_processor.analyse_lines(lines[30:])
+
+        self.assertEqual(len(first), 31)
+        self.assertEqual(len(later), 30)
+        self.assertTrue(all(r["analysis"]["is_attack"] for r in later))
+        self.assertEqual(len(mock_analyse.call_args_list[1].args[0]), 1)
+
+
+class NeighbourDB(DummyDB):
+    """永遠回傳一筆已知攻擊案例作為最近鄰。"""
+
+    def __init__(self, distance):
+        super().__init__()
+        self.distance = distance
+        self.known = {
+            "line": "GET /etc/passwd from 2.2.2.2",
+            "analysis": {"is_attack": True, "attack_type": "traversal", "entities": [], "relations": []},
+        }
+
+    def search_many(self, matrix, k=3):
+        n = len(matrix)
+        return np.array([[0, -1, -1]] * n), np.array([[self.distance, 0.0, 0.0]] * n)
+
+    def get_cases(self, ids):
+        return [self.known if i == 0 else None for i in ids]
+
+
+class SimilarityShortCircuitTest(TestCase):
+    line = "GET /etc/passwd from 1.1.1.1 error"
+
+    def _run(self, db):
+        with patch.object(log_processor, 'llm_analyse', return_value=[{'is_attack': False}]) as mock_analyse, \
+             patch.object(log_processor, 'embed_many', return_value=np.zeros((1, 3), dtype='float32')), \
+             patch.object(log_processor, 'VECTOR_DB', db), \
+             patch('lms_log_analyzer.src.log_processor.save_state'):
+            results = log_processor.analyse_lines([self.line])
+        return results, mock_analyse
+
+    def test_close_attack_neighbour_skips_llm(self):
+        db = NeighbourDB(distance=0.04)
+        before = log_processor.PIPELINE_STATS["llm_calls_avoided"]
+        results, mock_analyse = self._run(db)
+        mock_analyse.assert_not_called()
+        analysis = results[0]["analysis"]
+        self.assertTrue(analysis["is_attack"])
+        self.assertTrue(analysis["inherited"])
+        self.assertAlmostEqual(analysis["inherited_distance"], 0.2)
+        self.assertEqual(analysis["entities"][0]["id"], "ip_1.1.1.1")
+        self.assertEqual(db.added, [])
+        self.assertEqual(log_processor.PIPELINE_STATS["llm_calls_avoided"], before + 1)
+
+    def test_threshold_is_compared_as_squared_l2(self):
+        # FAISS 回傳 0.25 即 L2 距離 0.5，超過 0.3 的攻擊門檻
+        db = NeighbourDB(distance=0.25)
+        _, mock_analyse = self._run(db)
+        mock_analyse.assert_called_once()
+
+    def test_distant_neighbour_goes_to_llm(self):
+        db = NeighbourDB(distance=5.0)
+        results, mock_analyse = self._run(db)
+        mock_analyse.assert_called_once()
+        self.assertFalse(results[0]["analysis"]["is_attack"])
+        self.assertEqual(len(db.added), 1)
+
+
+class FakeOpenSearch:
+    """以固定文件模擬 PIT 分頁的 OpenSearch client。"""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.bodies = []
+        self.deleted = []
+
+    def create_pit(self, index, params=None):
+        return {"pit_id": "pit-1"}
+
+    def delete_pit(self, body=None):
+        self.deleted.extend(body["pit_id"])
+
+    def search(self, body=None, index=None):
+        self.bodies.append(body)
+        docs = [d for d in self.docs if not d.get("completed")]
+        if "slice" in body:
+            part = body["slice"]
+            docs = [d for d in docs if zlib.crc32(d["_id"].encode("utf-8")) % part["max"] == part["id"]]
+        if "search_after" in body:
+            docs = [d for d in docs if d["sort"] > body["search_after"]]
+        return {"pit_id": "pit-1", "hits": {"hits": docs[:body["size"]]}}
+
+
+class ProcessNewLogsTest(TestCase):
+    def test_pages_with_pit_and_bulk_updates_every_document(self):
+        docs = [
+            {"_index": "filebeat-1", "_id": str(i), "_source": {"message": msg}, "sort": [i]}
+            for i, msg in enumerate(["attack error", "noise", "attack error", ""])
+        ]
+        client = FakeOpenSearch(docs)
+        analysed = [{"line": "attack error", "analysis": {"is_attack": True}}]
+        with patch.object(log_processor, '_get_os_client', return_value=client), \
+             patch.object(log_processor, 'STATE', {}), \
+             patch.object(log_processor, 'analyse_lines', return_value=analysed) as mock_analyse, \
+             patch.object(log_processor.helpers, 'bulk', return_value=(4, [])) as mock_bulk:
+            count = log_processor.process_new_logs(index="filebeat-*", page_size=3)
+
+        self.assertEqual(count, 4)
+        self.assertEqual(mock_analyse.call_args_list[0].args[0], ["attack error", "noise"])
+        self.assertEqual(client.bodies[0]["_source"], ["message"])
+        self.assertEqual(client.bodies[0]["pit"]["id"], "pit-1")
+        self.assertEqual(client.bodies[1]["search_after"], [2])
+        self.assertEqual(client.deleted, ["pit-1"])
+
+        actions = [a for call in mock_bulk.call_args_list for a in call.args[1]]
+        self.assertEqual(sorted(a["_id"] for a in actions), ["0", "1", "2", "3"])
+        by_id = {a["_id"]: a["doc"] for a in actions}
+        self.assertTrue(by_id["0"]["analysis"]["is_attack"])
+        self.assertEqual(by_id["1"], {"ai_analysis_completed": True})
+        self.assertEqual(by_id["3"], {"ai_analysis_completed": True})
+
+    def test_workers_slice_documents_and_resume_from_cursor(self):
+        docs = [
+            {"_index": "filebeat-1", "_id": f"doc-{i}", "_source": {"message": f"error {i}"}, "sort": [1000 + i, f"doc-{i}"]}
+            for i in range(20)
+        ]
+        state = {}
+        seen = []
+        with patch.object(log_processor, 'STATE', state), \
+             patch.dict(log_processor._LAST_SWEEP, clear=True), \
+             patch.object(log_processor, 'analyse_lines', side_effect=lambda lines, sources=None: seen.extend(lines) or []), \
+             patch.object(log_processor.helpers, 'bulk', return_value=(0, [])):
+            results = []
+            for worker in range(3):
+                client = FakeOpenSearch(docs)
+                with patch.object(log_processor, '_get_os_client', return_value=client):
+                    results.append(log_processor.poll_opensearch(index="logs", page_size=8, worker_id=worker, workers=3))
+                # 分割在伺服器端以 PIT slice 完成，每個 worker 只讀取自己的文件
+                self.assertEqual(client.bodies[0]["slice"], {"id": worker, "max": 3})
+
+            client = FakeOpenSearch(docs)
+            with patch.object(log_processor, '_get_os_client', return_value=client):
+                again = log_processor.poll_opensearch(index="logs", page_size=8, worker_id=1, workers=3)
+
+        self.assertEqual(sum(r.processed for r in results), 20)
+        self.assertEqual(sorted(seen), sorted(f"error {i}" for i in range(20)))
+        last = max(i for i in range(20) if log_processor.owns_document(f"doc-{i}", 1, 3))
+        self.assertEqual(state["opensearch_cursor"]["logs#1/3"], {"timestamp": 1000 + last, "id": f"doc-{last}"})
+        # 下一次輪詢以游標（時間戳與 _id）作為 search_after 起點，不再使用時間下限過濾
+        self.assertEqual(client.bodies[0]["search_after"], [1000 + last, f"doc-{last}"])
+        self.assertNotIn("filter", client.bodies[0]["query"]["bool"])
+        self.assertEqual(again.processed, 0)
+
+    def test_periodic_sweep_picks_up_documents_behind_the_cursor(self):
+        docs = [
+            {"_index": "i", "_id": f"d{i}", "_source": {"message": f"error {i}"}, "sort": [i, f"d{i}"]}
+            for i in range(4)
+        ]
+        state = {}
+        seen = []
+        client = FakeOpenSearch(docs)
+
+        def fake_bulk(_client, actions, raise_on_error=False):
+            done = {a["_id"] for a in actions}
+            for d in docs:
+                d["completed"] = d.get("completed") or d["_id"] in done
+            return len(actions), []
+
+        with patch.object(log_processor, 'STATE', state), \
+             patch.object(log_processor, 'PERSISTENCE'), \
+             patch.dict(log_processor._LAST_SWEEP, clear=True), \
+             patch.object(log_processor, '_get_os_client', return_value=client), \
+             patch.object(log_processor, 'analyse_lines', side_effect=lambda lines, sources=None: seen.extend(lines) or []), \
+             patch.object(log_processor.helpers, 'bulk', side_effect=fake_bulk):
+            log_processor.poll_opensearch(index="i", page_size=10)
+            # 較晚才寫入、時間戳早於游標的文件
+            docs.insert(0, {"_index": "i", "_id": "late", "_source": {"message": "late error"}, "sort": [-1, "late"]})
+            log_processor.poll_opensearch(index="i", page_size=10)
+            self.assertNotIn("late error", seen)
+            with patch.object(log_processor.config, 'OPENSEARCH_SWEEP_INTERVAL_SEC', 0):
+                log_processor.poll_opensearch(index="i", page_size=10)
+
+        self.assertEqual(seen.count("late error"), 1)
+        self.assertEqual(len(seen), 5)
+        self.assertNotIn("search_after", client.bodies[-1])
+        self.assertEqual(state["opensearch_cursor"]["i#0/1"], {"timestamp": 3, "id": "d3"})
+
+    def test_max_pages_reports_backlog(self):
+        docs = [
+            {"_index": "i", "_id": str(i), "_source": {"message": "error"}, "sort": [i]}
+            for i in range(10)
+        ]
+        with patch.object(log_processor, '_get_os_client', return_value=FakeOpenSearch(docs)), \
+             patch.object(log_processor, 'STATE', {}), \
+             patch.object(log_processor, 'analyse_lines', return_value=[]), \
+             patch.object(log_processor.helpers, 'bulk', return_value=(0, [])):
+            result = log_processor.poll_opensearch(index="i", page_size=2, max_pages=2)
+        self.assertEqual(result, log_processor.PollResult(4, True))
+
+    def test_pipelined_poll_writes_back_and_advances_cursor_in_order(self):
+        docs = [
+            {"_index": "i", "_id": str(i), "_source": {"message": f"error {i}"}, "sort": [i]}
+            for i in range(7)
+        ]
+        state = {}
+        cursors = []
+        client = FakeOpenSearch(docs)
+
+        def fake_bulk(_client, actions, raise_on_error=False):
+            cursors.append(dict(state.get("opensearch_cursor", {}).get("i#0/1") or {}))
+            return len(actions), []
+
+        with patch.object(log_processor, '_get_os_client', return_value=client), \
+             patch.object(log_processor, 'STATE', state), \
+             patch.object(log_processor, 'PERSISTENCE'), \
+             patch.object(log_processor, 'llm_analyse', side_effect=lambda prompts: [{"is_attack": True} for _ in prompts]), \
+             patch.object(log_processor, 'embed_many', side_effect=lambda texts: np.zeros((len(texts), 3), dtype='float32')), \
+             patch.object(log_processor, 'VECTOR_DB', DummyDB()), \
+             patch.object(log_processor.helpers, 'bulk', side_effect=fake_bulk) as mock_bulk:
+            result = log_processor.poll_opensearch(index="i", page_size=3, pipelined=True)
+
+        self.assertEqual(result, log_processor.PollResult(7, False))
+        ids = [[a["_id"] for a in call.args[1]] for call in mock_bulk.call_args_list]
+        self.assertEqual(ids, [["0", "1", "2"], ["3", "4", "5"], ["6"]])
+        self.assertEqual([c.get("id") for c in cursors], [None, "2", "5"])
+        self.assertEqual(state["opensearch_cursor"]["i#0/1"], {"timestamp": 6, "id": "6"})
+        self.assertEqual(client.deleted, ["pit-1"])
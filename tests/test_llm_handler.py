@@ -0,0 +1,148 @@
+import json
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import TestCase
+from unittest.mock import patch
+
+from lms_log_analyzer.src import llm_handler
+from lms_log_analyzer.src.utils import RateLimiter
+from lms_log_analyzer.src.verdict_cache import VerdictCache
+
+
+class FakeChat:
+    """依序回傳預先設定的回應，並記錄每次請求。"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def invoke(self, messages):
+        self.calls.append(messages)
+        return SimpleNamespace(content=self.responses.pop(0))
+
+
+def _payload(line):
+    return {"alert": {"original_log": line}, "examples": [], "graph": {}}
+
+
+class TestLLMBatching(TestCase):
+    def setUp(self):
+        for name, value in (("_RATE_LIMITER", RateLimiter(0)), ("VERDICT_CACHE", VerdictCache(100))):
+            patcher = patch.object(llm_handler, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_batch_maps_results_by_index(self):
+        reply = json.dumps([
+            {"index": 1, "is_attack": False},
+            {"index": 0, "is_attack": True, "attack_type": "scan"},
+        ])
+        chat = FakeChat(["```json\n" + reply + "\n```"])
+        with patch.object(llm_handler, "_chat", return_value=chat):
+            results = llm_handler.llm_analyse([_payload("a"), _payload("b")], batch_size=10)
+        self.assertEqual(len(chat.calls), 1)
+        self.assertEqual(results, [{"is_attack": True, "attack_type": "scan"}, {"is_attack": False}])
+
+    def test_partial_batch_retries_missing_items_only(self):
+        chat = FakeChat([
+            json.dumps([{"index": 0, "is_attack": True}]),
+            json.dumps({"is_attack": False}),
+            "not json",
+        ])
+        payloads = [_payload("a"), _payload("b"), _payload("c")]
+        with patch.object(llm_handler, "_chat", return_value=chat):
+            results = llm_handler.llm_analyse(payloads, batch_size=3)
+        self.assertEqual(len(chat.calls), 3)
+        self.assertIn("Log: b", chat.calls[1][1].content)
+        self.assertEqual(results, [{"is_attack": True}, {"is_attack": False}, {}])
+
+
+class TestVerdictCache(TestCase):
+    def setUp(self):
+        self.cache = VerdictCache(100)
+        for name, value in (("_RATE_LIMITER", RateLimiter(0)), ("VERDICT_CACHE", self.cache)):
+            patcher = patch.object(llm_handler, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_same_template_is_sent_once(self):
+        verdict = {"is_attack": True, "entities": [{"id": "ip_1.1.1.1", "label": "IP"}], "relations": []}
+        chat = FakeChat([json.dumps(verdict)])
+        first = [_payload("Failed password for root from 1.1.1.1 port 22")]
+        second = [_payload("Failed password for root from 2.2.2.2 port 4022")]
+        with patch.object(llm_handler, "_chat", return_value=chat):
+            llm_handler.llm_analyse(first)
+            results = llm_handler.llm_analyse(second)
+        self.assertEqual(len(chat.calls), 1)
+        self.assertTrue(results[0]["is_attack"])
+        self.assertEqual(results[0]["entities"][0]["id"], "ip_2.2.2.2")
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_disk_tier_survives_restart_and_expires(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db = Path(tmpdir) / "verdicts.sqlite3"
+            VerdictCache(10, ttl=60, db_path=db).put("GET /a 404", {"is_attack": False})
+            restored = VerdictCache(10, ttl=60, db_path=db)
+            self.assertEqual(restored.get("GET /a 500"), ({"is_attack": False}, "GET /a 404"))
+            self.assertEqual(restored.disk_hits, 1)
+            expired = VerdictCache(10, ttl=-1, db_path=db)
+            expired.put("GET /c 200", {"is_attack": False})
+            self.assertIsNone(expired.get("GET /c 200"))
+
+
+class SlowChat:
+    """模擬網路延遲的本地聊天模型，回傳輸入日誌以便檢查順序。"""
+
+    def __init__(self, delay, failures=0):
+        self.delay = delay
+        self.failures = failures
+        self.calls = 0
+
+    def invoke(self, messages):
+        self.calls += 1
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("429 Resource has been exhausted")
+        time.sleep(self.delay)
+        line = messages[1].content.splitlines()[0][len("Log: "):]
+        return SimpleNamespace(content=json.dumps({"line": line}))
+
+
+class TestLLMDispatch(TestCase):
+    def setUp(self):
+        for name, value in (("_RATE_LIMITER", RateLimiter(0)), ("VERDICT_CACHE", VerdictCache(100))):
+            patcher = patch.object(llm_handler, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_concurrent_dispatch_keeps_input_order(self):
+        chat = SlowChat(delay=0.05)
+        names = [f"host-{c}" for c in "abcdefgh"]
+        payloads = [_payload(n) for n in names]
+        with patch.object(llm_handler, "_chat", return_value=chat), \
+             patch.object(llm_handler.config, "LLM_MAX_CONCURRENCY", 8):
+            start = time.monotonic()
+            results = llm_handler.llm_analyse(payloads, batch_size=1)
+            elapsed = time.monotonic() - start
+        self.assertEqual([r["line"] for r in results], names)
+        self.assertLess(elapsed, 8 * 0.05)
+
+    def test_retries_rate_limited_calls(self):
+        chat = SlowChat(delay=0, failures=2)
+        with patch.object(llm_handler, "_chat", return_value=chat), \
+             patch.object(llm_handler.config, "LLM_RETRY_BASE_DELAY_SEC", 0.001):
+            results = llm_handler.llm_analyse([_payload("x")])
+        self.assertEqual(chat.calls, 3)
+        self.assertEqual(results, [{"line": "x"}])
+
+
+class TestRateLimiter(TestCase):
+    def test_token_bucket_spaces_requests(self):
+        limiter = RateLimiter(rate_per_minute=600)  # one token per 0.1s
+        start = time.monotonic()
+        for _ in range(3):
+            limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.18)
@@ -0,0 +1,140 @@
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import TestCase
+
+from lms_log_analyzer.src import log_follower
+
+
+class FollowHarness:
+    def __init__(self, directory, watcher, **kwargs):
+        self.batches = []
+        self.stop = threading.Event()
+        self.thread = threading.Thread(
+            target=log_follower.follow,
+            args=(self.batches.append, {}, directory, self.stop, watcher),
+            kwargs=kwargs,
+            daemon=True,
+        )
+        self.thread.start()
+
+    def lines(self):
+        # 空行為只攜帶 checkpoint 的標記（例如輪替後已讀完的舊檔）
+        return [item.line for batch in self.batches for item in batch if item.line]
+
+    def wait_for(self, expected, timeout=3.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and self.lines() != expected:
+            time.sleep(0.01)
+        return self.lines()
+
+    def close(self):
+        self.stop.set()
+        self.thread.join(timeout=3)
+
+
+class TestLogFollower(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.dir = Path(self.tmp.name)
+        (self.dir / "app.log").write_text("existing\n")
+
+    def _exercise(self, watcher):
+        harness = FollowHarness(self.dir, watcher, batch_size=100, max_wait=0.05)
+        self.addCleanup(harness.close)
+        self.assertEqual(harness.wait_for(["existing"]), ["existing"])
+
+        start = time.monotonic()
+        with open(self.dir / "app.log", "a") as fh:
+            fh.write("appended\n")
+        self.assertEqual(harness.wait_for(["existing", "appended"]), ["existing", "appended"])
+        self.assertLess(time.monotonic() - start, 1.0)
+
+        # 輪替：舊檔改名後補寫的內容與新檔內容都會被讀到，且不重複
+        with open(self.dir / "app.log", "a") as fh:
+            fh.write("late\n")
+        os.rename(self.dir / "app.log", self.dir / "app.log.1")
+        (self.dir / "app.log").write_text("fresh\n")
+        (self.dir / "ignored.txt").write_text("not a log\n")
+        expected = ["existing", "appended", "late", "fresh"]
+        self.assertEqual(harness.wait_for(expected), expected)
+        harness.close()
+        self.assertFalse(harness.thread.is_alive())
+
+    def test_inotify_watcher(self):
+        try:
+            watcher = log_follower.InotifyWatcher(self.dir)
+        except (OSError, AttributeError):
+            self.skipTest("inotify unavailable")
+        self._exercise(watcher)
+
+    def test_polling_fallback(self):
+        self._exercise(log_follower.PollingWatcher(self.dir, interval=0.02))
+
+    def test_full_batch_flushes_without_waiting(self):
+        (self.dir / "app.log").write_text("".join(f"l{i}\n" for i in range(5)))
+        harness = FollowHarness(self.dir, log_follower.PollingWatcher(self.dir, interval=0.02),
+                                batch_size=2, max_wait=60)
+        self.addCleanup(harness.close)
+        harness.wait_for(["l0", "l1", "l2", "l3"])
+        self.assertEqual([len(b) for b in harness.batches], [2, 2])
+        harness.close()
+        # 停止時送出未滿的最後一批
+        self.assertEqual(harness.lines(), [f"l{i}" for i in range(5)])
+
+    def test_failed_batch_is_reread_and_following_continues(self):
+        attempts = []
+        done = []
+
+        def flaky(batch):
+            attempts.append([item.line for item in batch])
+            if len(attempts) == 1:
+                raise RuntimeError("analysis backend down")
+            done.extend(item.line for item in batch)
+
+        stop = threading.Event()
+        thread = threading.Thread(
+            target=log_follower.follow,
+            args=(flaky, {}, self.dir, stop, log_follower.PollingWatcher(self.dir, interval=0.02)),
+            kwargs={"batch_size": 100, "max_wait": 0.02, "retry_max": 0.05},
+            daemon=True,
+        )
+        thread.start()
+        self.addCleanup(thread.join, 3)
+        self.addCleanup(stop.set)
+        deadline = time.monotonic() + 3
+        while time.monotonic() < deadline and done != ["existing"]:
+            time.sleep(0.01)
+        with open(self.dir / "app.log", "a") as fh:
+            fh.write("after failure\n")
+        while time.monotonic() < deadline and done != ["existing", "after failure"]:
+            time.sleep(0.01)
+        stop.set()
+        thread.join(timeout=3)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(attempts[:2], [["existing"], ["existing"]])
+        self.assertEqual(done, ["existing", "after failure"])
+
+    def test_positions_of_deleted_files_are_pruned(self):
+        # 已刪除的檔案留下的位置與 app.log 的 inode 相同（inode 被重複使用），
+        # 未清除時 app.log 會誤沿用其位移而跳過內容
+        inode = (self.dir / "app.log").stat().st_ino
+        stale = {str(self.dir / "deleted.log"): {"inode": inode, "offset": 9, "size": 9}}
+        batches = []
+        stop = threading.Event()
+        thread = threading.Thread(
+            target=log_follower.follow,
+            args=(batches.append, stale, self.dir, stop, log_follower.PollingWatcher(self.dir, interval=0.02)),
+            kwargs={"batch_size": 100, "max_wait": 0.02},
+            daemon=True,
+        )
+        thread.start()
+        deadline = time.monotonic() + 3
+        while time.monotonic() < deadline and not batches:
+            time.sleep(0.01)
+        stop.set()
+        thread.join(timeout=3)
+        self.assertEqual([item.line for batch in batches for item in batch], ["existing"])
@@ -11,12 +11,57 @@ class TestLogParser(unittest.TestCase):
     def test_response_time(self):
         self.assertAlmostEqual(log_parser.response_time('resp_time:1.23'), 1.23)
         self.assertEqual(log_parser.response_time('foo'), 0.0)
+        # 查詢字串中的 sort=、port= 等不可被視為 rt=
+        self.assertAlmostEqual(log_parser.response_time('GET /x?sort=5 HTTP/1.1 resp_time:0.2'), 0.2)
+        self.assertEqual(log_parser.response_time('connection abort=3 port=8080'), 0.0)
+        self.assertAlmostEqual(log_parser.response_time('GET /x?sort=5&port=80 rt=0.7'), 0.7)
+        self.assertEqual(log_parser.parse_record('GET /search?sort=9 port=22').resp_time, 0.0)
 
     def test_fast_score(self):
         line = '1.1.1.1 - - [01/Jan/2023:00:00:00 +0000] "GET /etc/passwd HTTP/1.1" 404 0 "-" "nmap" resp_time:2'
         score = log_parser.fast_score(line)
         self.assertAlmostEqual(score, 0.9, places=2)
 
+    def test_parse_record_formats(self):
+        rec = log_parser.parse_record(
+            '1.1.1.1 - bob [01/Jan/2023:00:00:00 +0000] "POST /login HTTP/1.1" 401 0 "-" "curl/8" resp_time:0.5'
+        )
+        self.assertEqual((rec.fmt, rec.ip, rec.user, rec.method, rec.path), ("combined", "1.1.1.1", "bob", "POST", "/login"))
+        self.assertEqual((rec.status, rec.resp_time, rec.agent), (401, 0.5, "curl/8"))
+
+        rec = log_parser.parse_record(
+            'Jan  1 00:00:01 host sshd[1234]: Failed password for invalid user admin from 10.0.0.5 port 22 ssh2'
+        )
+        self.assertEqual((rec.fmt, rec.ip, rec.user), ("auth", "10.0.0.5", "admin"))
+
+        rec = log_parser.parse_record('Jan  1 00:00:01 host kernel: eth0 error from 10.1.1.1')
+        self.assertEqual((rec.fmt, rec.ip), ("syslog", "10.1.1.1"))
+
+        rec = log_parser.parse_record('{"client_ip": "9.9.9.9", "status": 500, "path": "/x"}')
+        self.assertEqual((rec.fmt, rec.ip, rec.status, rec.path), ("json", "9.9.9.9", 500, "/x"))
+
+    def test_register_format_and_record_reuse(self):
+        fmt = log_parser.LogFormat(
+            "custom", lambda l: l.startswith("CUSTOM "), lambda l: log_parser.LogRecord(l, "custom", status=503)
+        )
+        log_parser.register_format(fmt, first=True)
+        try:
+            rec = log_parser.parse_record("CUSTOM anything")
+        finally:
+            log_parser.FORMATS.remove(fmt)
+        self.assertEqual(rec.fmt, "custom")
+        self.assertEqual(log_parser.parse_status(rec), 503)
+        self.assertAlmostEqual(log_parser.fast_score(rec), 0.1)
+    def test_event_time(self):
+        combined = '1.1.1.1 - - [10/Oct/2023:13:55:36 +0000] "GET / HTTP/1.1" 200 1'
+        self.assertEqual(log_parser.event_time(combined), 1696946136.0)
+        self.assertEqual(log_parser.event_time('{"@timestamp": "2023-10-10T13:55:36Z"}'), 1696946136.0)
+        self.assertEqual(log_parser.event_time('{"ts": 1696946136000}'), 1696946136.0)
+        syslog = 'Dec 31 23:59:59 host sshd[1]: Failed password for root from 1.2.3.4 port 22 ssh2'
+        now = log_parser.event_time('{"ts": "2024-01-01T00:00:10"}')
+        self.assertEqual(log_parser.event_time(syslog, now=now), now - 11)
+        self.assertIsNone(log_parser.event_time('no timestamp here'))
+
 class TestLRUCache(unittest.TestCase):
     def test_eviction(self):
         cache = LRUCache(2)
@@ -0,0 +1,96 @@
+import bz2
+import gzip
+import os
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from lms_log_analyzer.src import log_reader
+
+
+def _read_all(paths, checkpoints, chunk_size=7):
+    lines = []
+    for batch in log_reader.micro_batches(log_reader.iter_new_lines(paths, checkpoints, chunk_size), 2):
+        lines.extend(item.line for item in batch if item.line)
+        log_reader.commit(checkpoints, batch)
+    return lines
+
+
+class TestLogReader(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.dir = Path(self.tmp.name)
+
+    def test_resumes_from_offset_and_holds_partial_line(self):
+        path = self.dir / "app.log"
+        path.write_bytes(b"first line\r\nsecond\npartial")
+        checkpoints = {}
+        self.assertEqual(_read_all([path], checkpoints), ["first line", "second"])
+        self.assertEqual(checkpoints[str(path)]["offset"], len(b"first line\r\nsecond\n"))
+        # 沒有新資料時不再產生任何行
+        self.assertEqual(_read_all([path], checkpoints), [])
+        with open(path, "ab") as fh:
+            fh.write(b" done\nthird\n")
+        self.assertEqual(_read_all([path], checkpoints), ["partial done", "third"])
+
+    def test_rotation_and_truncation(self):
+        path = self.dir / "app.log"
+        path.write_text("a\nb\n")
+        checkpoints = {}
+        _read_all([path], checkpoints)
+        # logrotate 改名後寫入新檔：舊檔沿用位移，新檔從頭讀取
+        with open(path, "a") as fh:
+            fh.write("c\n")
+        os.rename(path, self.dir / "app.log.1")
+        path.write_text("new\n")
+        self.assertEqual(_read_all([self.dir / "app.log.1", path], checkpoints), ["c", "new"])
+        # copytruncate：檔案變小時從頭讀取
+        path.write_text("")
+        with open(path, "a") as fh:
+            fh.write("x\n")
+        self.assertEqual(_read_all([path], checkpoints), ["x"])
+        os.remove(self.dir / "app.log.1")
+        self.assertEqual(log_reader.prune(checkpoints), 1)
+
+    def test_streams_compressed_files_once(self):
+        gz = self.dir / "old.log.2.gz"
+        with gzip.open(gz, "wt") as fh:
+            fh.write("g1\ng2\ng3")
+        bz = self.dir / "old.log.3.bz2"
+        with bz2.open(bz, "wt") as fh:
+            fh.write("b1\n")
+        os.utime(bz, (1, 1))
+        self.assertEqual(log_reader.discover_logs(self.dir), [bz, gz])
+        checkpoints = {}
+        self.assertEqual(_read_all([bz, gz], checkpoints), ["b1", "g1", "g2", "g3"])
+        self.assertTrue(checkpoints[str(gz)]["complete"])
+        self.assertEqual(_read_all([bz, gz], checkpoints), [])
+
+    def test_compressed_resume_after_partial_batch(self):
+        gz = self.dir / "big.gz"
+        with gzip.open(gz, "wt") as fh:
+            fh.write("".join(f"line {i}\n" for i in range(5)))
+        checkpoints = {}
+        batch = next(log_reader.micro_batches(log_reader.iter_new_lines([gz], checkpoints), 3))
+        log_reader.commit(checkpoints, batch)
+        self.assertNotIn("complete", checkpoints[str(gz)])
+        self.assertEqual(_read_all([gz], checkpoints), ["line 3", "line 4"])
+
+    def test_compressed_rotation_resumes_from_fingerprint(self):
+        path = self.dir / "app.log"
+        old = [f"Jan  1 00:00:0{i} host app[1]: request {i} finished with error code {i}" for i in range(3)]
+        path.write_text("".join(f"{line}\n" for line in old))
+        checkpoints = {}
+        self.assertEqual(_read_all(log_reader.discover_logs(self.dir), checkpoints), old)
+        os.rename(path, self.dir / "app.log.1")
+        path.write_text("m0\n")
+        self.assertEqual(_read_all(log_reader.discover_logs(self.dir), checkpoints), ["m0"])
+        # logrotate compress：app.log.1 壓縮為新 inode 的 app.log.2.gz，內容已讀過
+        rotated = self.dir / "app.log.1"
+        with open(rotated, "rb") as src, gzip.open(self.dir / "app.log.2.gz", "wb") as dst:
+            dst.write(src.read())
+        os.remove(rotated)
+        self.assertEqual(_read_all(log_reader.discover_logs(self.dir), checkpoints), [])
+        self.assertTrue(checkpoints[str(self.dir / "app.log.2.gz")]["complete"])
+        self.assertEqual(_read_all(log_reader.discover_logs(self.dir), checkpoints), [])
@@ -0,0 +1,54 @@
+import tempfile
+import time
+from pathlib import Path
+from unittest import TestCase
+
+from lms_log_analyzer.src.persistence import PersistenceScheduler
+from lms_log_analyzer.src.utils import load_state, save_state
+
+
+class TestPersistenceScheduler(TestCase):
+    def test_marks_are_coalesced_until_stop(self):
+        calls = []
+        sched = PersistenceScheduler(interval_sec=60, max_dirty=100)
+        sched.register("db", lambda: calls.append(1) or 10)
+        for _ in range(5):
+            sched.mark_dirty("db")
+        self.assertEqual(calls, [])
+        self.assertEqual(sched.stats()["pending"], {"db": 5})
+        sched.stop()
+        self.assertEqual(calls, [1])
+        self.assertEqual(sched.stats()["bytes_written"], 10)
+        self.assertEqual(sched.stats()["pending"], {})
+
+    def test_count_threshold_triggers_background_flush(self):
+        calls = []
+        sched = PersistenceScheduler(interval_sec=60, max_dirty=3)
+        sched.register("state", lambda: calls.append(1) or 0)
+        sched.mark_dirty(count=3)
+        deadline = time.monotonic() + 2
+        while not calls and time.monotonic() < deadline:
+            time.sleep(0.01)
+        sched.stop(flush=False)
+        self.assertEqual(calls, [1])
+        self.assertEqual(sched.stats()["flushes"], 1)
+
+    def test_failed_flush_stays_dirty(self):
+        sched = PersistenceScheduler(interval_sec=60, max_dirty=100)
+        sched.register("bad", lambda: 1 / 0)
+        sched.mark_dirty("bad")
+        sched.flush()
+        self.assertEqual(sched.stats()["errors"], 1)
+        self.assertIn("bad", sched.stats()["pending"])
+        sched.stop(flush=False)
+
+
+class TestStateFile(TestCase):
+    def test_save_and_load_state_atomically(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "state.json"
+            written = save_state({"cursor": {"id": "a"}}, path)
+            self.assertGreater(written, 0)
+            self.assertEqual(load_state(path), {"cursor": {"id": "a"}})
+            self.assertEqual([p.name for p in Path(tmpdir).iterdir()], ["state.json"])
+            self.assertEqual(load_state(Path(tmpdir) / "missing.json"), {})
@@ -0,0 +1,141 @@
+import asyncio
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+import numpy as np
+
+from lms_log_analyzer.src import log_processor
+from lms_log_analyzer.src.pipeline import Pipeline, Stage
+from lms_log_analyzer.src.sessionizer import Sessionizer
+from lms_log_analyzer.src.template_miner import TemplateMiner
+from tests.test_integration import DummyDB
+
+
+def _run(pipeline, coro_factory):
+    async def main():
+        await pipeline.start()
+        try:
+            return await coro_factory()
+        finally:
+            await pipeline.close()
+
+    return asyncio.run(main())
+
+
+class PipelineTest(TestCase):
+    def test_results_complete_in_submission_order(self):
+        def slow_first(item):
+            # 越早送入的項目處理越久，結果仍須依序回呼
+            time.sleep(0.02 * (5 - item))
+            return item * 10
+
+        pipeline = Pipeline([Stage("work", slow_first, concurrency=5), Stage("inc", lambda x: x + 1, "cpu")])
+        done = []
+        count = _run(pipeline, lambda: pipeline.map_ordered(range(5), lambda item, result: done.append((item, result))))
+
+        self.assertEqual(count, 5)
+        self.assertEqual(done, [(i, i * 10 + 1) for i in range(5)])
+        self.assertEqual(pipeline.stats()["work"]["items"], 5)
+
+    def test_bounded_queues_limit_items_in_flight(self):
+        started = []
+        release = threading.Event()
+
+        def blocked(item):
+            release.wait(5)
+            return item
+
+        def source():
+            for i in range(20):
+                started.append(i)
+                yield i
+
+        pipeline = Pipeline([Stage("slow", blocked)], queue_size=2)
+
+        async def scenario():
+            task = asyncio.ensure_future(pipeline.map_ordered(source(), max_in_flight=3))
+            await asyncio.sleep(0.2)
+            in_flight = len(started)
+            release.set()
+            await task
+            return in_flight
+
+        in_flight = _run(pipeline, scenario)
+        # 下游卡住時來源只會被多讀取有限的幾筆
+        self.assertLessEqual(in_flight, 5)
+        self.assertEqual(len(started), 20)
+
+    def test_stage_failure_stops_feeding_and_skips_callbacks(self):
+        def fail_on_two(item):
+            if item == 2:
+                raise ValueError("bad item")
+            return item
+
+        pipeline = Pipeline([Stage("check", fail_on_two)])
+        done = []
+        with self.assertRaises(ValueError):
+            _run(pipeline, lambda: pipeline.map_ordered(range(10), lambda item, _: done.append(item), max_in_flight=1))
+        self.assertEqual(done, [0, 1])
+        self.assertEqual(pipeline.stats()["check"]["errors"], 1)
+
+
+class RunPipelineTest(TestCase):
+    def _patches(self, calls, llm_delay=0.0):
+        def fake_llm(prompts):
+            time.sleep(llm_delay)
+            calls.append(len(prompts))
+            return [{"is_attack": True, "attack_type": "scan", "entities": [], "relations": []} for _ in prompts]
+
+        return [
+            patch.object(log_processor, "llm_analyse", side_effect=fake_llm),
+            patch.object(log_processor, "embed_many", side_effect=lambda texts: np.zeros((len(texts), 3), dtype="float32")),
+            patch.object(log_processor, "VECTOR_DB", DummyDB()),
+            patch.object(log_processor, "SESSIONIZER", Sessionizer(window_sec=60, mode="sliding", threshold=20)),
+            patch.object(log_processor, "TEMPLATE_MINER", TemplateMiner()),
+            patch.object(log_processor, "STATE", {}),
+            patch.object(log_processor, "save_state"),
+        ]
+
+    def _analyse(self, batches, pipelined, llm_delay=0.0):
+        calls = []
+        patches = self._patches(calls, llm_delay)
+        for p in patches:
+            p.start()
+        try:
+            if pipelined:
+                out = []
+                log_processor.run_pipeline(batches, lambda b: b, lambda b, results: out.append(results))
+                return out
+            return [log_processor.analyse_lines(b) for b in batches]
+        finally:
+            for p in reversed(patches):
+                p.stop()
+
+    def test_pipeline_matches_sequential_analysis(self):
+        batches = [
+            [f"GET /etc/passwd error from 10.0.{b}.{i} nmap" for i in range(3)] + ["normal log"]
+            for b in range(4)
+        ]
+        sequential = self._analyse(batches, pipelined=False)
+        pipelined = self._analyse(batches, pipelined=True)
+
+        def summary(runs):
+            return [[(r["line"], r["analysis"].get("is_attack")) for r in results] for results in runs]
+
+        self.assertEqual(summary(pipelined), summary(sequential))
+        self.assertIn("llm", log_processor.PIPELINE_STAGE_STATS)
+
+    def test_session_burst_across_batches_is_not_dropped(self):
+        # 同一來源的爆量跨越多批；管線模式下後一批的前置過濾會在前一批
+        # 記錄 session 判定之前執行，這些行仍須照常分析並回傳
+        lines = [f"sshd error: failed login user=admin port {i} from 10.7.7.7" for i in range(100)]
+        batches = [lines[i:i + 25] for i in range(0, 100, 25)]
+        sequential = self._analyse(batches, pipelined=False, llm_delay=0.2)
+        pipelined = self._analyse(batches, pipelined=True, llm_delay=0.2)
+
+        self.assertEqual([len(results) for results in sequential], [26, 25, 25, 25])
+        self.assertEqual([len(results) for results in pipelined], [26, 25, 25, 25])
+        for results in pipelined:
+            self.assertTrue(all(r["analysis"]["is_attack"] for r in results))
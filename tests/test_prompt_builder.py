@@ -0,0 +1,58 @@
+import unittest
+
+from lms_log_analyzer.src.prompt_builder import build_prompt, dedupe_graph, rank_graph
+
+
+def _node(nid, label, **props):
+    return {"id": nid, "labels": [label], "properties": {"id": nid, **props}}
+
+
+def _rel(start, end, rtype="CONNECTED"):
+    return {"start_id": start, "end_id": end, "type": rtype}
+
+
+class TestPromptBuilder(unittest.TestCase):
+    def test_duplicate_paths_are_merged(self):
+        graph = {
+            "nodes": [_node("ip_1.1.1.1", "IP"), _node("user_root", "User"), _node("ip_1.1.1.1", "IP", seen=3)],
+            "relationships": [_rel("ip_1.1.1.1", "user_root"), _rel("ip_1.1.1.1", "user_root")],
+        }
+        nodes, edges = dedupe_graph(graph)
+        self.assertEqual(len(nodes), 2)
+        self.assertEqual(nodes["ip_1.1.1.1"]["properties"]["seen"], 3)
+        self.assertEqual(edges, [("ip_1.1.1.1", "CONNECTED", "user_root")])
+
+    def test_nodes_near_alert_rank_first_and_hubs_last(self):
+        edges = [("ip_a", "R", "host_x"), ("host_x", "R", "far")] + [("hub", "R", f"n{i}") for i in range(5)]
+        edges.append(("ip_a", "R", "hub"))
+        nodes, ranked_edges = rank_graph({}, edges, {"ip_a"})
+        self.assertEqual(nodes[:3], ["ip_a", "host_x", "hub"])
+        self.assertEqual(ranked_edges[0], ("ip_a", "R", "host_x"))
+
+    def test_prompt_respects_token_budget(self):
+        graph = {
+            "nodes": [_node(f"user_u{i}", "User", name=f"u{i}") for i in range(200)],
+            "relationships": [_rel("ip_9.9.9.9", f"user_u{i}", "ATTEMPTED") for i in range(200)],
+        }
+        payload = {
+            "alert": {"original_log": "Failed password from 9.9.9.9"},
+            "fields": {"ip": "9.9.9.9"},
+            "examples": ["old case"] * 5,
+            "graph": graph,
+        }
+        built = build_prompt(payload, budget=300)
+        self.assertLessEqual(built.tokens, 300)
+        self.assertTrue(built.truncated)
+        lines = built.text.splitlines()
+        self.assertEqual(lines[0], "Log: Failed password from 9.9.9.9")
+        self.assertEqual(lines.count("- old case"), 1)
+        self.assertIn("E ip_9.9.9.9 -ATTEMPTED-> user_u0", lines)
+        self.assertTrue(any(l.startswith("Graph (nodes ") and "edges " in l and "/200" in l for l in lines))
+
+        small = build_prompt({"alert": {"original_log": "x"}, "graph": {}}, budget=300)
+        self.assertFalse(small.truncated)
+        self.assertEqual(small.text, "Log: x")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from lms_log_analyzer.src.rule_engine import RuleEngine, load_rules, DEFAULT_RULES
+
+
+class TestRuleEngine(unittest.TestCase):
+    def setUp(self):
+        self.engine = RuleEngine.from_dict(DEFAULT_RULES)
+
+    def test_default_rules_match_legacy_scores(self):
+        lines = [
+            '1.1.1.1 - - [01/Jan/2023:00:00:00 +0000] "GET /etc/passwd HTTP/1.1" 404 0 "-" "nmap" resp_time:2',
+            '1.1.1.1 - - [01/Jan/2023:00:00:00 +0000] "GET / HTTP/1.1" 200 0 "-" "Nmap"',
+            '{"status": 503, "path": "/x"}',
+            'nothing here /etc/passwd /etc/passwd',
+        ]
+        scores = self.engine.score_batch(lines)
+        self.assertEqual(scores.dtype, np.float32)
+        np.testing.assert_allclose(scores, [0.9, 0.3, 0.1, 0.5], rtol=1e-6)
+        np.testing.assert_allclose(self.engine.score_batch(lines[:1], statuses=[200]), [0.8], rtol=1e-6)
+
+    def test_filter_mask_is_case_insensitive(self):
+        mask = self.engine.filter_mask(["ERROR x", "ok", "login Failed", ""])
+        self.assertEqual(mask.tolist(), [True, False, True, False])
+
+    def test_lowercasing_that_changes_length_keeps_rows_aligned(self):
+        # "İ".lower() 為兩個字元，逐行轉小寫後再計算位置
+        mask = self.engine.filter_mask(["İ" * 40, "an error", "benign line"])
+        self.assertEqual(mask.tolist(), [False, True, False])
+
+    def test_matches_do_not_span_lines(self):
+        engine = RuleEngine.from_dict({"signatures": [
+            {"name": "sqli", "pattern": r"union\s+select", "weight": 0.7, "regex": True},
+            {"name": "anchored", "pattern": r"^get /admin$", "weight": 0.2, "regex": True},
+        ]})
+        lines = ["foo union", "select bar", "GET /admin", "x union  select y", "GET /admin?x"]
+        np.testing.assert_allclose(engine.score_batch(lines), [0.0, 0.0, 0.2, 0.7, 0.0], rtol=1e-6)
+
+    def test_top_indices_orders_by_score_then_position(self):
+        scores = np.array([0.1, 0.5, 0.5, 0.0, 0.5, 0.9], dtype=np.float32)
+        self.assertEqual(self.engine.top_indices(scores, 3).tolist(), [5, 1, 2])
+        self.assertEqual(self.engine.top_indices(scores, 10).tolist(), [5, 1, 2, 4, 0, 3])
+
+    def test_load_rules_from_file(self):
+        rules = {
+            "filter_keywords": ["denied"],
+            "signatures": [{"name": "sqli", "pattern": r"union\s+select", "weight": 0.7, "regex": True}],
+        }
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "rules.json"
+            path.write_text(json.dumps(rules))
+            engine = load_rules(path)
+        self.assertEqual(engine.filter_mask(["access denied", "error"]).tolist(), [True, False])
+        np.testing.assert_allclose(engine.score_batch(["id=1 UNION  SELECT pw", "404"]), [0.7, 0.0], rtol=1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+
+from lms_log_analyzer.src.sessionizer import Sessionizer
+
+
+def _entries(lines):
+    return [{"line": line, "alert": {"original_log": line}} for line in lines]
+
+
+class TestSessionizer(unittest.TestCase):
+    def test_burst_emits_one_session_then_absorbs(self):
+        s = Sessionizer(window_sec=60, mode="sliding", threshold=5, idle_sec=300)
+        brute = [f"Failed login user=root from 10.0.0.1 attempt {i}" for i in range(8)]
+        passthrough, sessions, absorbed = s.split(_entries(brute[:3] + ["error from 10.9.9.9"]), now=1000)
+        self.assertEqual(len(passthrough), 4)
+        self.assertEqual(sessions, [])
+
+        passthrough, sessions, absorbed = s.split(_entries(brute[3:6]), now=1001)
+        self.assertEqual(passthrough, [])
+        self.assertEqual(len(sessions), 1)
+        alert, *members = sessions[0]
+        self.assertEqual(alert["session"]["ip"], "10.0.0.1")
+        self.assertEqual(alert["session"]["user"], "root")
+        self.assertEqual(alert["session"]["events"], 3)
+        self.assertEqual(len(members), 3)
+
+        s.record_verdict(alert["session"]["session_id"], {"is_attack": True, "entities": []})
+        _, sessions, absorbed = s.split(_entries(brute[6:]), now=1002)
+        self.assertEqual(sessions, [])
+        self.assertEqual(len(absorbed), 2)
+        self.assertTrue(all(e["analysis"]["is_attack"] for e in absorbed))
+        self.assertEqual(absorbed[0]["session_id"], alert["session"]["session_id"])
+
+    def test_sliding_window_expires_old_events(self):
+        s = Sessionizer(window_sec=10, mode="sliding", threshold=3, idle_sec=300)
+        line = "error from 10.0.0.2"
+        s.split(_entries([line, line]), now=0)
+        passthrough, sessions, _ = s.split(_entries([line, line]), now=20)
+        self.assertEqual((len(passthrough), len(sessions)), (2, 0))
+        _, sessions, _ = s.split(_entries([line]), now=25)
+        self.assertEqual(len(sessions), 1)
+
+    def test_tumbling_window_starts_new_session_each_window(self):
+        s = Sessionizer(window_sec=10, mode="tumbling", threshold=2, idle_sec=300)
+        line = "error from 10.0.0.3"
+        _, first, _ = s.split(_entries([line, line]), now=0)
+        _, again, absorbed = s.split(_entries([line]), now=5)
+        self.assertEqual((len(first), len(again), len(absorbed)), (1, 0, 1))
+        passthrough, _, _ = s.split(_entries([line]), now=12)
+        self.assertEqual(len(passthrough), 1)
+        _, second, _ = s.split(_entries([line]), now=13)
+        self.assertEqual(len(second), 1)
+        self.assertNotEqual(first[0][0]["session"]["session_id"], second[0][0]["session"]["session_id"])
+
+    def test_idle_and_excess_keys_are_evicted(self):
+        s = Sessionizer(window_sec=10, threshold=100, idle_sec=30, max_keys=2)
+        s.split(_entries([f"error from 10.0.1.{i}" for i in range(3)]), now=0)
+        self.assertEqual(len(s), 2)
+        self.assertEqual(s.evict_idle(now=100), 2)
+        self.assertEqual(len(s), 0)
+
+    def test_windows_follow_event_time_when_replaying(self):
+        s = Sessionizer(window_sec=60, mode="sliding", threshold=3, idle_sec=300)
+
+        def line(clock, i):
+            return f'10.0.0.4 - - [01/Jan/2023:{clock} +0000] "GET /login?try={i} HTTP/1.1" 401 0'
+
+        morning = [line(f"10:00:{i:02d}", i) for i in range(4)]
+        noon = [line(f"12:00:{i:02d}", i) for i in range(4)]
+        scattered = [line(f"14:{i:02d}:00", i) for i in range(0, 40, 10)]
+        passthrough, sessions, absorbed = s.split(_entries(morning + noon + scattered), now=2e9)
+        self.assertEqual(len(sessions), 2)
+        self.assertNotEqual(sessions[0][0]["session"]["session_id"], sessions[1][0]["session"]["session_id"])
+        # 每段前兩行未達門檻，第三行起成為 session，第四行併入同一 session
+        self.assertEqual([len(group) - 1 for group in sessions], [2, 2])
+        self.assertEqual(sessions[0][0]["session"]["events"], 2)
+        self.assertEqual((len(passthrough), absorbed), (8, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
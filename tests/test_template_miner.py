@@ -0,0 +1,35 @@
+import unittest
+
+from lms_log_analyzer.src.template_miner import TemplateMiner, WILDCARD
+
+
+class TestTemplateMiner(unittest.TestCase):
+    def test_variables_collapse_into_one_template(self):
+        miner = TemplateMiner(depth=4, sim_threshold=0.5)
+        a = miner.add("Failed password for root from 10.0.0.1 port 22 ssh2")
+        b = miner.add("Failed password for admin from 10.0.0.2 port 2222 ssh2")
+        c = miner.add("Accepted publickey for alice from 10.0.0.3 port 22 ssh2")
+        self.assertIs(a, b)
+        self.assertIsNot(a, c)
+        self.assertEqual(a.size, 2)
+        self.assertEqual(a.tokens[3], WILDCARD)
+        self.assertIn("<IP>", a.template)
+        self.assertEqual([t["count"] for t in miner.templates()], [2, 1])
+
+    def test_dissimilar_lines_stay_apart(self):
+        miner = TemplateMiner(sim_threshold=0.5)
+        a = miner.add("disk quota exceeded on volume data")
+        b = miner.add("disk failure detected by raid controller now")
+        self.assertIsNot(a, b)
+
+    def test_least_recently_used_templates_are_evicted(self):
+        miner = TemplateMiner(max_clusters=2)
+        first = miner.add("alpha service started")
+        miner.add("beta worker crashed hard today")
+        miner.add("gamma job queued")
+        self.assertEqual(len(miner), 2)
+        self.assertNotEqual(miner.add("alpha service started").cluster_id, first.cluster_id)
+
+
+if __name__ == '__main__':
+    unittest.main()
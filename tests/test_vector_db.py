@@ -0,0 +1,128 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+import numpy as np
+
+from lms_log_analyzer.src import vector_db
+from lms_log_analyzer.src.persistence import PersistenceScheduler
+from lms_log_analyzer.src.utils import LRUCache
+
+
+class FakeEmbedder:
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True):
+        self.calls.append(list(texts))
+        return np.array([[len(t), 1.0, 0.0] for t in texts], dtype="float64")
+
+
+class TestEmbedMany(TestCase):
+    def setUp(self):
+        self.model = FakeEmbedder()
+        patcher_model = patch.object(vector_db, "_EMBEDDER", self.model)
+        patcher_cache = patch.object(vector_db, "_EMBED_CACHE", LRUCache(100))
+        patcher_model.start()
+        patcher_cache.start()
+        self.addCleanup(patcher_model.stop)
+        self.addCleanup(patcher_cache.stop)
+
+    def test_single_encode_call_with_duplicates(self):
+        vecs = vector_db.embed_many(["a b", "a  b ", "ccc"])
+        self.assertEqual(vecs.shape, (3, 3))
+        self.assertEqual(vecs.dtype, np.float32)
+        self.assertEqual(self.model.calls, [["a b", "ccc"]])
+        np.testing.assert_array_equal(vecs[0], vecs[1])
+
+    def test_cached_lines_skip_model(self):
+        vector_db.embed_many(["x", "y"])
+        vecs = vector_db.embed_many(["y", "x"])
+        self.assertEqual(len(self.model.calls), 1)
+        self.assertEqual(vecs.shape, (2, 3))
+        self.assertEqual(vector_db.embed("x"), vecs[1].tolist())
+        self.assertEqual(len(self.model.calls), 1)
+
+
+class TestIndexTypes(TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmp = Path(tmpdir.name)
+        self.data = np.random.default_rng(0).random((300, 8), dtype="float32")
+
+    def _db(self, index_type, **kwargs):
+        return vector_db.SimpleVectorDB(self.tmp / "idx", self.tmp / "cases", index_type=index_type, **kwargs)
+
+    def test_ivf_trains_in_background_once_enough_vectors(self):
+        db = self._db("ivf_flat", nlist=4, train_min=200)
+        db.add(self.data[:100], [{"n": i} for i in range(100)])
+        self.assertFalse(db.is_trained_ann)
+        db.add(self.data[100:], [{"n": i} for i in range(100, 300)])
+        db.wait_for_migration(timeout=10)
+        self.assertTrue(db.is_trained_ann)
+        self.assertEqual(db.index.ntotal, 300)
+        ids, dists = db.search(self.data[42], k=1, nprobe=4)
+        self.assertEqual(ids, [42])
+        self.assertAlmostEqual(dists[0], 0.0, places=5)
+
+    def test_hnsw_search(self):
+        db = self._db("hnsw")
+        db.add(self.data, [{"n": i} for i in range(300)])
+        ids, _ = db.search(self.data[7], k=3, ef_search=128)
+        self.assertEqual(ids[0], 7)
+
+    def test_unknown_index_type(self):
+        with self.assertRaises(ValueError):
+            self._db("lsh")
+
+
+class TestSave(TestCase):
+    def test_failed_save_propagates_and_stays_dirty(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db = vector_db.SimpleVectorDB(Path(tmpdir) / "idx", Path(tmpdir) / "cases", index_type="flat")
+            db.add(np.ones((1, 4), dtype="float32"), [{"n": 0}])
+            sched = PersistenceScheduler(interval_sec=60, max_dirty=100)
+            sched.register("vector_db", db.save)
+            sched.mark_dirty("vector_db")
+            with patch.object(db.cases, "sync", side_effect=OSError("disk full")):
+                with self.assertRaises(OSError):
+                    db.save()
+                sched.flush()
+            # 失敗的寫入保留變更標記，下次排程重試成功
+            self.assertIn("vector_db", sched.stats()["pending"])
+            self.assertGreater(sched.flush(), 0)
+            self.assertEqual(sched.stats()["pending"], {})
+            sched.stop(flush=False)
+
+
+class TestCaseAlignment(TestCase):
+    def test_missing_cases_keep_distances_aligned(self):
+        from lms_log_analyzer.src import api_server
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db = vector_db.SimpleVectorDB(Path(tmpdir) / "idx", Path(tmpdir) / "cases", index_type="flat")
+            db.add(np.eye(4, dtype="float32")[:2], [{"line": "a"}, {"line": "b", "kind": "session"}])
+            self.assertEqual(db.get_cases([1, 7, 0]), [{"line": "b", "kind": "session"}, None, {"line": "a"}])
+            with patch.object(api_server, "VECTOR_DB", db):
+                matches = api_server._matches([7, 1, -1, 0], [0.1, 0.2, 0.3, 0.4])
+        self.assertEqual([(m["log"], m["kind"], m["distance"]) for m in matches],
+                         [("b", "session", 0.2), ("a", "log", 0.4)])
+
+
+class TestSearchMany(TestCase):
+    def test_batched_search_matches_single_queries(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db = vector_db.SimpleVectorDB(Path(tmpdir) / "idx", Path(tmpdir) / "cases", index_type="flat")
+            empty_ids, _ = db.search_many(np.zeros((2, 4), dtype="float32"), k=2)
+            self.assertEqual(empty_ids.tolist(), [[-1, -1], [-1, -1]])
+
+            data = np.random.default_rng(1).random((50, 4), dtype="float32")
+            db.add(data, [{"n": i} for i in range(50)])
+            ids, dists = db.search_many(data[[3, 9, 27]], k=2)
+            self.assertEqual(ids.shape, (3, 2))
+            self.assertEqual(ids[:, 0].tolist(), [3, 9, 27])
+            single_ids, single_dists = db.search(data[9].tolist(), k=2)
+            self.assertEqual(single_ids, ids[1].tolist())
+            np.testing.assert_allclose(single_dists, dists[1])
@@ -0,0 +1,106 @@
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from lms_log_analyzer.src import wazuh_api
+from tests.mock_wazuh import MockWazuh, make_token
+
+ATTACK = "Jan  1 00:00:01 host sshd[1]: Failed password for root from 10.0.0.1 port 22"
+NORMAL = "Jan  1 00:00:02 host cron[2]: job finished"
+
+
+class WazuhClientTest(TestCase):
+    def setUp(self):
+        self.server = MockWazuh()
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__)
+
+    def _client(self, **kwargs):
+        client = wazuh_api.WazuhClient(self.server.url, "wazuh", "secret", **kwargs)
+        self.addCleanup(client.close)
+        return client
+
+    def test_batch_reuses_token_and_connections(self):
+        client = self._client(max_concurrency=4)
+        lines = [f"{ATTACK} #{i}" for i in range(10)] + [f"{NORMAL} #{i}" for i in range(10)]
+        self.assertEqual(client.logtest_many(lines), [True] * 10 + [False] * 10)
+        self.assertEqual(self.server.counts["authentications"], 1)
+        self.assertEqual(self.server.counts["logtests"], 20)
+        self.assertLessEqual(self.server.counts["connections"], 4 + 1)
+
+    def test_duplicates_and_repeats_are_served_from_cache(self):
+        client = self._client()
+        self.assertEqual(client.logtest_many([ATTACK, ATTACK.replace("  ", " "), NORMAL]), [True, True, False])
+        self.assertEqual(client.logtest_many([NORMAL, ATTACK]), [False, True])
+        self.assertEqual(self.server.counts["logtests"], 2)
+        self.assertEqual(client.stats()["cache_hits"], 2)
+
+    def test_cache_entries_expire(self):
+        client = self._client(cache_ttl=0.05)
+        client.logtest(ATTACK)
+        time.sleep(0.1)
+        client.logtest(ATTACK)
+        self.assertEqual(self.server.counts["logtests"], 2)
+
+    def test_rejected_token_is_refreshed_once(self):
+        client = self._client()
+        client.logtest(ATTACK)
+        self.server.revoke_tokens()
+        self.assertTrue(client.logtest(f"{ATTACK} again"))
+        self.assertEqual(self.server.counts["authentications"], 2)
+        self.assertEqual(self.server.counts["unauthorized"], 1)
+
+    def test_token_refreshed_before_expiry(self):
+        self.server.token_ttl = wazuh_api._TOKEN_REFRESH_MARGIN_SEC + 0.05
+        client = self._client()
+        client.logtest(ATTACK)
+        time.sleep(0.1)
+        client.logtest(NORMAL)
+        self.assertEqual(self.server.counts["authentications"], 2)
+        self.assertEqual(self.server.counts["unauthorized"], 0)
+
+    def test_concurrency_is_bounded(self):
+        self.server.latency = 0.05
+        active = 0
+        peak = 0
+        lock = threading.Lock()
+        client = self._client(max_concurrency=3)
+        original = client._request
+
+        def tracked(line):
+            nonlocal active, peak
+            with lock:
+                active += 1
+                peak = max(peak, active)
+            try:
+                return original(line)
+            finally:
+                with lock:
+                    active -= 1
+
+        with patch.object(client, "_request", side_effect=tracked):
+            client.logtest_many([f"{NORMAL} {i}" for i in range(12)])
+        self.assertEqual(peak, 3)
+
+    def test_failures_are_not_cached(self):
+        client = self._client()
+        with patch.object(client, "_request", side_effect=OSError("down")):
+            self.assertEqual(client.logtest_many([ATTACK]), [False])
+        self.assertTrue(client.logtest(ATTACK))
+        self.assertEqual(client.stats()["errors"], 1)
+
+
+class ResponseParsingTest(TestCase):
+    def test_has_alert_formats(self):
+        self.assertTrue(wazuh_api._has_alert({"data": {"alert": True}}))
+        self.assertFalse(wazuh_api._has_alert({"data": {"output": {"rule": {"level": 0}}}}))
+        self.assertTrue(wazuh_api._has_alert({"data": {"output": {"rule": {"level": 5}}}}))
+        self.assertTrue(wazuh_api._has_alert({"total_alerts": 2}))
+        self.assertTrue(wazuh_api._has_alert({"data": [{"rule": 1}]}))
+        self.assertFalse(wazuh_api._has_alert({}))
+
+    def test_token_expiry_from_jwt(self):
+        expires = wazuh_api._token_expiry(make_token(100), 5)
+        self.assertAlmostEqual(expires, time.time() + 100, delta=2)
+        self.assertAlmostEqual(wazuh_api._token_expiry("opaque", 5), time.time() + 5, delta=2)
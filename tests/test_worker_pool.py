@@ -0,0 +1,113 @@
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+import numpy as np
+
+from lms_log_analyzer import config
+from lms_log_analyzer.src import vector_db, worker_pool
+from lms_log_analyzer.src.log_parser import parse_record
+from lms_log_analyzer.src.rule_engine import RULE_ENGINE
+from lms_log_analyzer.src.utils import LRUCache
+
+LINES = [
+    '1.1.1.1 - - [01/Jan/2023:00:00:00 +0000] "GET /etc/passwd HTTP/1.1" 404 0 "-" "nmap"',
+    "Jan  1 00:00:01 host sshd[1]: Failed password for root from 10.0.0.1 port 22",
+    "normal log",
+    "kernel: disk error on sda",
+] * 5
+
+
+class CpuPoolTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = worker_pool.CpuPool(workers=2, cpus=[], min_shard=4)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+
+    def test_sharded_results_match_single_process(self):
+        np.testing.assert_array_equal(self.pool.filter_mask(LINES), RULE_ENGINE.filter_mask(LINES))
+        scores = self.pool.score_batch(LINES)
+        self.assertEqual(scores.dtype, np.float32)
+        np.testing.assert_array_equal(scores, RULE_ENGINE.score_batch(LINES))
+        records = self.pool.parse_records(LINES)
+        self.assertEqual([r.fields() for r in records], [parse_record(l).fields() for l in LINES])
+        self.assertEqual([r.raw for r in records], LINES)
+        self.assertGreaterEqual(self.pool.stats()["shards"], 6)
+
+    def test_small_batches_run_inline(self):
+        before = self.pool.stats()["inline"]
+        np.testing.assert_array_equal(self.pool.score_batch(LINES[:3]), RULE_ENGINE.score_batch(LINES[:3]))
+        self.assertEqual(self.pool.stats()["inline"], before + 1)
+        self.assertEqual(len(self.pool.score_batch([])), 0)
+
+    def test_encode_falls_back_to_local_model_for_small_batches(self):
+        class FakeModel:
+            def encode(self, texts, batch_size=32, convert_to_numpy=True):
+                return np.ones((len(texts), 2))
+
+        with patch.object(vector_db, "_EMBEDDER", FakeModel()):
+            vecs = self.pool.encode(["a", "b"])
+        self.assertEqual(vecs.shape, (2, 2))
+        self.assertEqual(vecs.dtype, np.float32)
+
+
+class WorkerSetupTest(TestCase):
+    def test_parse_cpu_list(self):
+        self.assertEqual(worker_pool.parse_cpu_list("0-2, 8"), [0, 1, 2, 8])
+        self.assertEqual(worker_pool.parse_cpu_list(""), [])
+
+    def test_shards_are_contiguous_and_cover_input(self):
+        pool = worker_pool.CpuPool(workers=3, cpus=[], min_shard=2)
+        shards = pool._shards(list(range(10)))
+        self.assertEqual(len(shards), 3)
+        self.assertEqual([x for shard in shards for x in shard], list(range(10)))
+        self.assertEqual(len(pool._shards(list(range(3)))), 1)
+
+    def test_default_file_batch_fans_out_to_all_workers(self):
+        pool = worker_pool.CpuPool(workers=8, cpus=[])
+        shards = pool._shards(list(range(config.FILE_BATCH_LINES)))
+        self.assertEqual(len(shards), 8)
+        self.assertEqual(sum(len(s) for s in shards), config.FILE_BATCH_LINES)
+
+    def test_parse_shard_returns_columns(self):
+        text, status, resp_time = worker_pool._parse_shard(LINES[:4])
+        self.assertEqual(text["ip"][0], "1.1.1.1")
+        self.assertNotIn("raw", text)
+        self.assertEqual(status.dtype, np.int32)
+        self.assertEqual(status[0], 404)
+        self.assertEqual(resp_time.shape, (4,))
+
+    def test_embed_many_uses_registered_encoder(self):
+        calls = []
+
+        def encoder(texts):
+            calls.append(texts)
+            return np.zeros((len(texts), 4), dtype="float32")
+
+        with patch.object(vector_db, "_EMBED_CACHE", LRUCache(10)):
+            vector_db.set_encoder(encoder)
+            try:
+                vecs = vector_db.embed_many(["x", "y", "x"])
+            finally:
+                vector_db.set_encoder(None)
+        self.assertEqual(vecs.shape, (3, 4))
+        self.assertEqual(calls, [["x", "y"]])
+
+    @patch.dict(os.environ, {})
+    @patch.object(os, "sched_setaffinity", create=True)
+    def test_workers_are_pinned_round_robin(self, setaffinity):
+        class Counter:
+            value = 0
+
+            def get_lock(self):
+                from contextlib import nullcontext
+
+                return nullcontext()
+
+        counter = Counter()
+        for _ in range(3):
+            worker_pool._init_worker(counter, [4, 5])
+        self.assertEqual([c.args[1] for c in setaffinity.call_args_list], [{4}, {5}, {4}])